@@ -0,0 +1,5 @@
+# Author: FL42
+
+"""
+Benchmarks of the monitor against local stand-in servers
+"""
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# Author: FL42
+
+"""
+usage: python -m benchmarks.run [-h] [--targets N [N ...]]
+                                [--probes PROBE [PROBE ...]]
+                                [--cycles CYCLES] [--latency LATENCY]
+                                [--failure-rate FAILURE_RATE]
+                                [--cert-lifetime CERT_LIFETIME]
+                                [--output OUTPUT] [--baseline BASELINE]
+                                [--threshold THRESHOLD]
+
+Drive ServicesMonitoring.monitor against local stand-in servers
+(see benchmarks.servers) with configs of increasing size and report, for
+each size, cycle time, throughput (probes per second), CPU time per cycle
+and memory (RSS) of the monitor process. Servers run in a child process so
+they are not accounted.
+
+Results are written as JSON (see run_benchmark) and may be compared to a
+previous run with --baseline: sizes whose mean cycle time grew by more than
+--threshold are reported as regressions (exit code 1).
+
+Note: failed probes are retried twice after 1 second (see
+ServicesMonitoring.monitor) so a failure rate above 0 mostly measures
+these delays.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+from time import perf_counter, process_time, time
+
+from benchmarks.servers import HOST, Behaviour, StandInServers
+from src.monitoring import ServicesMonitoring
+
+FORMAT_VERSION = 1
+PROBES = ('https', 'smtp', 'dns', 'raw_tcp')
+
+
+def serve(connection, latency, failure_rate, cert_lifetime):
+    """
+    Child process: start servers, send (ports, cert_path) and wait for
+    any message to stop (the exception is sent if servers can't start)
+    """
+    servers = StandInServers(Behaviour(latency, failure_rate, cert_lifetime))
+    try:
+        servers.start()
+    except Exception as server_exception:
+        connection.send(server_exception)
+        raise
+    connection.send((servers.ports, servers.cert_path))
+    connection.recv()
+    servers.shutdown()
+
+
+def build_config(size, probes, ports, failure_rate):
+    """
+    Return a config with size targets spread over probes
+    """
+    config_probes = {probe: [] for probe in probes}
+    # Raw TCP failures use a closed port (see benchmarks.servers)
+    fail_every = int(1 / failure_rate) if failure_rate > 0 else 0
+    for index in range(size):
+        probe = probes[index % len(probes)]
+        if probe == 'https':
+            service = {
+                'url': 'https://{}:{}/{}'.format(HOST, ports['https'], index)
+            }
+        elif probe == 'smtp':
+            service = {'host': HOST, 'port': ports['smtp']}
+        elif probe == 'dns':
+            service = {
+                'domain': 'target{}.benchmark.test'.format(index),
+                'ns_IPs': [HOST],
+                'ns_port': ports['dns']
+            }
+        else:
+            failing = fail_every and (index // len(probes)) % fail_every == 0
+            service = {
+                'host': HOST,
+                'port': ports['closed'] if failing else ports['raw_tcp']
+            }
+        config_probes[probe].append(service)
+    return {'common': {'delay': 0}, 'probes': config_probes}
+
+
+def rss_bytes():
+    """
+    Return the current resident memory of the process
+    (peak if /proc is not available)
+    """
+    try:
+        with open('/proc/self/statm', 'rt', encoding='utf-8') as statm_file:
+            return int(statm_file.read().split()[1]) \
+                * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def measure(config, cycles):
+    """
+    Run cycles monitor cycles of config
+
+    Return:
+    (dict) measures (see run_benchmark)
+    """
+    services_monitoring = ServicesMonitoring('benchmark')
+    services_monitoring.log.setLevel(logging.WARNING)
+    services_monitoring.config = config
+    size = sum(len(services) for services in config['probes'].values())
+
+    cycle_seconds = []
+    cpu_seconds = []
+    for _ in range(cycles):
+        start_time, start_cpu = perf_counter(), process_time()
+        services_monitoring.monitor(send_notification=False)
+        cycle_seconds.append(perf_counter() - start_time)
+        cpu_seconds.append(process_time() - start_cpu)
+
+    # The first cycle fills caches (certificates, TLS sessions)
+    steady = cycle_seconds[1:] or cycle_seconds
+    steady_cpu = cpu_seconds[1:] or cpu_seconds
+    mean_cycle = sum(steady) / len(steady)
+    return {
+        'targets': size,
+        'cycles': cycles,
+        'cycle_seconds': [round(value, 4) for value in cycle_seconds],
+        'first_cycle_seconds': round(cycle_seconds[0], 4),
+        'mean_cycle_seconds': round(mean_cycle, 4),
+        'throughput_probes_per_second': round(size / mean_cycle, 2),
+        'cpu_seconds_per_cycle': round(sum(steady_cpu) / len(steady_cpu), 4),
+        'rss_bytes': rss_bytes(),
+        'failed_targets': sum(
+            not success
+            for success, _, _ in services_monitoring.last_results.values()
+        )
+    }
+
+
+def git_commit():
+    """
+    Return the current git commit (None outside a git repository)
+    """
+    try:
+        return subprocess.run(
+            ('git', 'rev-parse', 'HEAD'),
+            capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes, probes=PROBES, cycles=3, latency=0, failure_rate=0,
+                  cert_lifetime=90 * 86400):
+    """
+    Run the benchmark for each size of sizes
+
+    Return:
+    (dict) format_version, timestamp, commit, python, platform,
+    parameters and results (one dict of measures per size)
+    """
+    parent_connection, child_connection = multiprocessing.Pipe()
+    server_process = multiprocessing.Process(
+        target=serve,
+        args=(child_connection, latency, failure_rate, cert_lifetime),
+        daemon=True
+    )
+    server_process.start()
+    try:
+        started = parent_connection.recv()
+        if isinstance(started, Exception):
+            raise started
+        ports, cert_path = started
+        # Trust the stand-in certificate (see https probe)
+        os.environ['REQUESTS_CA_BUNDLE'] = cert_path
+        results = []
+        for size in sizes:
+            results.append(measure(
+                build_config(size, list(probes), ports, failure_rate),
+                cycles
+            ))
+            logging.info("%s", json.dumps(results[-1]))
+    finally:
+        parent_connection.send('stop')
+        server_process.join(5)
+
+    return {
+        'format_version': FORMAT_VERSION,
+        'timestamp': time(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': {
+            'probes': list(probes),
+            'cycles': cycles,
+            'latency': latency,
+            'failure_rate': failure_rate,
+            'cert_lifetime': cert_lifetime
+        },
+        'results': results
+    }
+
+
+def compare(report, baseline, threshold):
+    """
+    Return the lines comparing report to baseline and the number of
+    regressions (mean cycle time grown by more than threshold)
+    """
+    lines = []
+    regressions = 0
+    baseline_results = {
+        result['targets']: result for result in baseline['results']
+    }
+    for result in report['results']:
+        previous = baseline_results.get(result['targets'])
+        if previous is None:
+            continue
+        change = result['mean_cycle_seconds'] \
+            / previous['mean_cycle_seconds'] - 1
+        regression = change > threshold
+        regressions += regression
+        lines.append(
+            "{:>6} targets: {:.4f}s -> {:.4f}s per cycle ({:+.1%}){}".format(
+                result['targets'],
+                previous['mean_cycle_seconds'],
+                result['mean_cycle_seconds'],
+                change,
+                " REGRESSION" if regression else ""
+            )
+        )
+    return lines, regressions
+
+
+def main():
+    """
+    See module docstring
+    """
+    parser = argparse.ArgumentParser(
+        description="Services Monitoring benchmark"
+    )
+    parser.add_argument('--targets', type=int, nargs='+', metavar='N',
+                        default=[10, 100, 1000],
+                        help="Config sizes (default to 10 100 1000)")
+    parser.add_argument('--probes', nargs='+', metavar='PROBE',
+                        choices=PROBES, default=list(PROBES),
+                        help="Probe types (default to all but ping)")
+    parser.add_argument('--cycles', type=int, default=3,
+                        help="Cycles per size (default to 3)")
+    parser.add_argument('--latency', type=float, default=0,
+                        help="Latency of servers in seconds (default to 0)")
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help="Ratio of failed requests (default to 0)")
+    parser.add_argument('--cert-lifetime', type=int, default=90 * 86400,
+                        help="Lifetime of certificates in seconds "
+                             "(default to 90 days)")
+    parser.add_argument('--output', default='benchmark.json',
+                        help="Result file (default to benchmark.json)")
+    parser.add_argument('--baseline',
+                        help="Result file of a previous run to compare to")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Regression threshold of the mean cycle time "
+                             "(default to 0.1, i.e. 10%%)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    report = run_benchmark(
+        args.targets,
+        args.probes,
+        args.cycles,
+        args.latency,
+        args.failure_rate,
+        args.cert_lifetime
+    )
+    with open(args.output, 'wt', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2)
+    print("Results written to {}".format(args.output))
+
+    if args.baseline:
+        with open(args.baseline, 'rt', encoding='utf-8') as baseline_file:
+            lines, regressions = compare(
+                report, json.load(baseline_file), args.threshold
+            )
+        print("\n".join(lines))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
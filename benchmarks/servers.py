@@ -0,0 +1,384 @@
+# Author: FL42
+
+"""
+Local stand-in servers for every probe type
+
+All servers listen on 127.0.0.1 (random ports) and share the same
+behaviour options:
+    latency: (float) seconds to wait before answering
+    failure_rate: (float) ratio of requests answered with an error
+                  (HTTP 500, SMTP 554 greeting, DNS SERVFAIL)
+    cert_lifetime: (int) lifetime in seconds of the self-signed certificate
+                   of HTTPS and SMTP STARTTLS (CN and SAN are 127.0.0.1)
+
+The raw TCP server accepts and closes connections (the handshake is done
+by the kernel so latency and failures can't be simulated: failing TCP
+targets use a closed port instead, see benchmarks.run).
+"""
+
+import datetime
+import ipaddress
+import os
+import random
+import socket
+import socketserver
+import ssl
+import struct
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+HOST = '127.0.0.1'
+
+
+class Behaviour:
+    """
+    Behaviour options shared by servers (see module docstring)
+    """
+
+    def __init__(self, latency=0, failure_rate=0, cert_lifetime=90 * 86400):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.cert_lifetime = cert_lifetime
+
+    def wait(self):
+        """
+        Simulate latency
+        """
+        if self.latency > 0:
+            sleep(self.latency)
+
+    def fail(self):
+        """
+        Return True if the request must fail
+        """
+        return random.random() < self.failure_rate
+
+
+def make_tls_context(lifetime, directory):
+    """
+    Return (server ssl.SSLContext, path of the certificate in PEM) using a
+    self-signed certificate for 127.0.0.1 valid for lifetime seconds
+    """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, HOST)])
+    now = datetime.datetime.utcnow()
+    alt_name = x509.SubjectAlternativeName(
+        [x509.IPAddress(ipaddress.ip_address(HOST))]
+    )
+    cert = x509.CertificateBuilder() \
+        .subject_name(name) \
+        .issuer_name(name) \
+        .public_key(key.public_key()) \
+        .serial_number(x509.random_serial_number()) \
+        .not_valid_before(now) \
+        .not_valid_after(now + datetime.timedelta(seconds=lifetime)) \
+        .add_extension(alt_name, critical=False) \
+        .sign(key, hashes.SHA256())
+
+    cert_path = os.path.join(directory, 'cert.pem')
+    key_path = os.path.join(directory, 'key.pem')
+    with open(cert_path, 'wb') as cert_file:
+        cert_file.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as key_file:
+        key_file.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption()
+        ))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    return context, cert_path
+
+
+class HTTPHandler(BaseHTTPRequestHandler):
+    """
+    Answer 200 to every GET (500 on simulated failure)
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment (no Nagle / delayed ACK stall)
+    disable_nagle_algorithm = True
+    wbufsize = 64 * 1024
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Handle GET requests
+        """
+        behaviour = self.server.behaviour
+        behaviour.wait()
+        status_code = 500 if behaviour.fail() else 200
+        body = b'services-monitoring benchmark\n'
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Minimal SMTP server with STARTTLS
+    """
+
+    disable_nagle_algorithm = True
+
+    def _reply(self, line):
+        self.wfile.write("{}\r\n".format(line).encode('ascii'))
+        self.wfile.flush()
+
+    def handle(self):
+        behaviour = self.server.behaviour
+        behaviour.wait()
+        if behaviour.fail():
+            self._reply('554 Service unavailable')
+            return
+        self._reply('220 {} ESMTP'.format(HOST))
+        tls = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self._reply('250-{}'.format(HOST))
+                if not tls:
+                    self._reply('250-STARTTLS')
+                self._reply('250 8BITMIME')
+            elif command == 'STARTTLS':
+                self._reply('220 Ready to start TLS')
+                self.request = self.server.tls_context.wrap_socket(
+                    self.request, server_side=True
+                )
+                self.rfile = self.request.makefile('rb')
+                self.wfile = self.request.makefile('wb')
+                tls = True
+            elif command == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:
+                self._reply('250 OK')
+
+
+class DNSServer:
+    """
+    Authoritative stand-in answering A (127.0.0.1) and SOA (serial 1)
+    queries for any domain, over UDP and TCP on the same port
+    """
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp_socket.bind((HOST, 0))
+        self.port = self.tcp_socket.getsockname()[1]
+        self.tcp_socket.listen(128)
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.bind((HOST, self.port))
+        self.exit_event = threading.Event()
+
+    def answer(self, wire):
+        """
+        Return the response (wire format) to the query wire
+        """
+        query = dns.message.from_wire(wire)
+        response = dns.message.make_response(query)
+        self.behaviour.wait()
+        if self.behaviour.fail():
+            response.set_rcode(dns.rcode.SERVFAIL)
+            return response.to_wire()
+        question = query.question[0]
+        if question.rdtype == dns.rdatatype.A:
+            response.answer.append(dns.rrset.from_text(
+                question.name, 300, 'IN', 'A', HOST
+            ))
+        elif question.rdtype == dns.rdatatype.SOA:
+            response.answer.append(dns.rrset.from_text(
+                question.name, 300, 'IN', 'SOA',
+                'ns.{0} hostmaster.{0} 1 3600 600 86400 300'.format(
+                    question.name
+                )
+            ))
+        return response.to_wire()
+
+    def serve_udp(self):
+        """
+        UDP loop
+        """
+        while not self.exit_event.is_set():
+            try:
+                wire, address = self.udp_socket.recvfrom(65535)
+            except OSError:
+                return
+            threading.Thread(
+                target=lambda wire=wire, address=address:
+                self.udp_socket.sendto(self.answer(wire), address),
+                daemon=True
+            ).start()
+
+    def serve_tcp_connection(self, connection):
+        """
+        Answer queries of a TCP connection (2 bytes length prefix)
+        """
+        with connection:
+            stream = connection.makefile('rb')
+            while True:
+                prefix = stream.read(2)
+                if len(prefix) < 2:
+                    return
+                wire = stream.read(struct.unpack('!H', prefix)[0])
+                response = self.answer(wire)
+                connection.sendall(struct.pack('!H', len(response)) + response)
+
+    def serve_tcp(self):
+        """
+        TCP loop
+        """
+        while not self.exit_event.is_set():
+            try:
+                connection, _ = self.tcp_socket.accept()
+            except OSError:
+                return
+            threading.Thread(
+                target=self.serve_tcp_connection,
+                args=(connection,),
+                daemon=True
+            ).start()
+
+    def start(self):
+        """
+        Start serving in threads
+        """
+        threading.Thread(target=self.serve_udp, daemon=True).start()
+        threading.Thread(target=self.serve_tcp, daemon=True).start()
+
+    def shutdown(self):
+        """
+        Stop serving
+        """
+        self.exit_event.set()
+        self.udp_socket.close()
+        self.tcp_socket.close()
+
+
+class TCPServer(socketserver.ThreadingTCPServer):
+    """
+    Threading TCP server with a larger backlog
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, behaviour,
+                 tls_context=None):
+        self.behaviour = behaviour
+        self.tls_context = tls_context  # STARTTLS (see SMTPHandler)
+        socketserver.ThreadingTCPServer.__init__(
+            self, server_address, handler_class
+        )
+
+
+class HTTPServer(ThreadingHTTPServer):
+    """
+    Threading HTTP server with a larger backlog
+    """
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, behaviour):
+        self.behaviour = behaviour
+        ThreadingHTTPServer.__init__(self, server_address, handler_class)
+
+
+class TCPHandler(socketserver.BaseRequestHandler):
+    """
+    Accept and close
+    """
+
+    def handle(self):
+        pass
+
+
+def _serve(server):
+    """
+    Serve server forever in a daemon thread
+    """
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def closed_port():
+    """
+    Return a local port where nothing is listening
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe_socket:
+        probe_socket.bind((HOST, 0))
+        return probe_socket.getsockname()[1]
+
+
+class StandInServers:
+    """
+    All stand-in servers (see module docstring)
+
+    Attributes (after start):
+    ports: (dict) probe type -> port (http, https, smtp, dns, raw_tcp and
+           closed for a port without listener)
+    cert_path: (str) certificate in PEM (CA bundle of HTTPS clients)
+    """
+
+    def __init__(self, behaviour):
+        self.behaviour = behaviour
+        self.directory = tempfile.mkdtemp(prefix='benchmark-')
+        self.servers = []
+        self.ports = {}
+        self.cert_path = None
+
+    def start(self):
+        """
+        Start all servers
+        """
+        tls_context, self.cert_path = make_tls_context(
+            self.behaviour.cert_lifetime, self.directory
+        )
+
+        http_server = HTTPServer((HOST, 0), HTTPHandler, self.behaviour)
+        https_server = HTTPServer((HOST, 0), HTTPHandler, self.behaviour)
+        # Handshake in the handler thread (not in the accept loop)
+        https_server.socket = tls_context.wrap_socket(
+            https_server.socket,
+            server_side=True,
+            do_handshake_on_connect=False
+        )
+        smtp_server = TCPServer((HOST, 0), SMTPHandler, self.behaviour,
+                                tls_context)
+        tcp_server = TCPServer((HOST, 0), TCPHandler, self.behaviour)
+        dns_server = DNSServer(self.behaviour)
+
+        for name, server in (('http', http_server),
+                             ('https', https_server),
+                             ('smtp', smtp_server),
+                             ('raw_tcp', tcp_server)):
+            self.ports[name] = server.server_address[1]
+            self.servers.append(server)
+            _serve(server)
+        dns_server.start()
+        self.ports['dns'] = dns_server.port
+        self.ports['closed'] = closed_port()
+        self.servers.append(dns_server)
+
+    def shutdown(self):
+        """
+        Stop all servers
+        """
+        for server in self.servers:
+            server.shutdown()
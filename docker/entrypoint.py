@@ -9,8 +9,10 @@ from os.path import isdir, isfile, join
 from sys import exit as sys_exit
 from time import sleep
 
-from prometheus_client import Counter, Gauge, start_http_server
 from src.monitoring import ServicesMonitoring
+from src.notification import digest, dispatcher, webhook
+from src.tools import history, http_server, offload, profiling, sharding
+from src.tools.on_demand import OnDemandProber
 
 config_directory = '/config'
 
@@ -40,12 +42,17 @@ def exit_gracefully(sigcode, _frame):
     log.info("Exiting gracefully now...")
     for key in threads:
         threads[key].exit_event.set()
+    digest.shutdown()
+    dispatcher.shutdown()
+    webhook.shutdown()
+    offload.shutdown()
     sys_exit(0)
 
 
 # Handle signals
 signal.signal(signal.SIGINT, exit_gracefully)
 signal.signal(signal.SIGTERM, exit_gracefully)  # issued by docker stop
+profiling.install_signal_handler()  # SIGUSR1: profile for 30 seconds
 
 
 # Check for config dir
@@ -53,8 +60,19 @@ if not isdir(config_directory):
     log.fatal("No config found")
     sys_exit(2)
 
-# Start web server for prometheus metrics
-start_http_server(8000)
+# Start web server for prometheus metrics (/metrics),
+# on-demand probes (/probe?module=...&target=...)
+# history of results (/history?probe=...&target=...&window=...)
+# profiling (/profile?seconds=... or /profile?cycles=...)
+# and targets owned by this instance (/shard)
+http_server.register(
+    '/probe',
+    OnDemandProber(ServicesMonitoring.probe_mapping).handle
+)
+http_server.register('/history', history.handle)
+http_server.register('/profile', profiling.handle)
+http_server.register('/shard', sharding.handle)
+http_server.start(8000)
 
 # Create threads
 threads = {}  # key is path to config file, value is Thread object
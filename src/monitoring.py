@@ -2,43 +2,52 @@
 # Authors: alex2242 & FL42
 
 """
-usage: monitoring.py [-h] [-c CONFIG]
+usage: monitoring.py [-h] [-c CONFIG] [--inventory] [--format {jsonl,csv}]
+                     [--output OUTPUT] [--concurrency CONCURRENCY]
 
 Services Monitoring
 
 optional arguments:
   -h, --help            show this help message and exit
   -c CONFIG, --config CONFIG
-                        Path to config file
+                        Path to config file (may be repeated with
+                        --inventory)
+  --inventory           Write the certificate inventory of all TLS endpoints
+                        of the config files and exit
+  --format {jsonl,csv}  Format of the inventory (default to jsonl)
+  --output OUTPUT       Inventory file (default to stdout)
+  --concurrency CONCURRENCY
+                        Maximum number of concurrent TLS connections during
+                        inventory (default to 32)
 """
 import argparse
+import itertools
 import logging
 import signal
+import sys
 import threading
+import uuid
 from sys import exit as sys_exit
 from time import sleep, time
 
 import yaml
-from prometheus_client import Counter, Gauge
 
-from src.notification import email
+from src.notification import digest, dispatcher, webhook
 from src.probes import dns, https, ping, raw_tcp, smtp
-from src.tools import Message
+from src.sinks.pipeline import ResultPipeline, make_record
+from src.tools import (AlertState, Message, engine_metrics, history,
+                       inventory, metrics, offload, profiling,
+                       sharding)
+from src.tools.discovery import Discovery
+from src.tools.flapping import FlapDetector
+from src.tools.spec import (ConfigError, compile_probes, count_targets,
+                            iter_specs)
+from src.tools.state_store import StateStore
+from src.tools.vantage import VantageAggregator
 
 version = "0.1"
 
 
-probe_success_total = Counter(
-    "probe_success_total", "Number of successful probes", ("probe", "target")
-)
-probe_failures_total = Counter(
-    "probe_failures_total", "Number of failed probes", ("probe", "target")
-)
-probe_duration = Gauge(
-    "probe_duration", "Duration of the probe", ("probe", "target")
-)
-
-
 class ServicesMonitoring(threading.Thread):
     """
     See module docstring.
@@ -92,8 +101,21 @@ class ServicesMonitoring(threading.Thread):
         self.config = None
         self.watchdog = time()
         # Store sent messages (prevent duplicate notifications)
-        self.down_services = []
+        # key is Message.key, value is AlertState object
+        self.down_services = {}
+        # key is (probe, target), value is (success, duration, timestamp)
+        self.last_results = {}
         self.exit_event = threading.Event()
+        self.dispatcher = None
+        self.state_store = None
+        self.history = None
+        self.pipeline = None
+        self.discovery = None
+        self.shard = None
+        self.aggregator = None
+        # compiled probes (see run() and src.tools.spec.compile_probes)
+        self.specs = None
+        self.flap_detector = FlapDetector()
 
     def run(self):
         """
@@ -113,6 +135,17 @@ class ServicesMonitoring(threading.Thread):
             else logging.INFO
         )
 
+        # Validate config and compile probes (all errors are reported)
+        self.compile_config()
+
+        # Set up optional components configured
+        self.start_components()
+
+        # Restore state saved before restart
+        state_file = self.config['common'].get('state_file')
+        if state_file is not None:
+            self.restore_state(state_file)
+
         # Wait for a delay at startup if configured
         delay_at_startup = self.config['common'].get('delay_at_startup', 0)
         if delay_at_startup > 0:
@@ -124,25 +157,142 @@ class ServicesMonitoring(threading.Thread):
 
         # Disable notifications if section is not defined
         send_notification = 'notifications' in self.config
+        if send_notification:
+            self.dispatcher = dispatcher.get_dispatcher(
+                self.config['notifications'].get('queue')
+            )
 
         # Send a test message
         if send_notification \
+           and 'email' in self.config['notifications'] \
            and self.config['common'].get('email_at_startup', False):
 
-            email.send_email(
+            self.dispatcher.enqueue(
                 subject="Services-monitoring started",
                 body="This is a message sent at startup",
                 smtp_config=self.config['notifications']['email']['config']
             )
 
-        # Call self.monitor every 'delay' sec
+        # Call self.monitor every 'delay' sec (fixed rate, see CycleTimer)
+        engine_metrics.register_thread(self)
+        cycle_timer = engine_metrics.CycleTimer(
+            self.config_path,
+            self.config['common']['delay']
+        )
         while not self.exit_event.is_set():
+            cycle_timer.start(time())
             self.monitor(send_notification=send_notification)
+            wait_time = cycle_timer.end(time())
             self.log.debug("Waiting...")
-            self.exit_event.wait(self.config['common']['delay'])
+            self.exit_event.wait(wait_time)
             self.watchdog = time()
+        self.stop_components()
         self.log.info("Exited")
 
+    def compile_config(self):
+        """
+        Validate config and compile probes (see src.tools.spec)
+
+        Raise ConfigError with all errors of the config
+        """
+        errors = []
+        try:
+            self.specs = compile_probes(
+                self.config.get('probes', {}),
+                ServicesMonitoring.probe_mapping
+            )
+        except ConfigError as config_error:
+            errors.extend(config_error.errors)
+        # Webhooks are started at first notification: check them now
+        notifications_config = self.config.get('notifications', {})
+        for webhook_config in notifications_config.get('webhook', []):
+            errors.extend(webhook.validate(webhook_config))
+        if errors:
+            for error in errors:
+                self.log.error("Invalid config: %s", error)
+            raise ConfigError(errors)
+        self.log.info(
+            "%d targets to monitor (%d expanded from generators)",
+            count_targets(self.specs),
+            count_targets(
+                [item for item in self.specs if not isinstance(item, tuple)]
+            )
+        )
+
+    def start_components(self):
+        """
+        Set up metrics, alerting and the optional components configured
+        (stopped by stop_components)
+        """
+
+        # Set up probe metrics (histogram buckets, cardinality limit)
+        metrics.configure(self.config['common'])
+
+        # Set up alert damping and flap detection
+        self.flap_detector = FlapDetector(
+            **self.config['common'].get('alerting', {})
+        )
+
+        # Offload CPU-bound stages to a process pool if configured
+        if 'process_pool' in self.config['common']:
+            offload.configure(self.config['common']['process_pool'])
+
+        # Only probe targets of this instance if sharded
+        self.shard = sharding.get_shard(
+            self.config['common'].get('sharding')
+        )
+
+        # Keep history of results if configured
+        if 'history' in self.config['common']:
+            self.history = history.get_store(self.config['common']['history'])
+
+        # Stream results to sinks if configured
+        if 'results' in self.config:
+            self.pipeline = ResultPipeline.from_config(self.config['results'])
+            self.pipeline.start()
+
+        # Aggregate results of vantage agents if configured
+        if 'aggregator' in self.config:
+            self.aggregator = VantageAggregator(**self.config['aggregator'])
+            self.aggregator.start()
+
+        # Discover services if configured (see src.tools.discovery)
+        if 'discovery' in self.config:
+            self.discovery = Discovery.from_config(
+                self.config['discovery'],
+                ServicesMonitoring.probe_mapping
+            )
+            self.discovery.start()
+
+    def stop_components(self):
+        """
+        Stop the components started by start_components
+        """
+        if self.state_store is not None:
+            self.state_store.close()
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        if self.discovery is not None:
+            self.discovery.stop()
+        if self.aggregator is not None:
+            self.aggregator.shutdown()
+
+    def restore_state(self, state_file):
+        """
+        Restore alerts and results saved before restart
+        (see src.tools.state_store)
+        """
+        self.state_store = StateStore(state_file, self.config_path)
+        self.down_services = self.state_store.load_alerts()
+        self.last_results = self.state_store.load_results()
+        metrics.restore(self.last_results)
+        self.flap_detector.restore(self.down_services)
+        self.log.info(
+            "State restored: %d alerts, %d results",
+            len(self.down_services),
+            len(self.last_results)
+        )
+
     def watchdog_is_alive(self):
         """
         Return False if the thread has died
@@ -161,74 +311,62 @@ class ServicesMonitoring(threading.Thread):
         # Set up a list of notifications to send
         notifications = []
 
-        # Probe configured services
-        config_probes = self.config['probes']
-        probe_names = config_probes.keys()
+        # Identify records of this cycle (see src.sinks)
+        cycle_id = uuid.uuid4().hex
 
-        for probe_name in probe_names:
-            probe_module = ServicesMonitoring.probe_mapping[probe_name]["module"]
-            target_type = ServicesMonitoring.probe_mapping[probe_name]["target_type"]
-            for service in config_probes[probe_name]:
-                self.log.debug("%s probe for %s", probe_name, str(service))
+        owned = []  # targets of this instance if sharded
 
-                # Target refers to the target of the probe (the host, the url, etc)
-                if target_type:
-                    target = service.get(target_type)
-                else:
-                    target = service
-
-                # Retry probe 2 times in case of error or warning
-                # to avoid notification on one-time error.
-                for _ in range(3):
-                    try:  # Catch unexpected exception
-                        start_time = time()
-                        probes_results = probe_module.test(service)
-                        if not probes_results:
-                            probe_duration.labels(
-                                probe=probe_name,
-                                target=target
-                            ).set(time() - start_time)
-                    except Exception as probe_exception:
-                        self.log.exception(
-                            "Exception %s in thread %s",
-                            str(probe_exception),
-                            self.config_path
-                        )
-                        probes_results = [
-                            Message(
-                                probe_name,
-                                "Exception: {}".format(probe_exception),
-                                Message.ERROR
-                            )
-                        ]
-
-                    if not probes_results:
-                        probe_success_total.labels(
-                            probe=probe_name,
-                            target=target
-                        ).inc()
-                        break
-
-                    self.log.info(
-                        "%s probe for %s returns %s",
-                        probe_name,
-                        str(service),
-                        str(probes_results)
-                    )
-                    sleep(1)
+        for probe_name, probe_module, service in self.cycle_specs():
 
-                if probes_results:
-                    probe_failures_total.labels(
-                        probe=probe_name,
-                        target=target
-                    ).inc()
+            # Target refers to the target of the probe (the host, the url, etc)
+            target = service.target
 
-                notifications += probes_results
+            # Skip targets of other instances (see src.tools.sharding)
+            if not self.owns(probe_name, target):
+                continue
+            owned.append((probe_name, target))
+            self.log.debug("%s probe for %s", probe_name, target)
+
+            probes_results, durations = self.probe(
+                probe_name, probe_module, service
+            )
+            self.record(probe_name, target, probes_results, durations,
+                        cycle_id)
+
+            # Apply alert damping and flap detection
+            notifications += self.flap_detector.update(
+                probe_name,
+                target,
+                probes_results
+            )
+
+        if self.shard is not None:
+            self.shard.publish(self.config_path, owned)
+
+        # Results of vantage agents (quorum applied, see src.tools.vantage)
+        if self.aggregator is not None:
+            notifications += self.aggregated_notifications()
 
         # Sort notifications by severity
         notifications.sort(key=lambda x: x.severity, reverse=True)
 
         # Log notifications messages
+        self.log_notifications(notifications)
+
+        # Send notifications
+        if send_notification:
+            self.send_notification(notifications=notifications)
+
+        # Save state (see self.run)
+        if self.state_store is not None:
+            self.state_store.save(self.down_services, self.last_results)
+
+        profiling.profiler.cycle_done()
+
+    def log_notifications(self, notifications):
+        """
+        Log notifications messages (list of Message objects)
+        """
         if notifications:
             for message in notifications:
                 if message.severity == Message.WARNING:
@@ -240,14 +378,170 @@ class ServicesMonitoring(threading.Thread):
         else:
             self.log.info("All services are up")
 
-        # Send notifications
-        if send_notification:
-            self.send_notification(notifications=notifications)
+    def cycle_specs(self):
+        """
+        Return an iterable of (probe name, probe module, spec) of the
+        services to probe in this cycle
+        """
+
+        # Probe configured services (compiled once, see src.tools.spec)
+        if self.specs is None:
+            self.specs = compile_probes(
+                self.config['probes'],
+                ServicesMonitoring.probe_mapping
+            )
+
+        # Generated services are expanded lazily (see src.tools.expansion)
+        specs = iter_specs(self.specs)
+
+        # Add discovered services, forget removed ones (state of other
+        # services is kept, see src.tools.discovery)
+        if self.discovery is not None:
+            for probe_name, target in self.discovery.removed_targets():
+                self.forget_target(probe_name, target, "service removed")
+            specs = itertools.chain(specs, self.discovery.specs)
+        return specs
+
+    def owns(self, probe_name, target):
+        """
+        Return True if target is probed by this instance (see
+        src.tools.sharding), the state of targets of other instances is
+        dropped
+        """
+        if self.shard is None or self.shard.owns(probe_name, target):
+            return True
+        if (probe_name, target) in self.last_results:
+            self.forget_target(probe_name, target, "not owned")
+        return False
+
+    def probe(self, probe_name, probe_module, service):
+        """
+        Run a probe, retried 2 times in case of error or warning to avoid
+        notification on one-time error
+
+        Return:
+        (tuple) results of the last attempt (list of Message objects) and
+        durations of attempts (list of float)
+        """
+        durations = []
+        for attempt in range(3):
+            start_time = time()
+            try:  # Catch unexpected exception
+                with engine_metrics.probes_in_flight.labels(
+                        probe=probe_name).track_inprogress(), \
+                        profiling.profiler.probe(probe_name):
+                    probes_results = probe_module.test(service)
+            except Exception as probe_exception:
+                self.log.exception(
+                    "Exception %s in thread %s",
+                    str(probe_exception),
+                    self.config_path
+                )
+                probes_results = [
+                    Message(
+                        probe_name,
+                        "Exception: {}".format(probe_exception),
+                        Message.ERROR
+                    )
+                ]
+            durations.append(time() - start_time)
+
+            if not probes_results:
+                break
+
+            self.log.info(
+                "%s probe for %s returns %s",
+                probe_name,
+                service.target,
+                str(probes_results)
+            )
+            if attempt < 2:
+                sleep(1)
+        return probes_results, durations
+
+    def record(self, probe_name, target, probes_results, durations,
+               cycle_id):
+        """
+        Record the result of a probe: metrics, last results, history and
+        result sinks
+        """
+        metrics.observe(
+            probe_name,
+            target,
+            not probes_results,
+            durations
+        )
+        self.last_results[(probe_name, target)] = (
+            not probes_results,
+            durations[-1],
+            time()
+        )
+        if self.history is not None:
+            self.history.append(
+                probe_name,
+                target,
+                time(),
+                not probes_results,
+                durations[-1]
+            )
+        if self.pipeline is not None:
+            self.pipeline.emit(make_record(
+                probe_name,
+                target,
+                not probes_results,
+                durations[-1],
+                probes_results,
+                timestamp=time(),
+                config=self.config_path,
+                cycle_id=cycle_id,
+                attempts=len(durations)
+            ))
+
+    def aggregated_notifications(self):
+        """
+        Return notifications of the results of vantage agents
+        (see src.tools.vantage)
+        """
+        notifications = []
+        for probe_name, target, probes_results, latency \
+                in self.aggregator.evaluate():
+            self.last_results[(probe_name, target)] = (
+                not probes_results,
+                latency,
+                time()
+            )
+            notifications += self.flap_detector.update(
+                probe_name,
+                target,
+                probes_results
+            )
+        return notifications
+
+    def forget_target(self, probe_name, target, reason):
+        """
+        Drop the state of a target no longer probed by this instance
+        (removed by discovery or owned by another shard): it is not back
+        online, so its alerts are dropped without notification
+
+        Parameters:
+        probe_name: (str) name of the probe
+        target: (str) target of the probe
+        reason: (str) logged with the dropped alerts
+        """
+        self.last_results.pop((probe_name, target), None)
+        self.flap_detector.forget(probe_name, target)
+        service = "[{}] {}".format(probe_name, target)
+        for key, alert in list(self.down_services.items()):
+            if alert.message.service == service:
+                del self.down_services[key]
+                self.log.info("[%s] %s", reason, str(alert.message))
 
     def manage_notifications(self, notifications):
         """
         This method reorganizes notifications: don't send notification
         already sent and add notification for services back online.
+        Sent notifications are indexed by Message.key in self.down_services
+        so this is linear in the number of notifications.
 
         Parameters:
         notifications: (list of Message object) notifications from self.monitor
@@ -257,16 +551,26 @@ class ServicesMonitoring(threading.Thread):
         """
 
         notifications_to_send = []
+        current_keys = set()
+        now = time()
 
         # Check if notification was already sent
         for message in notifications:
-            if message not in self.down_services:
+            key = message.key
+            if key in current_keys:
+                continue
+            current_keys.add(key)
+            alert = self.down_services.get(key)
+            if alert is None:
                 notifications_to_send.append(message)
-                self.down_services.append(message)
+                self.down_services[key] = AlertState(message, now)
+            else:
+                alert.last_seen = now
 
         # Add notification for services which are back online
-        for sent_message in list(self.down_services):
-            if sent_message not in notifications:
+        for key, alert in list(self.down_services.items()):
+            sent_message = alert.message
+            if key not in current_keys:
                 notifications_to_send.append(
                     Message(
                         sent_message.service,
@@ -275,7 +579,7 @@ class ServicesMonitoring(threading.Thread):
                         header='back online'
                     )
                 )
-                self.down_services.remove(sent_message)
+                del self.down_services[key]
                 self.log.info("[service online] %s", str(sent_message))
             else:
                 self.log.warning("[service down] %s", str(sent_message))
@@ -286,34 +590,63 @@ class ServicesMonitoring(threading.Thread):
         """
         This method is called only if send_notification is True
         and notifications is not empty.
-        It will send notifications after calling self.manage_notifications.
+        It will queue notifications after calling self.manage_notifications
+        for each configured channel (email and webhooks).
+        Delivery is done asynchronously (see src.notification).
         """
 
         # Reorganize notifications (see self.manage_notifications)
         notifications_to_send = self.manage_notifications(notifications)
 
-        if notifications_to_send:
+        if not notifications_to_send:
+            self.log.debug("notifications_to_send is empty")
+            return
 
-            # Build message body
-            message_body = ""
+        if 'email' in self.config['notifications']:
+            self.send_email_notification(notifications_to_send)
 
-            for message in notifications_to_send:
-                message_body += "{}\n---\n".format(message)
+        for webhook_config in self.config['notifications'].get('webhook', []):
+            webhook.get_notifier(webhook_config).enqueue(notifications_to_send)
+            self.log.info("Notification queued for webhook")
 
-            # Send the email
-            mail_sent = email.send_email(
-                subject="Monitoring alert!",
-                body=message_body,
-                smtp_config=self.config['notifications']['email']['config']
+    def send_email_notification(self, notifications_to_send):
+        """
+        Queue notifications_to_send (list of Message objects) by email,
+        as one email or in a digest (see src.notification.digest)
+        """
+
+        email_config = self.config['notifications']['email']
+        aggregation = email_config.get('aggregation', {})
+
+        if aggregation.get('window', 0) > 0:
+
+            # Merge into the digest of the recipient
+            digest.get_aggregator(self.dispatcher.enqueue).add(
+                notifications_to_send,
+                email_config['config'],
+                aggregation['window'],
+                aggregation.get('error_max_delay')
             )
+            self.log.info("Notification added to digest")
+            return
 
-            if mail_sent:
-                self.log.info("Notification mail sent")
-            else:
-                self.log.error("Fail to send notification mail")
+        # Build message body
+        message_body = ""
+
+        for message in notifications_to_send:
+            message_body += "{}\n---\n".format(message)
+
+        # Queue the email
+        mail_queued = self.dispatcher.enqueue(
+            subject="Monitoring alert!",
+            body=message_body,
+            smtp_config=email_config['config']
+        )
 
+        if mail_queued:
+            self.log.info("Notification mail queued")
         else:
-            self.log.debug("notifications_to_send is empty")
+            self.log.error("Fail to queue notification mail")
 
 
 if __name__ == '__main__':
@@ -322,10 +655,58 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Services Monitoring")
     parser.add_argument(
         '-c', '--config',
-        help="Path to config file"
+        action='append',
+        help="Path to config file (may be repeated with --inventory)"
+    )
+    parser.add_argument(
+        '--inventory',
+        action='store_true',
+        help="Write the certificate inventory of all TLS endpoints "
+             "of the config files and exit"
+    )
+    parser.add_argument(
+        '--format',
+        choices=('jsonl', 'csv'),
+        default='jsonl',
+        help="Format of the inventory (default to jsonl)"
+    )
+    parser.add_argument(
+        '--output',
+        help="Inventory file (default to stdout)"
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=32,
+        help="Maximum number of concurrent TLS connections during inventory "
+             "(default to 32)"
     )
     args = parser.parse_args()
 
+    if not args.config:
+        parser.error("a config file is required")
+
+    # Certificate inventory mode
+    if args.inventory:
+        configs = []
+        for path in args.config:
+            with open(path, 'rt', encoding='utf-8') as stream:
+                configs.append(yaml.safe_load(stream))
+        records = inventory.scan(
+            inventory.collect_endpoints(configs),
+            concurrency=args.concurrency
+        )
+        if args.output:
+            with open(args.output, 'wt', newline='',
+                      encoding='utf-8') as output_file:
+                inventory.write_inventory(records, output_file, args.format)
+        else:
+            inventory.write_inventory(records, sys.stdout, args.format)
+        sys_exit(0)
+
+    if len(args.config) > 1:
+        parser.error("only one config file is allowed without --inventory")
+
     # Print version at startup
     print("Services Monitoring V{}".format(version))
 
@@ -337,13 +718,18 @@ if __name__ == '__main__':
         services_monitoring.log.info("Signal %d received", sigcode)
         services_monitoring.log.info("Exiting gracefully now...")
         services_monitoring.exit_event.set()
+        digest.shutdown()
+        dispatcher.shutdown()
+        webhook.shutdown()
+        offload.shutdown()
         sys_exit(0)
     signal.signal(signal.SIGINT, exit_gracefully)
     signal.signal(signal.SIGTERM, exit_gracefully)
+    profiling.install_signal_handler()
 
     # Start Imap2Smtp thread
     services_monitoring = ServicesMonitoring(
-        config_path=args.config
+        config_path=args.config[0]
     )
     services_monitoring.start()
 
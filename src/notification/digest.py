@@ -0,0 +1,199 @@
+# Author: FL42
+
+"""
+Aggregation of notifications into digests
+
+Messages from every config thread and cycle are merged into one digest per
+recipient during an aggregation window. A digest containing an ERROR is
+sent at most error_max_delay seconds after the first ERROR was added.
+Messages are grouped by severity and service in the digest body.
+
+Options (notifications/email/aggregation section of the config):
+    window: (float) aggregation window in seconds (default to 0: disabled)
+    error_max_delay: (float) maximum delay in seconds of ERROR messages
+                     (default to window)
+"""
+
+import logging
+import threading
+from time import monotonic
+
+from src.tools import Message
+
+log = logging.getLogger(__name__)
+
+SEVERITY_NAMES = {
+    Message.ERROR: 'ERROR',
+    Message.WARNING: 'WARNING',
+    Message.INFO: 'INFO'
+}
+
+
+def recipient_key(smtp_config):
+    """
+    Return the key identifying the recipient (and the server used) of
+    smtp_config
+    """
+    return (
+        smtp_config['recipient_address'],
+        smtp_config['host'],
+        smtp_config.get('port', 587),
+        smtp_config.get('user', None)
+    )
+
+
+def format_digest(messages):
+    """
+    Return the body of the digest of messages
+    (grouped by severity and service)
+    """
+
+    groups = {}
+    for message in messages:
+        groups.setdefault(message.severity, {}) \
+              .setdefault(message.service, []) \
+              .append(message)
+
+    body = ""
+    for severity in sorted(groups, reverse=True):
+        body += "== {} ==\n".format(SEVERITY_NAMES.get(severity, severity))
+        for service in sorted(groups[severity]):
+            body += "{}\n".format(service)
+            for message in groups[severity][service]:
+                body += "  - {}{}\n".format(
+                    "[{}] ".format(message.header)
+                    if message.header is not None else "",
+                    message.body
+                )
+        body += "\n"
+    return body
+
+
+class Digest:
+    """
+    Messages waiting to be sent to a recipient
+    """
+
+    __slots__ = ('smtp_config', 'messages', 'deadline')
+
+    def __init__(self, smtp_config, deadline):
+        self.smtp_config = smtp_config
+        self.messages = []
+        self.deadline = deadline
+
+
+class DigestAggregator(threading.Thread):
+    """
+    Thread sending digests when their deadline is reached
+    """
+
+    def __init__(self, deliver_function):
+        """
+        deliver_function is called as
+        deliver_function(subject, body, smtp_config)
+        """
+        threading.Thread.__init__(self, name='notification-digest')
+        self.daemon = True
+        self.deliver_function = deliver_function
+        self.digests = {}  # recipient key -> Digest
+        self.condition = threading.Condition()
+        self.exit_event = threading.Event()
+
+    def add(self, messages, smtp_config, window, error_max_delay=None):
+        """
+        Add messages (list of Message objects) to the digest of the
+        recipient of smtp_config
+        """
+
+        if error_max_delay is None:
+            error_max_delay = window
+        now = monotonic()
+        key = recipient_key(smtp_config)
+
+        with self.condition:
+            digest = self.digests.get(key)
+            if digest is None:
+                digest = Digest(smtp_config, now + window)
+                self.digests[key] = digest
+            digest.messages += messages
+            if any(message.severity >= Message.ERROR for message in messages):
+                digest.deadline = min(digest.deadline, now + error_max_delay)
+            self.condition.notify()
+
+    def run(self):
+        """
+        Run method (see threading module)
+        """
+        while not self.exit_event.is_set():
+            with self.condition:
+                timeout = 1
+                if self.digests:
+                    timeout = min(
+                        timeout,
+                        min(digest.deadline
+                            for digest in self.digests.values())
+                        - monotonic()
+                    )
+                if timeout > 0:
+                    self.condition.wait(timeout)
+            self.flush()
+
+    def flush(self, force=False):
+        """
+        Send digests whose deadline is reached (all digests if force)
+        """
+
+        now = monotonic()
+        with self.condition:
+            keys = [
+                key for key, digest in self.digests.items()
+                if force or digest.deadline <= now
+            ]
+            digests = [self.digests.pop(key) for key in keys]
+
+        for digest in digests:
+            log.info(
+                "Sending digest of %d messages to %s",
+                len(digest.messages),
+                digest.smtp_config['recipient_address']
+            )
+            self.deliver_function(
+                "Monitoring alert!",
+                format_digest(digest.messages),
+                digest.smtp_config
+            )
+
+    def stop(self):
+        """
+        Stop the thread and send pending digests
+        """
+        self.exit_event.set()
+        self.flush(force=True)
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+def get_aggregator(deliver_function):
+    """
+    Return the aggregator shared by all config threads
+    (started at first call)
+    """
+
+    global _aggregator  # pylint: disable=global-statement
+
+    with _aggregator_lock:
+        if _aggregator is None:
+            _aggregator = DigestAggregator(deliver_function)
+            _aggregator.start()
+    return _aggregator
+
+
+def shutdown():
+    """
+    Stop the shared aggregator if started
+    """
+    with _aggregator_lock:
+        if _aggregator is not None:
+            _aggregator.stop()
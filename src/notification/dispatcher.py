@@ -0,0 +1,317 @@
+# Author: FL42
+
+"""
+Asynchronous delivery of notifications
+
+Notifications are pushed onto a bounded queue and sent by a dedicated
+thread, so probing never waits on alert delivery. Failed deliveries are
+retried with exponential backoff. If a spool directory is configured,
+notifications which can't be queued or delivered are written to it and
+delivered again later (including after a restart).
+
+Options (notifications/queue section of the config):
+    max_size: (int) size of the queue (default to 100)
+    max_retries: (int) delivery attempts before giving up (default to 5)
+    backoff: (float) delay in seconds before the first retry, doubled at
+             each retry (default to 5)
+    max_backoff: (float) maximum delay between two retries (default to 300)
+    spool_directory: (str) directory used to spool undelivered
+                     notifications (default to None: no spool)
+    spool_interval: (float) seconds between two reloads of the spool
+                    (default to 300)
+"""
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+from time import monotonic, time
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from src.notification import email
+
+log = logging.getLogger(__name__)
+
+notification_queue_depth = Gauge(
+    "notification_queue_depth", "Number of notifications waiting in queue"
+)
+notification_send_duration = Histogram(
+    "notification_send_duration_seconds",
+    "Duration of notification delivery attempts"
+)
+notification_dropped_total = Counter(
+    "notification_dropped_total",
+    "Number of notifications dropped",
+    ("reason",)
+)
+
+
+class Job:
+    """
+    Notification waiting for delivery
+    """
+
+    __slots__ = ('subject', 'body', 'smtp_config', 'attempts', 'spool_path')
+
+    def __init__(self, subject, body, smtp_config, spool_path=None):
+        self.subject = subject
+        self.body = body
+        self.smtp_config = smtp_config
+        self.attempts = 0
+        self.spool_path = spool_path
+
+
+class NotificationDispatcher(threading.Thread):
+    """
+    Thread delivering queued notifications
+    """
+
+    def __init__(self, max_size=100, max_retries=5, backoff=5,
+                 max_backoff=300, spool_directory=None, spool_interval=300,
+                 send_function=email.send_email):
+        """
+        See module docstring for options
+        send_function is called as send_function(subject, body, smtp_config)
+        and must return True on success
+        """
+
+        threading.Thread.__init__(self, name='notification-dispatcher')
+        self.daemon = True
+        self.options = {
+            'max_size': max_size,
+            'max_retries': max_retries,
+            'backoff': backoff,
+            'max_backoff': max_backoff,
+            'spool_directory': spool_directory,
+            'spool_interval': spool_interval
+        }
+        self.send_function = send_function
+        self.queue = queue.Queue(maxsize=max_size)
+        self.retries = []  # heap of (due time, sequence, Job)
+        self.sequence = itertools.count()
+        self.exit_event = threading.Event()
+        notification_queue_depth.set_function(
+            lambda: self.queue.qsize() + len(self.retries)
+        )
+
+        if spool_directory is not None:
+            os.makedirs(spool_directory, exist_ok=True)
+
+    def enqueue(self, subject, body, smtp_config):
+        """
+        Queue a notification (never blocks)
+
+        Return:
+        (bool) notification was queued or spooled
+        """
+        return self._put(Job(subject, body, smtp_config))
+
+    def _put(self, job):
+        """
+        Queue job or spool it if the queue is full
+        """
+        try:
+            self.queue.put_nowait(job)
+            return True
+        except queue.Full:
+            log.error("Notification queue is full")
+            return self._spool(job, 'queue_full')
+
+    def run(self):
+        """
+        Run method (see threading module)
+        """
+
+        next_spool_reload = monotonic()
+        while not self.exit_event.is_set():
+
+            if self.options['spool_directory'] is not None \
+               and monotonic() >= next_spool_reload:
+                self._reload_spool()
+                next_spool_reload = \
+                    monotonic() + self.options['spool_interval']
+
+            # Retries which are due
+            if self.retries and self.retries[0][0] <= monotonic():
+                self._deliver(heapq.heappop(self.retries)[2])
+                continue
+
+            timeout = 1
+            if self.retries:
+                timeout = min(timeout, self.retries[0][0] - monotonic())
+            try:
+                job = self.queue.get(timeout=max(timeout, 0))
+            except queue.Empty:
+                email.pool.close_idle()
+                continue
+            self._deliver(job)
+
+    def _deliver(self, job):
+        """
+        Try to deliver job and schedule a retry on failure
+        """
+
+        job.attempts += 1
+        start_time = monotonic()
+        try:
+            sent = self.send_function(job.subject, job.body, job.smtp_config)
+        except Exception as send_exception:
+            log.exception(send_exception)
+            sent = False
+        notification_send_duration.observe(monotonic() - start_time)
+
+        if sent:
+            log.info("Notification sent")
+            if job.spool_path is not None:
+                os.remove(job.spool_path)
+            return
+
+        if job.attempts >= self.options['max_retries']:
+            log.error(
+                "Failed to send notification after %d attempts",
+                job.attempts
+            )
+            if job.spool_path is None:
+                self._spool(job, 'retries_exhausted')
+            return
+
+        delay = min(
+            self.options['backoff'] * 2 ** (job.attempts - 1),
+            self.options['max_backoff']
+        )
+        log.warning("Failed to send notification, retrying in %ds", delay)
+        heapq.heappush(
+            self.retries,
+            (monotonic() + delay, next(self.sequence), job)
+        )
+
+    def _spool(self, job, reason):
+        """
+        Write job to the spool directory or drop it if there is no spool
+
+        Return:
+        (bool) job was spooled
+        """
+
+        if self.options['spool_directory'] is None:
+            notification_dropped_total.labels(reason=reason).inc()
+            log.error("Notification dropped (%s)", reason)
+            return False
+
+        spool_path = os.path.join(
+            self.options['spool_directory'],
+            "{:.6f}-{}.json".format(time(), next(self.sequence))
+        )
+        try:
+            # smtp_config may contain credentials
+            spool_fd = os.open(
+                spool_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600
+            )
+            with os.fdopen(spool_fd, 'wt', encoding='utf-8') as spool_file:
+                json.dump({
+                    'subject': job.subject,
+                    'body': job.body,
+                    'smtp_config': job.smtp_config
+                }, spool_file)
+        except (OSError, TypeError, ValueError) as spool_exception:
+            # e.g. disk full or read-only spool: never raise in enqueue()
+            try:
+                os.remove(spool_path)
+            except OSError:
+                pass  # not created
+            notification_dropped_total.labels(reason=reason).inc()
+            log.error("Notification dropped (%s), spool failed: %s",
+                      reason, spool_exception)
+            return False
+        job.spool_path = spool_path
+        log.info("Notification spooled to %s", job.spool_path)
+        return True
+
+    def _reload_spool(self):
+        """
+        Queue spooled notifications again
+        """
+
+        queued = {job.spool_path for job in list(self.queue.queue)}
+        queued |= {job.spool_path for _, _, job in self.retries}
+
+        for file_name in sorted(os.listdir(self.options['spool_directory'])):
+            spool_path = os.path.join(
+                self.options['spool_directory'],
+                file_name
+            )
+            if not file_name.endswith('.json') or spool_path in queued:
+                continue
+            try:
+                with open(spool_path, 'rt', encoding='utf-8') as spool_file:
+                    content = json.load(spool_file)
+            except (OSError, ValueError) as spool_exception:
+                log.error("Invalid spool file %s: %s", spool_path,
+                          spool_exception)
+                continue
+            try:
+                self.queue.put_nowait(Job(
+                    content['subject'],
+                    content['body'],
+                    content['smtp_config'],
+                    spool_path=spool_path
+                ))
+            except queue.Full:
+                return
+
+    def stop(self):
+        """
+        Stop the thread and spool notifications not yet delivered
+        """
+        self.exit_event.set()
+        pending = [job for _, _, job in self.retries]
+        while True:
+            try:
+                pending.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for job in pending:
+            if job.spool_path is None:
+                self._spool(job, 'shutdown')
+        email.pool.close_all()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher(options=None):
+    """
+    Return the dispatcher shared by all config threads
+    (started at first call with the given options)
+    """
+
+    global _dispatcher  # pylint: disable=global-statement
+
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher(**(options or {}))
+            _dispatcher.start()
+        elif options and any(
+                _dispatcher.options[key] != value
+                for key, value in options.items()):
+            log.warning(
+                "Notification queue already started with options %s: "
+                "options %s ignored",
+                _dispatcher.options,
+                options
+            )
+    return _dispatcher
+
+
+def shutdown():
+    """
+    Stop the shared dispatcher if started
+    """
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            _dispatcher.stop()
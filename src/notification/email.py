@@ -3,6 +3,11 @@
 """
 Send an email
 
+Connections to SMTP servers are kept open (after STARTTLS and login) and
+shared by all senders using the same server and credentials, so many
+messages are sent in one session. Connections are checked with NOOP after
+being idle, opened again on demand and closed after max_idle seconds.
+
 Parameters:
     subject: (str) subject of the email
     body: (str) body of the email
@@ -14,19 +19,186 @@ Parameters:
         password: (str or None) smtp password (or None)
         recipient_address: (str) recipient address
         sender_address: (str) sender address
+        timeout: (int) timeout in seconds of SMTP commands (default to 30)
 
 Return:
     (bool) message was sent
 """
 
 import logging
+import threading
 from email.mime.text import MIMEText
 from email.utils import formatdate
-from smtplib import SMTP, SMTPResponseException
+from smtplib import SMTP, SMTPException, SMTPServerDisconnected
+from time import monotonic
 
 log = logging.getLogger(__name__)
 
 
+class SMTPSession:
+    """
+    Persistent authenticated connection to a SMTP server
+    """
+
+    def __init__(self, smtp_config):
+        self.smtp_config = smtp_config
+        self.smtp_fd = None
+        self.last_used = 0
+        self.lock = threading.Lock()
+
+    def connect(self):
+        """
+        Open the connection, run STARTTLS and login
+        """
+
+        smtp_config = self.smtp_config
+        self.smtp_fd = SMTP(
+            host=smtp_config['host'],
+            port=smtp_config.get('port', 587),
+            timeout=smtp_config.get('timeout', 30)
+        )
+        log.debug("Connexion opened to %s", smtp_config['host'])
+
+        try:
+            if smtp_config.get('starttls', True):
+                self.smtp_fd.starttls()
+                log.debug("STARTTLS has succeeded")
+            else:
+                log.debug("SMTP is in PLAIN (no STARTTLS)")
+
+            smtp_user = smtp_config.get('user', None)
+            smtp_password = smtp_config.get('password', None)
+            if smtp_user is not None and smtp_password is not None:
+                self.smtp_fd.login(smtp_user, smtp_password)
+                log.debug("SMTP login has succeeded")
+            else:
+                log.debug("No login given for SMTP")
+        except (SMTPException, OSError):
+            self.close()
+            raise
+
+        self.last_used = monotonic()
+
+    def is_alive(self, noop_after):
+        """
+        Return True if the connection is open
+        (checked with NOOP if idle for more than noop_after seconds)
+        """
+        if self.smtp_fd is None:
+            return False
+        if monotonic() - self.last_used < noop_after:
+            return True
+        try:
+            return self.smtp_fd.noop()[0] == 250
+        except (SMTPException, OSError):
+            return False
+
+    def send(self, msg):
+        """
+        Send msg (email.message.Message object)
+        """
+        self.smtp_fd.send_message(msg)
+        self.last_used = monotonic()
+        log.debug("Message sent")
+
+    def close(self):
+        """
+        Close the connection
+        """
+        if self.smtp_fd is None:
+            return
+        try:
+            self.smtp_fd.quit()
+        except (SMTPException, OSError):
+            self.smtp_fd.close()
+        self.smtp_fd = None
+        log.debug("Connexion closed to %s", self.smtp_config['host'])
+
+
+class SMTPPool:
+    """
+    SMTP sessions indexed by server and credentials
+    """
+
+    def __init__(self, max_idle=300, noop_after=30):
+        """
+        Parameters:
+        max_idle: (int) close connections idle for more than max_idle seconds
+        noop_after: (int) check connections idle for more than noop_after
+                    seconds before using them
+        """
+        self.max_idle = max_idle
+        self.noop_after = noop_after
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(smtp_config):
+        return (
+            smtp_config['host'],
+            smtp_config.get('port', 587),
+            smtp_config.get('starttls', True),
+            smtp_config.get('user', None),
+            smtp_config.get('password', None)
+        )
+
+    def send(self, msg, smtp_config):
+        """
+        Send msg using a (new or open) session matching smtp_config
+        Raise SMTPException or OSError on failure
+        """
+
+        key = self._key(smtp_config)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = SMTPSession(smtp_config)
+                self._sessions[key] = session
+
+        with session.lock:
+            if not session.is_alive(self.noop_after):
+                session.close()
+                session.connect()
+            try:
+                session.send(msg)
+            except (SMTPServerDisconnected, ConnectionError):
+                # Connection closed by server: try again with a new one
+                log.debug("Connexion lost to %s", smtp_config['host'])
+                session.close()
+                session.connect()
+                session.send(msg)
+
+    def close_idle(self):
+        """
+        Close sessions idle for more than max_idle seconds
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        for session in sessions:
+            if session.smtp_fd is not None \
+               and monotonic() - session.last_used > self.max_idle \
+               and session.lock.acquire(blocking=False):
+                try:
+                    session.close()
+                finally:
+                    session.lock.release()
+
+    def close_all(self):
+        """
+        Close all sessions
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            with session.lock:
+                session.close()
+
+
+# Pool shared by all senders
+pool = SMTPPool()
+
+
 def send_email(subject, body, smtp_config):
     """
     See module docstring
@@ -39,32 +211,8 @@ def send_email(subject, body, smtp_config):
     msg['Date'] = formatdate(localtime=True)
 
     try:
-        smtp_fd = SMTP(
-            host=smtp_config['host'],
-            port=smtp_config.get('port', 587)
-        )
-        log.debug("Connexion opened to %s", smtp_config['host'])
-
-        if smtp_config.get('starttls', True):
-            smtp_fd.starttls()
-            log.debug("STARTTLS has succeeded")
-        else:
-            log.debug("SMTP is in PLAIN (no STARTTLS)")
-
-        smtp_user = smtp_config.get('user', None)
-        smtp_password = smtp_config.get('password', None)
-        if smtp_user is not None and smtp_password is not None:
-            smtp_fd.login(smtp_user, smtp_password)
-            log.debug("SMTP login has succeeded")
-        else:
-            log.debug("No login given for SMTP")
-
-        smtp_fd.send_message(msg)
-        log.debug("Message sent")
-
-        smtp_fd.quit()
-
-    except (SMTPResponseException, OSError) as smtp_exception:
+        pool.send(msg, smtp_config)
+    except (SMTPException, OSError) as smtp_exception:
         log.exception(smtp_exception)
         return False
     return True
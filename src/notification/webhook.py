@@ -0,0 +1,380 @@
+# Author: FL42
+
+"""
+Send notifications to webhooks (chat and incident tools)
+
+Each endpoint has its own delivery thread: messages are queued (the probe
+thread never waits), batched, and posted over a pooled HTTP session while
+honoring the rate limit of the endpoint. Failed requests are retried with
+exponential backoff (Retry-After is honored on 429).
+
+Options (each item of the notifications/webhook section of the config):
+    url: (str) url of the webhook
+    format: (str) payload format: json (default), slack or matrix
+    headers: (dict) additional HTTP headers
+    batch_size: (int) maximum number of messages per request (default to 20)
+    batch_interval: (float) seconds to wait for more messages before
+                    posting a batch (default to 5)
+    rate_limit: (float) maximum number of requests per second
+                (default to 1)
+    max_retries: (int) attempts before dropping a batch (default to 5)
+    backoff: (float) delay in seconds before the first retry, doubled at
+             each retry (default to 2)
+    timeout: (float) timeout in seconds of requests (default to 10)
+    max_queue_size: (int) maximum number of messages waiting for delivery,
+                    the oldest ones are dropped when full (default to 1000)
+
+Webhook settings are validated at startup (see validate()).
+"""
+
+import logging
+import queue
+import threading
+from time import monotonic
+from urllib.parse import urlparse
+
+import requests
+from prometheus_client import Counter
+from requests.adapters import HTTPAdapter
+
+from src.tools import Message
+
+log = logging.getLogger(__name__)
+
+webhook_sent_total = Counter(
+    "webhook_sent_total", "Number of messages sent to webhooks", ("endpoint",)
+)
+webhook_dropped_total = Counter(
+    "webhook_dropped_total", "Number of messages dropped", ("endpoint",)
+)
+
+SEVERITY_NAMES = {
+    Message.ERROR: 'ERROR',
+    Message.WARNING: 'WARNING',
+    Message.INFO: 'INFO'
+}
+
+
+def format_json(messages):
+    """
+    Generic JSON payload
+    """
+    return {
+        'messages': [
+            {
+                'service': message.service,
+                'body': message.body,
+                'severity': SEVERITY_NAMES.get(message.severity,
+                                               message.severity),
+                'header': message.header
+            }
+            for message in messages
+        ]
+    }
+
+
+def _text(messages):
+    """
+    Plain text of messages (one line per message)
+    """
+    return "\n".join(
+        "{}: {}".format(
+            SEVERITY_NAMES.get(message.severity, message.severity),
+            message
+        )
+        for message in messages
+    )
+
+
+def format_slack(messages):
+    """
+    Slack (and compatible, e.g. Mattermost) incoming webhook payload
+    """
+    return {'text': "Monitoring alert!\n{}".format(_text(messages))}
+
+
+def format_matrix(messages):
+    """
+    Matrix m.text event payload
+    """
+    return {
+        'msgtype': 'm.text',
+        'body': "Monitoring alert!\n{}".format(_text(messages))
+    }
+
+
+FORMATS = {
+    'json': format_json,
+    'slack': format_slack,
+    'matrix': format_matrix
+}
+
+
+POSITIVE_INTEGERS = ('batch_size', 'max_retries', 'max_queue_size')
+POSITIVE_NUMBERS = ('rate_limit', 'timeout')
+NON_NEGATIVE_NUMBERS = ('batch_interval', 'backoff')
+OPTIONS = ('url', 'format', 'headers') + POSITIVE_INTEGERS \
+    + POSITIVE_NUMBERS + NON_NEGATIVE_NUMBERS
+
+
+def _is_valid(option, value):
+    """
+    Return True if value is a valid value of option
+    """
+    is_number = isinstance(value, (int, float)) \
+        and not isinstance(value, bool)
+    if option == 'url':
+        valid = isinstance(value, str)
+    elif option == 'format':
+        valid = isinstance(value, str) and value in FORMATS
+    elif option == 'headers':
+        valid = isinstance(value, dict)
+    elif option in POSITIVE_INTEGERS:
+        valid = isinstance(value, int) and is_number and value > 0
+    elif option in POSITIVE_NUMBERS:
+        valid = is_number and value > 0
+    else:
+        valid = is_number and value >= 0
+    return valid
+
+
+def _expected(option):
+    """
+    Return the description of valid values of option
+    """
+    if option == 'format':
+        return "one of {}".format(", ".join(sorted(FORMATS)))
+    if option in POSITIVE_INTEGERS:
+        return "a positive integer"
+    if option in POSITIVE_NUMBERS:
+        return "a positive number"
+    if option in NON_NEGATIVE_NUMBERS:
+        return "a number >= 0"
+    return {'url': "a string", 'headers': "a mapping"}[option]
+
+
+def validate(webhook_config):
+    """
+    Check settings of a webhook
+
+    Parameters:
+    webhook_config: (dict) item of the notifications/webhook section
+
+    Return:
+    (list of str) errors found (empty if valid)
+    """
+    if not isinstance(webhook_config, dict):
+        return ["notifications/webhook: items must be mappings"]
+    errors = []
+    if 'url' not in webhook_config:
+        errors.append("url is required")
+    for option, value in sorted(webhook_config.items()):
+        if option not in OPTIONS:
+            errors.append("unknown option {}".format(option))
+        elif not _is_valid(option, value):
+            errors.append("{} must be {} (got {!r})".format(
+                option, _expected(option), value
+            ))
+    return ["notifications/webhook: {}".format(error) for error in errors]
+
+
+def notifier_key(webhook_config):
+    """
+    Return the key of the notifier of webhook_config: configs with the same
+    url, format and headers share a notifier (and its rate limit)
+    """
+    return (
+        webhook_config['url'],
+        webhook_config.get('format', 'json'),
+        tuple(sorted(webhook_config.get('headers', {}).items()))
+    )
+
+
+class WebhookNotifier(threading.Thread):
+    """
+    Delivery thread of one webhook endpoint
+    """
+
+    def __init__(self, url, **options):
+        """
+        See module docstring for options
+        """
+        threading.Thread.__init__(self, name='webhook-{}'.format(
+            urlparse(url).netloc
+        ))
+        self.daemon = True
+        self.url = url
+        self.endpoint = urlparse(url).netloc  # url may contain secrets
+        self.format_function = FORMATS[options.get('format', 'json')]
+        self.headers = options.get('headers', {})
+        self.batch_size = options.get('batch_size', 20)
+        self.batch_interval = options.get('batch_interval', 5)
+        self.min_interval = 1 / options.get('rate_limit', 1)
+        self.max_retries = options.get('max_retries', 5)
+        self.backoff = options.get('backoff', 2)
+        self.timeout = options.get('timeout', 10)
+
+        self.queue = queue.Queue(maxsize=options.get('max_queue_size', 1000))
+        self.exit_event = threading.Event()
+        self.last_request = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def enqueue(self, messages):
+        """
+        Queue messages (list of Message objects), never blocks
+
+        The oldest messages are dropped if the queue is full
+        """
+        for message in messages:
+            while True:
+                try:
+                    self.queue.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    log.warning("Queue of %s is full, dropping oldest message",
+                                self.endpoint)
+                    webhook_dropped_total.labels(endpoint=self.endpoint).inc()
+
+    def run(self):
+        """
+        Run method (see threading module)
+        """
+        while not self.exit_event.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._post(batch)
+
+        # Stopped: post messages still queued (one attempt per batch)
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            self._post(batch)
+
+    def _next_batch(self):
+        """
+        Return up to batch_size messages, waiting at most batch_interval
+        after the first one (the wait is interrupted on exit)
+        """
+        try:
+            batch = [self.queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = monotonic() + self.batch_interval
+        while len(batch) < self.batch_size \
+                and not self.exit_event.is_set():
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=min(remaining, 0.1)))
+            except queue.Empty:
+                pass
+        return batch
+
+    def _wait(self, delay):
+        """
+        Wait for delay seconds (interrupted on exit)
+        """
+        if delay > 0:
+            self.exit_event.wait(delay)
+
+    def _post(self, batch):
+        """
+        Post batch with retries
+        """
+
+        payload = self.format_function(batch)
+        delay = self.backoff
+        for attempt in range(1, self.max_retries + 1):
+
+            # Rate limit
+            self._wait(self.last_request + self.min_interval - monotonic())
+            self.last_request = monotonic()
+
+            retry_after = None
+            try:
+                response = self.session.post(
+                    self.url,
+                    json=payload,
+                    headers=self.headers,
+                    timeout=self.timeout
+                )
+                if response.ok:
+                    webhook_sent_total.labels(endpoint=self.endpoint) \
+                        .inc(len(batch))
+                    log.info("%d messages sent to %s", len(batch),
+                             self.endpoint)
+                    return
+                log.warning(
+                    "Webhook %s returned status code %d",
+                    self.endpoint,
+                    response.status_code
+                )
+                if response.status_code == 429:
+                    retry_after = response.headers.get('Retry-After')
+            except requests.exceptions.RequestException as request_exception:
+                log.warning("Webhook %s failed: %s", self.endpoint,
+                            request_exception)
+
+            # No retry once stopped (see stop)
+            if attempt == self.max_retries or self.exit_event.is_set():
+                break
+            try:
+                self._wait(float(retry_after))
+            except (TypeError, ValueError):
+                self._wait(delay)
+            delay *= 2
+
+        log.error("Dropping %d messages for %s", len(batch), self.endpoint)
+        webhook_dropped_total.labels(endpoint=self.endpoint).inc(len(batch))
+
+    def stop(self):
+        """
+        Stop the thread and wait until messages still queued are posted
+        (one attempt per batch, see run)
+        """
+        self.exit_event.set()
+        if self.is_alive():
+            batches = self.queue.qsize() // self.batch_size + 2
+            self.join(batches * self.timeout)
+
+
+_notifiers = {}
+_notifiers_lock = threading.Lock()
+
+
+def get_notifier(webhook_config):
+    """
+    Return the notifier of webhook_config (shared by all config threads
+    with the same key, see notifier_key, and started at first call)
+    """
+    key = notifier_key(webhook_config)
+    with _notifiers_lock:
+        notifier = _notifiers.get(key)
+        if notifier is None:
+            notifier = WebhookNotifier(**webhook_config)
+            notifier.start()
+            _notifiers[key] = notifier
+    return notifier
+
+
+def shutdown():
+    """
+    Stop all notifiers (queued messages are posted)
+    """
+    with _notifiers_lock:
+        for notifier in _notifiers.values():
+            notifier.stop()
@@ -3,13 +3,22 @@
 """
 This probe tries to resolv the given domain using all domain's nameservers.
 
+All nameservers are queried in parallel. For each nameserver, the A record
+is resolved in UDP and TCP mode and the SOA record is fetched in the same
+round to detect nameservers whose serials disagree (replication lag).
+
 Parameters:
-    service: (dict)
+    service: (dict or Spec object)
         domain: (str) domain to check
         ns_IPs: (list of str) IPs of nameservers to check
                 If not given all NS servers will be checked.
         dnssec: (bool) Check DNSSEC resolution (default to False)
                 Local resolver needs to handle DO bit (aka DNSSEC compatible)
+        check_soa: (bool) Check that SOA serials are consistent across
+                   nameservers (default to True)
+        timeout: (int) timeout in seconds of each query (default to 5)
+        ns_port: (int) port of nameservers (default to 53)
+        check_tlsa: ignored (accepted for compatibility with old configs)
 
 Return:
     List of Message objects
@@ -17,12 +26,30 @@ Return:
 """
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+from typing import Optional, Tuple
+
 import dns.resolver
+from prometheus_client import Gauge, Histogram
+
 from src.tools import Message
+from src.tools.spec import NUMBER, Option, ProbeSpec, freeze
 
 log = logging.getLogger(__name__)
 
 
+dns_query_duration = Histogram(
+    "dns_query_duration_seconds",
+    "Duration of DNS queries per nameserver and transport",
+    ("domain", "nameserver", "transport")
+)
+dns_soa_serial = Gauge(
+    "dns_soa_serial", "SOA serial returned by the nameserver",
+    ("domain", "nameserver")
+)
+
+
 def get_ns_servers(domain):
     """
     Helper function used to get all NS servers of a domain.
@@ -43,57 +70,172 @@ def get_ns_servers(domain):
     return ns_ips
 
 
-def test(service):
-    """
-    See module docstring
+def _query(domain, ns_ip, request, transport, timeout, port=53):
     """
+    Send request to ns_ip using the given transport and record its latency.
 
-    domain = service['domain']
-    ns_ips = service.get('ns_IPs', None)
-    dnssec = service.get('dnssec', False)
-    service_name = "[dns] {}".format(domain)
+    Return:
+    (dns.message.Message) response
+    """
+    query_function = dns.query.udp if transport == 'udp' else dns.query.tcp
+    start_time = time()
+    try:
+        response = query_function(request, ns_ip, timeout=timeout, port=port)
+    finally:
+        dns_query_duration.labels(
+            domain=domain,
+            nameserver=ns_ip,
+            transport=transport
+        ).observe(time() - start_time)
+    if response.rcode() != 0:
+        raise Exception('rcode is not 0')
+    return response
+
+
+def _check_nameserver(service_name, domain, ns_ip, dnssec, check_soa, timeout,
+                      port=53):
+    """
+    Run all queries against one nameserver.
 
-    # Auto-discover NS servers if not given
-    if ns_ips is None:
-        ns_ips = get_ns_servers(domain)
+    Return:
+    (tuple) (list of Message objects, SOA serial or None)
+    """
 
     results = []
 
-    for ns_ip in ns_ips:
-
-        # request object
-        request = dns.message.make_query(domain, dns.rdatatype.A)
-        if dnssec:
-            request.flags |= dns.flags.AD
+    # request object
+    request = dns.message.make_query(domain, dns.rdatatype.A)
+    if dnssec:
+        request.flags |= dns.flags.AD
 
-        # UDP mode
+    for transport in ('udp', 'tcp'):
         try:
-            response = dns.query.udp(request, ns_ip)
-            if response.rcode() != 0:
-                raise Exception('rcode is not 0')
+            _query(domain, ns_ip, request, transport, timeout, port)
         except Exception as resolver_exception:
             results.append(
                 Message(
                     service_name,
-                    "Failed to resolv in UDP mode for ns {}: {}"
-                    .format(ns_ip, resolver_exception),
+                    "Failed to resolv in {} mode for ns {}: {}"
+                    .format(transport.upper(), ns_ip, resolver_exception),
                     Message.ERROR
                 )
             )
 
-        # TCP mode
-        try:
-            response = dns.query.tcp(request, ns_ip)
-            if response.rcode() != 0:
-                raise Exception('rcode is not 0')
-        except Exception as resolver_exception:
-            results.append(
-                Message(
-                    service_name,
-                    "Failed to resolv in TCP mode for ns {}: {}"
-                    .format(ns_ip, resolver_exception),
-                    Message.ERROR
+    serial = _soa_serial(domain, ns_ip, timeout, port) if check_soa else None
+
+    return results, serial
+
+
+def _soa_serial(domain, ns_ip, timeout, port=53):
+    """
+    Return the SOA serial of domain on a nameserver (None if not found)
+    """
+
+    serial = None
+    try:
+        response = _query(
+            domain,
+            ns_ip,
+            dns.message.make_query(domain, dns.rdatatype.SOA),
+            'udp',
+            timeout,
+            port
+        )
+        for rrset in response.answer:
+            if rrset.rdtype == dns.rdatatype.SOA:
+                serial = rrset[0].serial
+                break
+    except Exception as resolver_exception:
+        log.debug(
+            "Failed to fetch SOA from %s: %s", ns_ip, resolver_exception
+        )
+
+    if serial is not None:
+        dns_soa_serial.labels(domain=domain, nameserver=ns_ip).set(serial)
+    return serial
+
+
+class Spec(ProbeSpec):
+    """
+    Compiled service (see src.tools.spec)
+    """
+
+    __slots__ = ('domain', 'ns_IPs', 'dnssec', 'check_soa', 'timeout',
+                 'ns_port', 'check_tlsa', 'service_name')
+    options = (
+        Option('domain', str),
+        Option('ns_IPs', list, None, convert=freeze),
+        Option('dnssec', bool, False),
+        Option('check_soa', bool, True),
+        Option('timeout', NUMBER, 5),
+        Option('ns_port', int, 53),
+        Option('check_tlsa', bool, False)
+    )
+    target_option = 'domain'
+
+    domain: str
+    ns_IPs: Optional[Tuple[str, ...]]
+    dnssec: bool
+    check_soa: bool
+    timeout: float
+    ns_port: int
+    check_tlsa: bool
+    service_name: str
+
+    def compile(self):
+        self.set('service_name', "[dns] {}".format(self.domain))
+
+
+def test(service):
+    """
+    See module docstring
+    """
+
+    spec = service if isinstance(service, Spec) else Spec(service)
+    domain = spec.domain
+    ns_ips = spec.ns_IPs
+    dnssec = spec.dnssec
+    check_soa = spec.check_soa
+    timeout = spec.timeout
+    port = spec.ns_port
+    service_name = spec.service_name
+
+    # Auto-discover NS servers if not given
+    if ns_ips is None:
+        ns_ips = get_ns_servers(domain)
+
+    if not ns_ips:
+        return []
+
+    results = []
+    serials = {}
+
+    with ThreadPoolExecutor(max_workers=len(ns_ips)) as executor:
+        futures = [
+            (ns_ip, executor.submit(
+                _check_nameserver,
+                service_name, domain, ns_ip, dnssec, check_soa, timeout, port
+            ))
+            for ns_ip in ns_ips
+        ]
+        for ns_ip, future in futures:
+            ns_results, serial = future.result()
+            results += ns_results
+            if serial is not None:
+                serials[ns_ip] = serial
+
+    # Flag nameservers which are behind the highest serial
+    if len(set(serials.values())) > 1:
+        latest_serial = max(serials.values())
+        for ns_ip, serial in serials.items():
+            if serial != latest_serial:
+                results.append(
+                    Message(
+                        service_name,
+                        "SOA serial {} of ns {} differs from latest serial {}"
+                        .format(serial, ns_ip, latest_serial),
+                        Message.WARNING
+                    )
                 )
-            )
 
-        return results
+    return results
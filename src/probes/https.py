@@ -3,15 +3,21 @@
 """
 This probe checks if status code is 2XX or 3XX.
 
-Parameters:
+Parameters (dict or Spec object):
     url: (str) url to check (http or https protocols)
     verify_certificate: (bool) check validity of SSL certificate
     check_tlsa: (bool) check validity of TLSA record
     redirection: (bool) check if url redirects to another url (3XX codes)
     expected_status_code: (int)
     user_agent: (str)
-    custom_headers: (dict)
+    headers: (dict) additional HTTP headers
     pattern: (raw str) source code of the page must match this pattern
+    expiry_error_hours: (int) error if certificate expires within this
+                        window (default to 48)
+    expiry_warning_hours: (int) warning if certificate expires within this
+                          window (default to 168)
+    revalidate_interval: (int) seconds between two full validations (TLSA)
+                         of an unchanged certificate (default to 3600)
 
 Return:
     List of Message objects
@@ -20,12 +26,13 @@ Return:
 
 import logging
 import re
-from datetime import datetime, timedelta
+from typing import Mapping, Optional
 
 import requests
 import urllib3
 
-from src.tools import TLSA, Message, tls
+from src.tools import TLSA, Message, certificate, offload, tls
+from src.tools.spec import Option, ProbeSpec, freeze
 
 log = logging.getLogger(__name__)
 
@@ -33,31 +40,110 @@ log = logging.getLogger(__name__)
 urllib3.disable_warnings()
 
 
+class Spec(ProbeSpec):
+    """
+    Compiled service (see src.tools.spec)
+    """
+
+    __slots__ = ('url', 'verify_certificate', 'check_tlsa', 'redirection',
+                 'expected_status_code', 'user_agent', 'headers', 'pattern',
+                 'expiry_error_hours', 'expiry_warning_hours',
+                 'revalidate_interval', 'service_name', 'request_headers',
+                 'regex', 'tls_host', 'tls_port', 'tls_endpoint')
+    options = (
+        Option('url', str),
+        Option('verify_certificate', bool, True),
+        Option('check_tlsa', bool, False),
+        Option('redirection', bool, False),
+        Option('expected_status_code', int, None),
+        Option('user_agent', str, 'services-monitoring/v1'),
+        Option('headers', dict, {}, convert=freeze),
+        Option('pattern', str, None),
+        Option('expiry_error_hours', int, 48),
+        Option('expiry_warning_hours', int, 168),
+        Option('revalidate_interval', int, 3600)
+    )
+    target_option = 'url'
+
+    url: str
+    verify_certificate: bool
+    check_tlsa: bool
+    redirection: bool
+    expected_status_code: Optional[int]
+    user_agent: str
+    headers: Mapping[str, str]
+    pattern: Optional[str]
+    expiry_error_hours: int
+    expiry_warning_hours: int
+    revalidate_interval: int
+    service_name: str
+    request_headers: Mapping[str, str]
+    regex: Optional[re.Pattern]
+    tls_host: Optional[str]
+    tls_port: Optional[int]
+    tls_endpoint: Optional[str]
+
+    def compile(self):
+        self.set('service_name', "[https] {}".format(self.url))
+        headers = {'user-agent': self.user_agent}
+        headers.update(self.headers)
+        self.set('request_headers', freeze(headers))
+        self.set(
+            'regex',
+            re.compile(self.pattern) if self.pattern is not None else None
+        )
+        # Certificate checks are only done for https with verification
+        parsed_url = urllib3.util.parse_url(self.url)
+        if parsed_url.scheme == 'https' and self.verify_certificate:
+            self.set('tls_host', parsed_url.host)
+            self.set(
+                'tls_port',
+                parsed_url.port if parsed_url.port is not None else 443
+            )
+            self.set(
+                'tls_endpoint',
+                "{}:{}".format(self.tls_host, self.tls_port)
+            )
+        else:
+            self.set('tls_host', None)
+            self.set('tls_port', None)
+            self.set('tls_endpoint', None)
+
+    @classmethod
+    def validate(cls, service, path):
+        errors = super().validate(service, path)
+        if isinstance(service, dict) and isinstance(service.get('url'), str):
+            try:
+                urllib3.util.parse_url(service['url'])
+            except urllib3.exceptions.LocationParseError as url_error:
+                errors.append("{}: invalid url: {}".format(path, url_error))
+        if isinstance(service, dict) \
+                and isinstance(service.get('pattern'), str):
+            try:
+                re.compile(service['pattern'])
+            except re.error as regex_error:
+                errors.append("{}: invalid pattern: {}".format(
+                    path, regex_error
+                ))
+        return errors
+
+
 def test(service):
     """
     See module docstring
     """
 
-    url = service['url']
-    verify_certificate = service.get('verify_certificate', True)
-    check_tlsa = service.get('check_tlsa', False)
-    redirection = service.get('redirection', False)
-    expected_status_code = service.get('expected_status_code', None)
-    user_agent = service.get('user_agent', 'services-monitoring/v1')
-    custom_headers = service.get('headers', {})
-    pattern = service.get('pattern', None)
-    service_name = "[https] {}".format(url)
+    spec = service if isinstance(service, Spec) else Spec(service)
+    url = spec.url
+    service_name = spec.service_name
 
     results = []
 
-    headers = {'user-agent': user_agent}
-    for header in custom_headers:
-        headers[header] = custom_headers[header]
     try:
         request = requests.get(
             url,
-            verify=verify_certificate,
-            headers=headers,
+            verify=spec.verify_certificate,
+            headers=spec.request_headers,
             timeout=5
         )
 
@@ -78,8 +164,8 @@ def test(service):
         ))
         return results
 
-    if expected_status_code is not None:
-        if request.status_code != expected_status_code:
+    if spec.expected_status_code is not None:
+        if request.status_code != spec.expected_status_code:
             results.append(Message(
                 service_name,
                 "HTTP Status code different than expected (status code: {})"
@@ -98,7 +184,7 @@ def test(service):
             ))
 
     # Check if url redirects to another url (3XX codes)
-    if redirection:
+    if spec.redirection:
         first_response = request.history[0] if request.history else request
         if not first_response.is_redirect:
             results.append(Message(
@@ -108,61 +194,42 @@ def test(service):
             ))
 
     # Check regex
-    if pattern:
-        if not re.search(pattern, request.text):
+    if spec.regex is not None:
+        # Matching may run in the process pool (see src.tools.offload)
+        if not offload.run(offload.regex_search, spec.regex, request.text):
             results.append(Message(
                 service_name,
-                f"Does not match pattern '{pattern}'",
+                f"Does not match pattern '{spec.pattern}'",
                 Message.ERROR
             ))
 
     # For https check certificate expiration date and TLSA (if requested)
-    parsed_url = urllib3.util.parse_url(url)
-    if parsed_url.scheme == 'https' and verify_certificate:
+    if spec.tls_host is not None:
 
         # Get certificate
-        port = parsed_url.port if parsed_url.port is not None else 443
-        cert = tls.get_certificate(parsed_url.host, port)
+        host, port = spec.tls_host, spec.tls_port
+        cert = tls.get_certificate(host, port)
 
-        # Check if certificate has expired or will expire soon
-        not_before = datetime.strptime(
-            cert.get_notBefore().decode('ascii'),
-            '%Y%m%d%H%M%SZ'
+        cert_state = certificate.store.get_state(
+            'https',
+            spec.tls_endpoint,
+            cert
         )
 
-        not_after = datetime.strptime(
-            cert.get_notAfter().decode('ascii'),
-            '%Y%m%d%H%M%SZ'
-        )
-        log.debug(
-            "Certificate: not_before: %s, not_after: %s",
-            str(not_before),
-            str(not_after)
+        # Check if certificate has expired or will expire soon
+        results += certificate.check_expiry(
+            service_name,
+            cert_state,
+            spec.expiry_error_hours,
+            spec.expiry_warning_hours
         )
 
-        now = datetime.utcnow()
-
-        if now < not_before or now > not_after:
-            results.append(Message(
-                service_name,
-                "Certificate has expired",
-                Message.ERROR
-            ))
-        elif now + timedelta(hours=48) > not_after:
-            results.append(Message(
+        # Check TLSA only if cert has changed or on interval
+        if spec.check_tlsa:
+            results += cert_state.validate(
                 service_name,
-                "Certificate will expire in less than 48 hours",
-                Message.ERROR
-            ))
-        elif now + timedelta(days=7) > not_after:
-            results.append(Message(
-                service_name,
-                "Certificate will expire in less than 7 days",
-                Message.WARNING
-            ))
-
-        if check_tlsa:
-            tlsa_checker = TLSA(service_name)
-            results += tlsa_checker.check_tlsa(parsed_url.host, port, cert)
+                spec.revalidate_interval,
+                lambda: TLSA(service_name).check_tlsa(host, port, cert)
+            )
 
     return results
@@ -2,7 +2,7 @@
 
 """
 Parameter:
-    host: host to ping
+    host: (str) host to ping (or a Spec object)
 
 Return:
     True if host is reachable else False
@@ -10,18 +10,41 @@ Return:
 
 import logging
 import subprocess
+from typing import Tuple
 
 from src.tools import Message
+from src.tools.spec import Option, ProbeSpec
 
 log = logging.getLogger(__name__)
 
 
+class Spec(ProbeSpec):
+    """
+    Compiled service (see src.tools.spec), configured as a string
+    """
+
+    __slots__ = ('host', 'command', 'service_name')
+    options = (
+        Option('host', str),
+    )
+    target_option = 'host'
+
+    host: str
+    command: Tuple[str, ...]
+    service_name: str
+
+    def compile(self):
+        self.set('command', ("ping", "-c", "3", "-W", "3", self.host))
+        self.set('service_name', "[ping] {}".format(self.host))
+
+
 def test(host):
     """
     See module docstring
     """
+    spec = host if isinstance(host, Spec) else Spec(host)
     returncode = subprocess.call(
-        ["ping", "-c", "3", "-W", "3", host],
+        spec.command,
         stdout=subprocess.DEVNULL
     )
     if returncode == 1:
@@ -29,7 +52,7 @@ def test(host):
             Message(
                 body="Host is not reachable",
                 severity=Message.ERROR,
-                service="[ping] {}".format(host)
+                service=spec.service_name
             )
         ]
     if returncode == 2:
@@ -37,7 +60,7 @@ def test(host):
             Message(
                 body="Invalid host",
                 severity=Message.ERROR,
-                service="[ping] {}".format(host)
+                service=spec.service_name
             )
         ]
     return []
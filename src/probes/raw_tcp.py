@@ -2,7 +2,7 @@
 
 """
 Parameters:
-    service: (dict)
+    service: (dict or Spec object)
         host: (str) host to check (hostname or ip address)
         port: (int) port to check
         timeout: (int) (optional) timeout in seconds (default to 1)
@@ -14,30 +14,63 @@ Return:
 
 import logging
 import socket
+
 from src.tools import Message
+from src.tools.spec import NUMBER, Option, ProbeSpec
 
 log = logging.getLogger(__name__)
 
 
+class Spec(ProbeSpec):
+    """
+    Compiled service (see src.tools.spec)
+    """
+
+    __slots__ = ('host', 'port', 'timeout', 'service_name')
+    options = (
+        Option('host', str),
+        Option('port', int),
+        Option('timeout', NUMBER, 1)
+    )
+    target_option = 'host'
+
+    host: str
+    port: int
+    timeout: float
+    service_name: str
+
+    def compile(self):
+        self.set(
+            'service_name',
+            "[raw_tcp] {}:{}".format(self.host, self.port)
+        )
+
+    @property
+    def target(self):
+        """
+        (str) host:port (each port of a host is a target)
+        """
+        return "{}:{}".format(self.host, self.port)
+
+
 def test(service):
     """
     See module docstring
     """
-    host = service['host']
-    port = service['port']
-    timeout = service.get('timeout', 1)
+    spec = service if isinstance(service, Spec) else Spec(service)
 
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.settimeout(timeout)
+    sock.settimeout(spec.timeout)
     try:
-        sock.connect((host, port))
+        sock.connect((spec.host, spec.port))
         sock.close()
     except Exception as socket_exception:
+        sock.close()
         return [
             Message(
                 body="{}".format(socket_exception),
                 severity=Message.ERROR,
-                service="[raw_tcp] {}:{}".format(host, port)
+                service=spec.service_name
             )
         ]
     return []
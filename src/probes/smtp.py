@@ -2,11 +2,18 @@
 
 """
 Parameters:
-    service: (dict)
+    service: (dict or Spec object)
         host: (str) host to check
         port: (int) port to check (default to 25)
         check_tlsa: (bool) check validity of the SMTP TLSA record
                     (default to False)
+        expiry_error_hours: (int) error if certificate expires within this
+                            window (default to 72)
+        expiry_warning_hours: (int) warning if certificate expires within
+                              this window (default to None: no warning)
+        revalidate_interval: (int) seconds between two full validations
+                             (hostname, TLSA) of an unchanged certificate
+                             (default to 3600)
 
 Return:
     List of Message objects
@@ -15,33 +22,73 @@ Return:
 
 import logging
 import smtplib
-from datetime import datetime, timedelta
 from re import match
+from typing import Optional
 
 import OpenSSL.crypto
 
-from src.tools import TLSA, Message
+from src.tools import TLSA, Message, certificate
+from src.tools.spec import Option, ProbeSpec
 
 log = logging.getLogger(__name__)
 
 
+class Spec(ProbeSpec):
+    """
+    Compiled service (see src.tools.spec)
+    """
+
+    __slots__ = ('host', 'port', 'check_tlsa', 'expiry_error_hours',
+                 'expiry_warning_hours', 'revalidate_interval',
+                 'service_name', 'endpoint')
+    options = (
+        Option('host', str),
+        Option('port', int, 25),
+        Option('check_tlsa', bool, False),
+        Option('expiry_error_hours', int, 72),
+        Option('expiry_warning_hours', int, None),
+        Option('revalidate_interval', int, 3600)
+    )
+    target_option = 'host'
+
+    host: str
+    port: int
+    check_tlsa: bool
+    expiry_error_hours: int
+    expiry_warning_hours: Optional[int]
+    revalidate_interval: int
+    service_name: str
+    endpoint: str
+
+    def compile(self):
+        self.set('service_name', "[smtp] {}:{}".format(self.host, self.port))
+        self.set('endpoint', "{}:{}".format(self.host, self.port))
+
+    @property
+    def target(self):
+        """
+        (str) host:port (each port of a host is a target)
+        """
+        return self.endpoint
+
+
 def test(service):
     """
     See module docstring
     """
 
-    host = service['host']
-    port = service.get('port', 25)
-    check_tlsa = service.get('check_tlsa', False)
-    service_name = "[smtp] {}:{}".format(host, port)
+    spec = service if isinstance(service, Spec) else Spec(service)
+    host = spec.host
+    port = spec.port
+    check_tlsa = spec.check_tlsa
+    service_name = spec.service_name
 
     # This list will store warnings or errors.
     results = []
 
     # Fetch certificate
     try:
-        connection = smtplib.SMTP('{}:{}'.format(host, port), timeout=10)
-        connection.starttls()
+        cert = get_certificate(host, port)
     except Exception as connection_exception:
         results.append(Message(
             service_name,
@@ -52,15 +99,62 @@ def test(service):
 
         return results  # Future tests will necessarily fail
 
-    # Parse peer certificate
-    cert = OpenSSL.crypto.load_certificate(
-        OpenSSL.crypto.FILETYPE_ASN1,
-        connection.sock.getpeercert(
-            binary_form=True
+    cert_state = certificate.store.get_state('smtp', spec.endpoint, cert)
+
+    # Check if certificate has expired or will expire soon
+    results += certificate.check_expiry(
+        service_name,
+        cert_state,
+        spec.expiry_error_hours,
+        spec.expiry_warning_hours
+    )
+
+    # Check hostname and TLSA only if cert has changed or on interval
+    results += cert_state.validate(
+        service_name,
+        spec.revalidate_interval,
+        lambda: validate_certificate(
+            service_name, host, port, cert, check_tlsa
         )
     )
 
-    connection.quit()
+    return results
+
+
+def get_certificate(host, port=25, timeout=10):
+    """
+    Return the certificate (OpenSSL cert object) of the SMTP server
+    using STARTTLS
+    """
+
+    connection = smtplib.SMTP('{}:{}'.format(host, port), timeout=timeout)
+    try:
+        connection.starttls()
+
+        # Parse peer certificate
+        cert = OpenSSL.crypto.load_certificate(
+            OpenSSL.crypto.FILETYPE_ASN1,
+            connection.sock.getpeercert(
+                binary_form=True
+            )
+        )
+
+        connection.quit()
+    finally:
+        connection.close()
+
+    return cert
+
+
+def validate_certificate(service_name, host, port, cert, check_tlsa):
+    """
+    Check that the certificate matches host and TLSA record (if check_tlsa)
+
+    Return:
+    List of Message objects
+    """
+
+    results = []
 
     # Check if hostname is correct
     common_name = dict(
@@ -84,32 +178,6 @@ def test(service):
                 Message.ERROR
             ))
 
-    # Check if certificate has expired or will expire soon
-    not_before = datetime.strptime(
-        cert.get_notBefore().decode('ascii'),
-        '%Y%m%d%H%M%SZ'
-    )
-
-    not_after = datetime.strptime(
-        cert.get_notAfter().decode('ascii'),
-        '%Y%m%d%H%M%SZ'
-    )
-
-    now = datetime.utcnow()
-
-    if now < not_before or now > not_after:
-        results.append(Message(
-            service_name,
-            "Certificate has expired",
-            Message.ERROR
-        ))
-    elif now + timedelta(hours=72) > not_after:
-        results.append(Message(
-            service_name,
-            "Certificate will expire in less than 72 hours",
-            Message.ERROR
-        ))
-
     if check_tlsa:
         tlsa_checker = TLSA(service_name)
         results += tlsa_checker.check_tlsa(host, port, cert)
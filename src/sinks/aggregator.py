@@ -0,0 +1,48 @@
+# Author: FL42
+
+"""
+Send result records to an aggregator (see src.tools.vantage)
+
+A monitor with this sink is a vantage agent: each batch of records of the
+pipeline is sent as one frame {"agent": ..., "records": [...]} (see
+src.tools.framing). The sink connects lazily and reconnects after an
+error; batches written while the aggregator is unreachable are dropped
+(see src.sinks.pipeline and src.sinks.socket_sink).
+
+Options (item of the results/sinks section of the config):
+    type: aggregator
+    address: (str) 'host:port' or path of a Unix socket
+    agent: (str) name of the vantage point (default to the hostname)
+    secret: (str) shared secret signing frames (see src.tools.framing),
+            as set on the aggregator
+    timeout: (float) timeout in seconds of connection and writes
+             (default to 5)
+"""
+
+import socket
+
+from src.sinks.socket_sink import SocketSink
+from src.tools import framing
+
+
+class AggregatorSink(SocketSink):
+    """
+    See module docstring
+    """
+
+    def __init__(self, address, agent=None, timeout=5, secret=None):
+        SocketSink.__init__(self, timeout)
+        self.address = address
+        self.agent = agent or socket.gethostname()
+        self.secret = secret
+
+    def socket_address(self):
+        return framing.parse_address(self.address)
+
+    def encode(self, records):
+        """
+        One frame of records (see src.tools.framing)
+        """
+        return framing.encode(
+            {'agent': self.agent, 'records': records}, self.secret
+        )
@@ -0,0 +1,69 @@
+# Author: FL42
+
+"""
+Write result records to a JSON lines file (one record per line)
+
+The file is rotated when it exceeds max_bytes: path is renamed path.1,
+path.1 is renamed path.2 and so on up to path.<backup_count>.
+
+Options (item of the results/sinks section of the config):
+    type: jsonl
+    path: (str) path of the file
+    max_bytes: (int) size triggering a rotation (default to 10 MB,
+               0 disables rotation)
+    backup_count: (int) number of rotated files to keep (default to 5)
+"""
+
+import json
+import os
+
+
+class JSONLinesSink:
+    """
+    See module docstring
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = None
+
+    def write(self, records):
+        """
+        Append records (list of dict) to the file
+        """
+        if self.file is None:
+            # Kept open between batches, closed by close() and rotate()
+            self.file = open(  # pylint: disable=consider-using-with
+                self.path, 'at', encoding='utf-8'
+            )
+        self.file.write(''.join(
+            json.dumps(record, separators=(',', ':')) + '\n'
+            for record in records
+        ))
+        self.file.flush()
+        if 0 < self.max_bytes <= self.file.tell():
+            self.rotate()
+
+    def rotate(self):
+        """
+        Rotate the files (see module docstring)
+        """
+        self.close()
+        for index in range(self.backup_count - 1, 0, -1):
+            source = '{}.{}'.format(self.path, index)
+            if os.path.exists(source):
+                os.replace(source, '{}.{}'.format(self.path, index + 1))
+        if self.backup_count > 0:
+            os.replace(self.path, '{}.1'.format(self.path))
+        else:
+            os.remove(self.path)
+
+    def close(self):
+        """
+        Close the file
+        """
+        if self.file is not None:
+            self.file.close()
+            self.file = None
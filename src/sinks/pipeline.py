@@ -0,0 +1,202 @@
+# Author: FL42
+
+"""
+Pipeline streaming probe results as structured records to sinks
+
+Each probe outcome becomes a record:
+    {"timestamp": 1700000000.0, "config": "...", "cycle_id": "...",
+     "probe": "https", "target": "https://example.com", "status": "down",
+     "latency_seconds": 0.42, "attempts": 3,
+     "messages": [{"service": "...", "body": "...", "severity": "ERROR"}]}
+
+Records are pushed onto a bounded queue (probing never waits on sinks) and
+written by a dedicated thread in batches of up to batch_size records, at
+least every flush_interval seconds. Records are dropped when the queue is
+full or when a sink fails.
+
+Options (results section of the config):
+    sinks: (list of dict) sinks, with a type (see SINK_TYPES) and the
+           options of the sink
+    batch_size: (int) maximum number of records per write (default to 100)
+    flush_interval: (float) maximum seconds before writing buffered
+                    records (default to 1)
+    max_size: (int) size of the queue (default to 10000)
+"""
+
+import logging
+import queue
+import threading
+from time import monotonic
+
+from prometheus_client import Counter
+
+from src.sinks.aggregator import AggregatorSink
+from src.sinks.jsonl import JSONLinesSink
+from src.sinks.unix_socket import UnixSocketSink
+from src.tools import Message
+
+log = logging.getLogger(__name__)
+
+sink_records_total = Counter(
+    "sink_records_total", "Number of records written", ("sink",)
+)
+sink_dropped_total = Counter(
+    "sink_dropped_total", "Number of records dropped", ("sink",)
+)
+
+SINK_TYPES = {
+    'aggregator': AggregatorSink,
+    'jsonl': JSONLinesSink,
+    'unix_socket': UnixSocketSink
+}
+
+SEVERITY_NAMES = {
+    Message.ERROR: 'ERROR',
+    Message.WARNING: 'WARNING',
+    Message.INFO: 'INFO'
+}
+
+
+def make_record(probe, target, success, duration, messages, **fields):
+    """
+    Return the record (dict) of a probe outcome
+
+    Parameters:
+    probe: (str) probe name
+    target: (str) target of the probe
+    success: (bool) result of the probe
+    duration: (float) duration of the probe in seconds
+    messages: (list of Message objects) messages returned by the probe
+    fields: other fields of the record (timestamp, config, cycle_id...)
+    """
+    record = dict(fields)
+    record.update({
+        'probe': probe,
+        'target': target,
+        'status': 'up' if success else 'down',
+        'latency_seconds': round(duration, 6),
+        'messages': [
+            {
+                'service': message.service,
+                'body': message.body,
+                'severity': SEVERITY_NAMES.get(message.severity,
+                                               message.severity)
+            }
+            for message in messages
+        ]
+    })
+    return record
+
+
+def create_sink(sink_config):
+    """
+    Return the sink described by sink_config (dict with a type)
+    """
+    options = dict(sink_config)
+    sink_type = options.pop('type')
+    if sink_type not in SINK_TYPES:
+        raise ValueError("Unknown sink type: {}".format(sink_type))
+    return SINK_TYPES[sink_type](**options)
+
+
+class ResultPipeline(threading.Thread):
+    """
+    See module docstring
+    """
+
+    def __init__(self, sinks, batch_size=100, flush_interval=1,
+                 max_size=10000):
+        """
+        Parameters:
+        sinks: (list) sink objects (with write and close methods)
+        see module docstring for other parameters
+        """
+        threading.Thread.__init__(self, name='result-pipeline')
+        self.daemon = True
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_size)
+        self.exit_event = threading.Event()
+
+    @classmethod
+    def from_config(cls, results_config):
+        """
+        Create the pipeline from the results section of a config
+        """
+        options = dict(results_config)
+        sinks = [create_sink(sink) for sink in options.pop('sinks', [])]
+        return cls(sinks, **options)
+
+    @staticmethod
+    def _sink_name(sink):
+        return type(sink).__name__
+
+    def emit(self, record):
+        """
+        Queue record (dict), never blocks
+
+        Return:
+        (bool) False if record was dropped
+        """
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            for sink in self.sinks:
+                sink_dropped_total.labels(sink=self._sink_name(sink)).inc()
+            return False
+        return True
+
+    def run(self):
+        """
+        Run method (see threading module)
+        """
+        while not self.exit_event.is_set():
+            self._write(self._next_batch())
+        # Write remaining records
+        while not self.queue.empty():
+            self._write(self._next_batch(timeout=0))
+        for sink in self.sinks:
+            sink.close()
+
+    def _next_batch(self, timeout=None):
+        """
+        Return up to batch_size records, waiting at most flush_interval
+        """
+        batch = []
+        deadline = monotonic() + (
+            self.flush_interval if timeout is None else timeout
+        )
+        while len(batch) < self.batch_size:
+            remaining = deadline - monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """
+        Write batch to all sinks
+        """
+        if not batch:
+            return
+        for sink in self.sinks:
+            name = self._sink_name(sink)
+            try:
+                sink.write(batch)
+                sink_records_total.labels(sink=name).inc(len(batch))
+            except Exception as sink_exception:
+                # A failing sink (e.g. unserializable record) must neither
+                # stop the pipeline nor the other sinks
+                log.warning("Sink %s failed: %r", name, sink_exception)
+                sink_dropped_total.labels(sink=name).inc(len(batch))
+
+    def stop(self):
+        """
+        Stop the thread (buffered records are written)
+        """
+        self.exit_event.set()
@@ -0,0 +1,71 @@
+# Author: FL42
+
+"""
+Base class of sinks sending records over a stream socket
+
+The sink connects lazily and reconnects after an error: the connection is
+closed when a connection or a write fails and the error is raised, so the
+batch is dropped by the pipeline (see src.sinks.pipeline).
+
+Subclasses define:
+    socket_address(): return (socket family, address) to connect to
+    encode(records): return the bytes sent for records (list of dict)
+"""
+
+import socket
+
+
+class SocketSink:
+    """
+    See module docstring
+    """
+
+    def __init__(self, timeout):
+        """
+        Parameters:
+        timeout: (float) timeout in seconds of connection and writes
+        """
+        self.timeout = timeout
+        self.socket = None
+
+    def socket_address(self):
+        """
+        Return (socket family, address) of the consumer
+        """
+        raise NotImplementedError
+
+    def encode(self, records):
+        """
+        Return the bytes sent for records (list of dict)
+        """
+        raise NotImplementedError
+
+    def write(self, records):
+        """
+        Send records (list of dict)
+
+        Raise OSError if the consumer is not reachable
+        """
+        payload = self.encode(records)
+        if self.socket is None:
+            family, address = self.socket_address()
+            self.socket = socket.socket(family, socket.SOCK_STREAM)
+            self.socket.settimeout(self.timeout)
+            try:
+                self.socket.connect(address)
+            except OSError:
+                self.close()
+                raise
+        try:
+            self.socket.sendall(payload)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        """
+        Close the connection
+        """
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
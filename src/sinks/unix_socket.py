@@ -0,0 +1,42 @@
+# Author: FL42
+
+"""
+Stream result records to a Unix socket (JSON lines over SOCK_STREAM)
+
+The listener is owned by the consumer. The sink connects lazily and
+reconnects after an error; records written while no consumer is listening
+are dropped (see src.sinks.pipeline and src.sinks.socket_sink).
+
+Options (item of the results/sinks section of the config):
+    type: unix_socket
+    path: (str) path of the socket
+    timeout: (float) timeout in seconds of connection and writes
+             (default to 1)
+"""
+
+import json
+import socket
+
+from src.sinks.socket_sink import SocketSink
+
+
+class UnixSocketSink(SocketSink):
+    """
+    See module docstring
+    """
+
+    def __init__(self, path, timeout=1):
+        SocketSink.__init__(self, timeout)
+        self.path = path
+
+    def socket_address(self):
+        return socket.AF_UNIX, self.path
+
+    def encode(self, records):
+        """
+        JSON lines of records
+        """
+        return ''.join(
+            json.dumps(record, separators=(',', ':')) + '\n'
+            for record in records
+        ).encode()
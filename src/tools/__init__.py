@@ -2,5 +2,5 @@
 tools package
 """
 
-from .message import Message
+from .message import AlertState, Message
 from .tlsa import TLSA
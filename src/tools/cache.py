@@ -0,0 +1,129 @@
+# Author: FL42
+
+"""
+Thread-safe LRU cache with optional per-entry expiration
+and deduplication of concurrent calls (single flight)
+
+Hits and misses are exported as prometheus counters labelled by cache name.
+"""
+
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from prometheus_client import Counter
+
+cache_hits_total = Counter(
+    "cache_hits_total", "Number of cache hits", ("cache",)
+)
+cache_misses_total = Counter(
+    "cache_misses_total", "Number of cache misses", ("cache",)
+)
+
+
+class LRUCache:
+    """
+    Least recently used cache shared between threads
+    """
+
+    def __init__(self, name, max_size=1024):
+        """
+        Parameters:
+        name: (str) name of the cache (used as metric label)
+        max_size: (int) maximum number of entries
+        """
+        self.name = name
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (expiration or None, value)
+        self._lock = threading.Lock()
+        self._hits = cache_hits_total.labels(cache=name)
+        self._misses = cache_misses_total.labels(cache=name)
+
+    def get(self, key, default=None):
+        """
+        Return the value stored for key or default if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expiration, value = entry
+                if expiration is None or expiration > monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits.inc()
+                    return value
+                del self._entries[key]
+        self._misses.inc()
+        return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Store value for key (for ttl seconds if given)
+        """
+        expiration = monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expiration, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all entries
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Call:
+    """
+    Call in progress in SingleFlight
+    """
+
+    __slots__ = ('event', 'result', 'exception')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight:
+    """
+    Deduplicate concurrent calls: callers asking for the same key while a
+    call is in progress wait for it and share its result
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """
+        Return function() (called once for concurrent callers of key)
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if leader:
+            try:
+                call.result = function()
+            except Exception as call_exception:
+                call.exception = call_exception
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.event.set()
+        else:
+            call.event.wait()
+
+        if call.exception is not None:
+            raise call.exception
+        return call.result
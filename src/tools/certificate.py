@@ -0,0 +1,157 @@
+# Author: FL42
+
+"""
+Certificate state indexed per endpoint
+
+The validity period of a certificate is parsed once per fingerprint and
+exported as cert_expiry_timestamp_seconds. Checking expiration windows is
+then only arithmetic. Full validation (TLSA, hostname, etc) is done when the
+fingerprint changes or when the revalidation interval has elapsed, else the
+previous validation messages are reused.
+"""
+
+import calendar
+import logging
+import threading
+from time import strptime, time
+
+from prometheus_client import Gauge
+
+from src.tools.message import Message
+from src.tools.tlsa import get_fingerprint
+
+log = logging.getLogger(__name__)
+
+cert_expiry_timestamp = Gauge(
+    "cert_expiry_timestamp_seconds",
+    "Expiration date of the certificate (unix timestamp)",
+    ("probe", "target")
+)
+
+
+def parse_asn1_time(asn1_time):
+    """
+    Convert an ASN.1 time (bytes, e.g. b'20200101000000Z')
+    to a unix timestamp
+    """
+    return calendar.timegm(
+        strptime(asn1_time.decode('ascii'), '%Y%m%d%H%M%SZ')
+    )
+
+
+class CertificateState:
+    """
+    State of the certificate of an endpoint
+    """
+
+    __slots__ = ('fingerprint', 'not_before', 'not_after', 'validations')
+
+    def __init__(self, cert):
+        self.fingerprint = get_fingerprint(cert)
+        self.not_before = parse_asn1_time(cert.get_notBefore())
+        self.not_after = parse_asn1_time(cert.get_notAfter())
+        # key -> (validation timestamp, list of Message objects)
+        self.validations = {}
+
+    def validate(self, key, interval, validate_function):
+        """
+        Return the messages of validate_function()
+        validate_function is only called if there is no validation for key
+        or if it is older than interval (seconds)
+        (key is usually the service name)
+        """
+        now = time()
+        validated_at, messages = self.validations.get(key, (None, []))
+        if validated_at is None or now - validated_at >= interval:
+            messages = validate_function()
+            self.validations[key] = (now, messages)
+        else:
+            log.debug("Certificate already validated for %s", key)
+        return list(messages)
+
+
+class CertificateStore:
+    """
+    Index of CertificateState by (probe, endpoint)
+    """
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def get_state(self, probe, endpoint, cert):
+        """
+        Return the CertificateState of endpoint for cert
+        (parsed only if the fingerprint has changed)
+        """
+        fingerprint = get_fingerprint(cert)
+        with self._lock:
+            state = self._states.get((probe, endpoint))
+        if state is None or state.fingerprint != fingerprint:
+            log.debug("New certificate for %s %s", probe, endpoint)
+            state = CertificateState(cert)
+            with self._lock:
+                self._states[(probe, endpoint)] = state
+            cert_expiry_timestamp.labels(
+                probe=probe,
+                target=endpoint
+            ).set(state.not_after)
+        return state
+
+
+# Store shared by all probes
+store = CertificateStore()
+
+
+def _format_window(hours):
+    """
+    Human readable window
+    """
+    if hours > 72 and hours % 24 == 0:
+        return "{} days".format(hours // 24)
+    return "{} hours".format(hours)
+
+
+def check_expiry(service_name, state, error_hours, warning_hours=None):
+    """
+    Check if certificate has expired or will expire soon
+
+    Parameters:
+    service_name: (str)
+    state: (CertificateState)
+    error_hours: (int) return an error if cert expires within this window
+    warning_hours: (int or None) return a warning if cert expires
+                   within this window
+
+    Return:
+    List of Message objects
+    """
+
+    now = time()
+    log.debug(
+        "Certificate: not_before: %d, not_after: %d",
+        state.not_before,
+        state.not_after
+    )
+
+    if now < state.not_before or now > state.not_after:
+        return [Message(
+            service_name,
+            "Certificate has expired",
+            Message.ERROR
+        )]
+    if now + error_hours * 3600 > state.not_after:
+        return [Message(
+            service_name,
+            "Certificate will expire in less than {}"
+            .format(_format_window(error_hours)),
+            Message.ERROR
+        )]
+    if warning_hours and now + warning_hours * 3600 > state.not_after:
+        return [Message(
+            service_name,
+            "Certificate will expire in less than {}"
+            .format(_format_window(warning_hours)),
+            Message.WARNING
+        )]
+    return []
@@ -0,0 +1,302 @@
+# Author: FL42
+
+"""
+Discovery of services to probe
+
+Providers return services in the format of the probes section of a config
+(probe name -> list of services, generators included, see
+src.tools.expansion):
+    file: services read from a JSON or YAML file (reloaded when modified)
+    dns_srv: one service per SRV record of a name
+
+A thread refreshes each provider every interval seconds and applies the
+difference: only added and removed services change, so services found by
+a refresh keep their state (alerts, flap detection, history...), while
+alerts of removed services are dropped without a back online message.
+Invalid services are logged and ignored; when a provider fails, its
+previous services are kept.
+
+Options (discovery section of the config, list of providers):
+    type: (str) provider type (see PROVIDER_TYPES)
+    interval: (float) seconds between two refreshes (default to 60)
+    file provider:
+        path: (str) path of the file (not in the config directory, whose
+              files are all loaded as monitoring configs)
+    dns_srv provider:
+        name: (str) name of the SRV records (e.g. _smtp._tcp.example.com)
+        probe: (str) probe of discovered services
+        template: (str) target of services formatted with host, port,
+                  priority and weight (default to host and port options)
+        options: (dict) other options of services
+        nameservers: (list of str) IPs of resolvers (default to system)
+        timeout: (float) timeout of a query in seconds (default to 5)
+"""
+
+import json
+import logging
+import os
+import threading
+from time import monotonic
+
+import dns.resolver
+import yaml
+from prometheus_client import Counter, Gauge
+
+from src.tools.expansion import Expansion, is_expansion
+from src.tools.spec import ConfigError
+
+log = logging.getLogger(__name__)
+
+discovery_services = Gauge(
+    "discovery_services", "Number of discovered services", ("provider",)
+)
+discovery_failures_total = Counter(
+    "discovery_failures_total", "Number of failed refreshes", ("provider",)
+)
+
+
+class FileProvider:
+    """
+    Services of a JSON or YAML file (see module docstring)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = "file:{}".format(path)
+        self._mtime = None
+        self._services = {}
+
+    def fetch(self):
+        """
+        Return services (dict probe name -> list of services)
+        The file is parsed only if modified since the last call
+        """
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with open(self.path, 'rt', encoding='utf-8') as services_file:
+                services = yaml.safe_load(services_file) or {}
+            if not isinstance(services, dict):
+                raise ValueError("{} must contain a mapping".format(self.path))
+            self._services = services
+            self._mtime = mtime
+        return self._services
+
+
+class SRVProvider:
+    """
+    Services of SRV records (see module docstring)
+    """
+
+    def __init__(self, name, probe, template=None, options=None,
+                 nameservers=None, timeout=5):
+        self.name = "dns_srv:{}".format(name)
+        self.record_name = name
+        self.probe = probe
+        self.template = template
+        self.options = options or {}
+        self.resolver = dns.resolver.Resolver(configure=not nameservers)
+        if nameservers:
+            self.resolver.nameservers = nameservers
+        self.resolver.lifetime = timeout
+
+    def fetch(self):
+        """
+        Return services (dict probe name -> list of services)
+        """
+        services = []
+        for record in self.resolver.query(self.record_name, 'SRV'):
+            fields = {
+                'host': record.target.to_text(omit_final_dot=True),
+                'port': record.port,
+                'priority': record.priority,
+                'weight': record.weight
+            }
+            if self.template is None:
+                service = dict(self.options, host=fields['host'],
+                               port=fields['port'])
+            else:
+                # One combination (see src.tools.expansion)
+                service = dict(self.options, expand=fields,
+                               template=self.template)
+            services.append(service)
+        return {self.probe: services}
+
+
+PROVIDER_TYPES = {
+    'file': FileProvider,
+    'dns_srv': SRVProvider
+}
+
+
+def create_provider(provider_config):
+    """
+    Return (provider, interval) described by provider_config
+    (dict with a type)
+    """
+    options = dict(provider_config)
+    provider_type = options.pop('type')
+    interval = options.pop('interval', 60)
+    if provider_type not in PROVIDER_TYPES:
+        raise ValueError("Unknown provider type: {}".format(provider_type))
+    return PROVIDER_TYPES[provider_type](**options), interval
+
+
+def _service_key(probe_name, service):
+    """
+    Return a hashable key identifying service
+    """
+    return probe_name, json.dumps(service, sort_keys=True, default=str)
+
+
+class Discovery(threading.Thread):
+    """
+    See module docstring
+    """
+
+    def __init__(self, providers, probe_mapping):
+        """
+        Parameters:
+        providers: (list of tuples) (provider, interval), a provider has a
+                   name and a fetch method (see FileProvider)
+        probe_mapping: (dict) see ServicesMonitoring.probe_mapping
+        """
+        threading.Thread.__init__(self, name='discovery')
+        self.daemon = True
+        self.providers = providers
+        self.probe_mapping = probe_mapping
+        self.exit_event = threading.Event()
+        self._lock = threading.Lock()
+        # provider name -> {service key: (probe name, probe module, spec)}
+        self._discovered = {provider.name: {} for provider, _ in providers}
+        self._specs = ()
+        self._removed = []  # (probe name, target) removed since last call
+
+    @classmethod
+    def from_config(cls, discovery_config, probe_mapping):
+        """
+        Create the discovery thread from the discovery section of a config
+        """
+        return cls(
+            [create_provider(provider) for provider in discovery_config],
+            probe_mapping
+        )
+
+    @property
+    def specs(self):
+        """
+        (tuple) (probe name, probe module, spec) of discovered services
+        """
+        return self._specs
+
+    def removed_targets(self):
+        """
+        Return the list of (probe name, target) removed since the last
+        call (see ServicesMonitoring.monitor)
+        """
+        with self._lock:
+            removed, self._removed = self._removed, []
+        return removed
+
+    def _compile(self, provider, services):
+        """
+        Yield (service key, (probe name, probe module, spec)) of services
+        (invalid services are logged and skipped)
+        """
+        for probe_name, items in services.items():
+            if probe_name not in self.probe_mapping \
+                    or not isinstance(items, list):
+                log.error("%s: invalid probe %s", provider.name, probe_name)
+                continue
+            probe_module = self.probe_mapping[probe_name]["module"]
+            for index, item in enumerate(items):
+                path = "{}:{}[{}]".format(provider.name, probe_name, index)
+                try:
+                    if is_expansion(item):
+                        expanded = Expansion(
+                            probe_name, probe_module, item, path
+                        ).services()
+                    else:
+                        expanded = [item]
+                    for service in expanded:
+                        yield _service_key(probe_name, service), (
+                            probe_name,
+                            probe_module,
+                            probe_module.Spec(service, path)
+                        )
+                except ConfigError as config_error:
+                    for error in config_error.errors:
+                        log.error("Invalid discovered service: %s", error)
+                except Exception as service_exception:
+                    log.error("Invalid discovered service: %s: %s",
+                              path, service_exception)
+
+    def refresh(self, provider):
+        """
+        Fetch the services of provider and apply the difference
+
+        Return:
+        (tuple) numbers of added and removed services
+        """
+        try:
+            services = provider.fetch()
+        except Exception as provider_exception:
+            log.warning("Discovery %s failed: %s",
+                        provider.name, provider_exception)
+            discovery_failures_total.labels(provider=provider.name).inc()
+            return 0, 0
+
+        previous = self._discovered[provider.name]
+        current = {}
+        for key, compiled in self._compile(provider, services):
+            # Keep the spec of known services
+            current[key] = previous.get(key, compiled)
+        added = current.keys() - previous.keys()
+        removed = previous.keys() - current.keys()
+        if not added and not removed:
+            return 0, 0
+
+        with self._lock:
+            self._discovered[provider.name] = current
+            specs = []
+            for discovered in self._discovered.values():
+                specs.extend(discovered.values())
+            self._specs = tuple(specs)
+            targets = {
+                (probe_name, spec.target) for probe_name, _, spec in specs
+            }
+            self._removed.extend(
+                (previous[key][0], previous[key][2].target)
+                for key in removed
+                if (previous[key][0], previous[key][2].target) not in targets
+            )
+        discovery_services.labels(provider=provider.name).set(len(current))
+        log.info("Discovery %s: %d added, %d removed",
+                 provider.name, len(added), len(removed))
+        return len(added), len(removed)
+
+    def run(self):
+        """
+        Run method (see threading module)
+        """
+        next_refresh = {provider.name: 0 for provider, _ in self.providers}
+        while not self.exit_event.is_set():
+            now = monotonic()
+            for provider, interval in self.providers:
+                if next_refresh[provider.name] <= now:
+                    try:
+                        self.refresh(provider)
+                    except Exception as refresh_exception:
+                        log.exception("Discovery %s failed: %s",
+                                      provider.name, refresh_exception)
+                        discovery_failures_total \
+                            .labels(provider=provider.name).inc()
+                    next_refresh[provider.name] = monotonic() + interval
+            self.exit_event.wait(max(
+                0, min(next_refresh.values(), default=60) - monotonic()
+            ))
+
+    def stop(self):
+        """
+        Stop the thread
+        """
+        self.exit_event.set()
@@ -0,0 +1,131 @@
+# Author: FL42
+
+"""
+Metrics about the monitor itself (as opposed to the probed targets)
+
+- monitor_scheduler_lag_seconds: actual minus intended start time of a cycle
+  (cycles are scheduled at a fixed rate: a cycle is due delay seconds after
+  the intended start of the previous one, so a cycle running longer than
+  delay delays the next one and shows up as lag),
+- monitor_cycle_duration_seconds: duration of a probe cycle,
+- monitor_busy_ratio: share of the last cycle period spent probing
+  (1 means the config thread is saturated),
+- monitor_probes_in_flight: probes currently running per probe type,
+- monitor_thread_alive: liveness of config threads (see watchdog_is_alive),
+- monitor_open_sockets: sockets opened by the process.
+"""
+
+import os
+
+from prometheus_client import Gauge, Histogram
+
+scheduler_lag_seconds = Histogram(
+    "monitor_scheduler_lag_seconds",
+    "Actual minus intended start time of probe cycles",
+    ("config",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+)
+cycle_duration_seconds = Histogram(
+    "monitor_cycle_duration_seconds",
+    "Duration of probe cycles",
+    ("config",),
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+busy_ratio = Gauge(
+    "monitor_busy_ratio",
+    "Share of the last cycle period spent probing",
+    ("config",)
+)
+probes_in_flight = Gauge(
+    "monitor_probes_in_flight", "Number of running probes", ("probe",)
+)
+thread_alive = Gauge(
+    "monitor_thread_alive", "Config thread is alive (1) or not (0)",
+    ("config",)
+)
+open_sockets = Gauge(
+    "monitor_open_sockets", "Number of sockets opened by the process"
+)
+
+
+def count_open_sockets():
+    """
+    Return the number of sockets opened by the process
+    (0 if /proc is not available)
+    """
+    count = 0
+    try:
+        for fd in os.listdir('/proc/self/fd'):
+            try:
+                if os.readlink(os.path.join('/proc/self/fd', fd)) \
+                        .startswith('socket:'):
+                    count += 1
+            except OSError:  # fd closed meanwhile
+                pass
+    except OSError:
+        return 0
+    return count
+
+
+open_sockets.set_function(count_open_sockets)
+
+
+def register_thread(services_monitoring):
+    """
+    Export the liveness of services_monitoring (ServicesMonitoring object)
+    """
+    thread_alive.labels(config=services_monitoring.config_path).set_function(
+        lambda: int(
+            services_monitoring.is_alive()
+            and services_monitoring.watchdog_is_alive()
+        )
+    )
+
+
+class CycleTimer:
+    """
+    Record scheduling metrics of the cycles of a config thread
+    """
+
+    def __init__(self, config, delay):
+        """
+        Parameters:
+        config: (str) label of the config thread
+        delay: (float) delay between cycles in seconds
+        """
+        self.delay = delay
+        self.intended_start = None
+        self.cycle_start = None
+        self.cycle_duration = None
+        self._lag = scheduler_lag_seconds.labels(config=config)
+        self._duration = cycle_duration_seconds.labels(config=config)
+        self._busy_ratio = busy_ratio.labels(config=config)
+
+    def start(self, now):
+        """
+        Call at the start of a cycle
+        """
+        if self.intended_start is None:
+            self.intended_start = now
+        else:
+            lag = now - self.intended_start
+            self._lag.observe(max(0, lag))
+            if lag > self.delay:
+                # Missed cycles are skipped, not run in a burst
+                self.intended_start = now
+            period = now - self.cycle_start
+            if period > 0:
+                self._busy_ratio.set(self.cycle_duration / period)
+        self.cycle_start = now
+
+    def end(self, now):
+        """
+        Call at the end of a cycle
+
+        Return:
+        (float) seconds to wait before the next cycle (0 if late)
+        """
+        self.cycle_duration = now - self.cycle_start
+        self._duration.observe(self.cycle_duration)
+        self.intended_start += self.delay
+        return max(0, self.intended_start - now)
@@ -0,0 +1,278 @@
+# Author: FL42
+
+"""
+Expansion of target generators in the probes section of a config
+
+An item of a probe list may be an expansion instead of a service:
+
+    raw_tcp:
+      - expand:
+          host: [{cidr: 10.0.0.0/24}, db.example.com]
+          port: [22, 443]
+        timeout: 2
+    https:
+      - expand:
+          host: {file: /config/hosts.txt}
+          port: {range: [8000, 8010]}
+        template: 'https://{host}:{port}/health'
+        pattern: OK
+
+Each variable of expand is a value, a list of values or a source:
+    {cidr: network}: host addresses of the network (IPv4 or IPv6, at most
+                     MAX_CIDR_HOSTS addresses)
+    {file: path}: one value per line (empty lines and # comments ignored)
+    {range: [first, last]}: integers from first to last (included)
+Lists may mix values and sources.
+
+Services are generated for every combination of variables (host x port
+matrix). Without template, variables are options of the services. With a
+template (a format string for the target option of the probe, or a dict
+option -> format string), variables are only used to format the template.
+Other keys of the item are options shared by all generated services.
+
+Expansions are validated at load time (sources, template variables and
+options of the first service) and counted without being materialized;
+services are generated lazily at each cycle. Errors found while
+generating services (a target file removed, an invalid generated service)
+are logged and the bad entry is skipped.
+"""
+
+import ipaddress
+import logging
+import string
+
+from src.tools.spec import ConfigError
+
+log = logging.getLogger(__name__)
+
+SOURCES = ('cidr', 'file', 'range')
+MAX_CIDR_HOSTS = 65536
+
+
+def _cidr_values(network):
+    """
+    Yield the host addresses of network (all addresses for /31 and /32)
+    """
+    addresses = network.hosts() if network.num_addresses > 2 else network
+    for address in addresses:
+        yield str(address)
+
+
+def _cidr_count(network):
+    if network.num_addresses > 2 and network.version == 4:
+        return network.num_addresses - 2
+    if network.num_addresses > 2:
+        return network.num_addresses - 1  # no broadcast in IPv6
+    return network.num_addresses
+
+
+def _file_values(path):
+    """
+    Yield the values of a target file
+    """
+    with open(path, 'rt', encoding='utf-8') as target_file:
+        for line in target_file:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield line
+
+
+class Source:
+    """
+    Lazy sequence of values of a variable
+    """
+
+    __slots__ = ('parts', 'count')
+
+    def __init__(self, value, path):
+        """
+        Parameters:
+        value: value, list of values or sources (see module docstring)
+        path: (str) location in config (used in errors)
+
+        Raise ConfigError if a source is invalid
+        """
+        self.parts = []  # (function, argument) yielding values
+        self.count = 0
+        errors = []
+        for item in value if isinstance(value, list) else [value]:
+            try:
+                self._add(item)
+            except (ValueError, TypeError, OSError) as source_error:
+                errors.append("{}: invalid source {!r}: {}".format(
+                    path, item, source_error
+                ))
+        if errors:
+            raise ConfigError(errors)
+
+    def _add(self, item):
+        if not isinstance(item, dict):
+            self.parts.append((iter, (item,)))
+            self.count += 1
+            return
+        if len(item) != 1 or next(iter(item)) not in SOURCES:
+            raise ValueError("expected one of {}".format(', '.join(SOURCES)))
+        kind, argument = next(iter(item.items()))
+        if kind == 'cidr':
+            network = ipaddress.ip_network(argument, strict=False)
+            if _cidr_count(network) > MAX_CIDR_HOSTS:
+                raise ValueError("more than {} addresses".format(
+                    MAX_CIDR_HOSTS
+                ))
+            self.parts.append((_cidr_values, network))
+            self.count += _cidr_count(network)
+        elif kind == 'file':
+            self.parts.append((_file_values, argument))
+            self.count += sum(1 for _ in _file_values(argument))
+        else:
+            first, last = argument
+            if not isinstance(first, int) or not isinstance(last, int):
+                raise TypeError("range bounds must be integers")
+            self.parts.append((iter, range(first, last + 1)))
+            self.count += max(0, last - first + 1)
+
+    def __iter__(self):
+        for function, argument in self.parts:
+            yield from function(argument)
+
+    def __len__(self):
+        return self.count
+
+
+def _combinations(names, sources):
+    """
+    Yield dicts name -> value for every combination of sources (lazy,
+    unlike itertools.product which materializes its inputs)
+    """
+    if not names:
+        yield {}
+        return
+    for value in sources[0]:
+        for combination in _combinations(names[1:], sources[1:]):
+            combination[names[0]] = value
+            yield combination
+
+
+class Expansion:
+    """
+    Generator of services (see module docstring)
+    """
+
+    def __init__(self, probe_name, probe_module, item, path):
+        """
+        Parameters:
+        probe_name: (str) name of the probe
+        probe_module: (module) probe module (with a Spec class)
+        item: (dict) item of the probe list with an expand key
+        path: (str) location in config (used in errors)
+
+        Raise ConfigError with all errors of the item
+        """
+        self.probe_name = probe_name
+        self.probe_module = probe_module
+        self.path = path
+        self.options = dict(item)
+        variables = self.options.pop('expand')
+        template = self.options.pop('template', None)
+        errors = []
+
+        if not isinstance(variables, dict) or not variables:
+            raise ConfigError(
+                ["{}: expand must be a mapping of variables".format(path)]
+            )
+        self.names = list(variables)
+        self.sources = []
+        for name in self.names:
+            try:
+                self.sources.append(Source(
+                    variables[name], "{}.expand.{}".format(path, name)
+                ))
+            except ConfigError as config_error:
+                errors += config_error.errors
+
+        if isinstance(template, str):
+            template = {probe_module.Spec.target_option: template}
+        if template is not None and not isinstance(template, dict):
+            errors.append("{}: template must be a string or a mapping"
+                          .format(path))
+            template = None
+        self.template = template
+        errors += self._check_template()
+        if errors:
+            raise ConfigError(errors)
+
+        # Check options with the first service
+        for service in self.services():
+            probe_module.Spec(service, "{}[expanded]".format(path))
+            break
+
+    def _check_template(self):
+        """
+        Return the list of errors (str) of the template
+        """
+        errors = []
+        for option, pattern in (self.template or {}).items():
+            try:
+                fields = {
+                    field for _, field, _, _ in
+                    string.Formatter().parse(pattern) if field is not None
+                }
+            except (ValueError, AttributeError) as template_error:
+                errors.append("{}: invalid template of {}: {}".format(
+                    self.path, option, template_error
+                ))
+                continue
+            for field in fields - set(self.names):
+                errors.append(
+                    "{}: template of {} uses undefined variable {}".format(
+                        self.path, option, field
+                    )
+                )
+        return errors
+
+    def services(self):
+        """
+        Yield the generated services (dict)
+        """
+        for combination in _combinations(self.names, self.sources):
+            service = dict(self.options)
+            if self.template is None:
+                service.update(combination)
+            else:
+                for option, pattern in self.template.items():
+                    service[option] = pattern.format(**combination)
+            yield service
+
+    def __iter__(self):
+        """
+        Yield (probe name, probe module, Spec object) of generated services
+        (invalid services are skipped, and the rest of the expansion if
+        services can not be generated, e.g. a target file was removed)
+        """
+        spec_class = self.probe_module.Spec
+        path = "{}[expanded]".format(self.path)
+        try:
+            for service in self.services():
+                try:
+                    spec = spec_class(service, path)
+                except Exception as spec_error:
+                    log.error("%s: service %s skipped: %s",
+                              path, service, spec_error)
+                    continue
+                yield self.probe_name, self.probe_module, spec
+        except Exception as source_error:
+            log.error("%s: rest of expansion skipped: %s",
+                      self.path, source_error)
+
+    def __len__(self):
+        count = 1
+        for source in self.sources:
+            count *= len(source)
+        return count
+
+
+def is_expansion(item):
+    """
+    Return True if item of a probe list is an expansion
+    """
+    return isinstance(item, dict) and 'expand' in item
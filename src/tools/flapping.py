@@ -0,0 +1,177 @@
+# Author: FL42
+
+"""
+Alert damping and flap detection
+
+Each target has a small state machine:
+- a target is declared down after failure_threshold consecutive failures
+  and back up after success_threshold consecutive successes,
+- a target whose result changed at least flap_threshold times during the
+  last flap_window probes is flapping: its notifications are replaced by a
+  single "flapping" message until it becomes stable again (at most
+  flap_threshold / 2 changes in the window).
+
+Options (common/alerting section of the config):
+    failure_threshold: (int) default to 1
+    success_threshold: (int) default to 1
+    flap_window: (int) default to 10
+    flap_threshold: (int) default to 6 (0 disables flap detection)
+
+Targets with alerts restored after a restart (see src.tools.state_store)
+start down, so they are not notified again, nor back online, at the first
+cycle.
+"""
+
+import logging
+from collections import deque
+from itertools import islice
+
+from prometheus_client import Gauge
+
+from src.tools.message import Message
+
+log = logging.getLogger(__name__)
+
+FLAPPING_BODY = "Service is flapping, notifications are suppressed"
+
+probe_flapping = Gauge(
+    "probe_flapping", "Target is flapping (1) or not (0)", ("probe", "target")
+)
+
+
+class TargetState:
+    """
+    Alerting state of a target
+    """
+
+    __slots__ = ('down', 'flapping', 'failures', 'successes', 'history',
+                 'messages')
+
+    def __init__(self, window):
+        self.down = False
+        self.flapping = False
+        self.failures = 0  # consecutive failures
+        self.successes = 0  # consecutive successes
+        self.history = deque(maxlen=window)  # True if probe failed
+        self.messages = []  # messages reported while down
+
+    def changes(self):
+        """
+        Number of result changes in history
+        """
+        return sum(
+            previous != current
+            for previous, current in zip(self.history,
+                                         islice(self.history, 1, None))
+        )
+
+
+class FlapDetector:
+    """
+    State machines of all targets of a config
+    """
+
+    def __init__(self, failure_threshold=1, success_threshold=1,
+                 flap_window=10, flap_threshold=6):
+        """
+        See module docstring
+        """
+        self.failure_threshold = failure_threshold
+        self.success_threshold = success_threshold
+        self.flap_window = flap_window
+        self.flap_threshold = flap_threshold
+        self.targets = {}  # (probe, target) -> TargetState
+
+    def update(self, probe, target, messages):
+        """
+        Update the state of target with the result of a probe
+
+        Parameters:
+        probe: (str) probe name
+        target: (str) target of the probe
+        messages: (list of Message objects) result of the probe
+
+        Return:
+        (list of Message objects) messages to notify
+        """
+
+        state = self.targets.get((probe, target))
+        if state is None:
+            state = TargetState(self.flap_window)
+            self.targets[(probe, target)] = state
+
+        failed = bool(messages)
+        state.history.append(failed)
+        if failed:
+            state.failures += 1
+            state.successes = 0
+        else:
+            state.successes += 1
+            state.failures = 0
+
+        if self.flap_threshold > 0:
+            self._detect_flapping(probe, target, state)
+
+        if state.flapping:
+            # Freeze the state: no new alert and no back online message
+            return list(state.messages) + [Message(
+                "[{}] {}".format(probe, target),
+                FLAPPING_BODY,
+                Message.WARNING
+            )]
+
+        if not state.down and state.failures >= self.failure_threshold:
+            state.down = True
+        elif state.down and state.successes >= self.success_threshold:
+            state.down = False
+
+        if not state.down:
+            state.messages = []
+        elif failed:
+            state.messages = list(messages)
+        return list(state.messages)
+
+    def restore(self, alerts):
+        """
+        Set targets of alerts sent before a restart as down
+
+        Parameters:
+        alerts: (dict) Message.key -> AlertState (services are
+                "[probe] target", see src.tools.state_store)
+        """
+        for alert in alerts.values():
+            message = alert.message
+            probe, separator, target = message.service.partition('] ')
+            if not probe.startswith('[') or not separator \
+                    or message.body == FLAPPING_BODY:
+                continue
+            state = self.targets.get((probe[1:], target))
+            if state is None:
+                state = TargetState(self.flap_window)
+                self.targets[(probe[1:], target)] = state
+            state.down = True
+            state.failures = self.failure_threshold
+            state.messages.append(message)
+
+    def forget(self, probe, target):
+        """
+        Drop the state of a target which is no longer probed
+        """
+        self.targets.pop((probe, target), None)
+
+    def _detect_flapping(self, probe, target, state):
+        """
+        Enter or leave flapping state
+        """
+        changes = state.changes()
+        if not state.flapping and changes >= self.flap_threshold:
+            state.flapping = True
+            log.warning("%s %s is flapping", probe, target)
+        elif state.flapping and changes <= self.flap_threshold // 2:
+            state.flapping = False
+            log.info("%s %s is not flapping anymore", probe, target)
+        else:
+            return
+        probe_flapping.labels(probe=probe, target=target).set(
+            int(state.flapping)
+        )
@@ -0,0 +1,118 @@
+# Author: FL42
+
+"""
+Framed protocol between vantage agents and the aggregator
+
+A frame is a header (payload length as 4 bytes big-endian and 1 byte of
+flags) followed by the payload: a compact JSON document, compressed with
+zlib when larger than COMPRESS_THRESHOLD bytes (flag FLAG_ZLIB).
+
+With a shared secret, frames are signed (flag FLAG_HMAC): the payload is
+followed by the HMAC-SHA256 of the header and the payload, and frames
+without a valid signature are rejected.
+
+Addresses are 'host:port' for TCP ('[::1]:9100' for IPv6) or the path of a
+Unix socket (any address containing a /).
+"""
+
+import hashlib
+import hmac
+import json
+import socket
+import struct
+import zlib
+
+HEADER = struct.Struct('!IB')
+FLAG_ZLIB = 1
+FLAG_HMAC = 2
+COMPRESS_THRESHOLD = 1024
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def _signature(secret, header, payload):
+    return hmac.new(
+        secret.encode(), header + payload, hashlib.sha256
+    ).digest()
+
+
+def encode(document, secret=None):
+    """
+    Return the frame (bytes) of document (JSON serializable), signed if
+    secret (str) is set
+    """
+    payload = json.dumps(document, separators=(',', ':')).encode()
+    flags = 0
+    if len(payload) > COMPRESS_THRESHOLD:
+        payload = zlib.compress(payload)
+        flags |= FLAG_ZLIB
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ValueError("Frame too large ({} bytes)".format(len(payload)))
+    if secret is None:
+        return HEADER.pack(len(payload), flags) + payload
+    header = HEADER.pack(len(payload), flags | FLAG_HMAC)
+    return header + payload + _signature(secret, header, payload)
+
+
+def read_frame(stream, secret=None):
+    """
+    Read a frame from stream (binary file object, see socket.makefile)
+
+    Parameters:
+    stream: binary file object
+    secret: (str) shared secret (frames must be signed if set)
+
+    Return:
+    the decoded document or None at end of stream
+
+    Raise ValueError if the frame is invalid
+    """
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise ValueError("Truncated frame header")
+    length, flags = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError("Frame too large ({} bytes)".format(length))
+    payload = stream.read(length)
+    if len(payload) < length:
+        raise ValueError("Truncated frame")
+    if secret is not None or flags & FLAG_HMAC:
+        _check_signature(stream, secret, header, payload)
+    try:
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        return json.loads(payload)
+    except (zlib.error, UnicodeDecodeError, json.JSONDecodeError) \
+            as decode_error:
+        raise ValueError("Invalid frame: {}".format(decode_error)) \
+            from decode_error
+
+
+def _check_signature(stream, secret, header, payload):
+    """
+    Read the signature of a frame from stream
+
+    Raise ValueError if it does not match secret
+    """
+    _, flags = HEADER.unpack(header)
+    if secret is None:
+        raise ValueError("Signed frame but no secret configured")
+    if not flags & FLAG_HMAC:
+        raise ValueError("Unsigned frame")
+    signature = stream.read(hashlib.sha256().digest_size)
+    if not hmac.compare_digest(
+            signature, _signature(secret, header, payload)):
+        raise ValueError("Invalid frame signature")
+
+
+def parse_address(address):
+    """
+    Return (socket family, address) of address (see module docstring)
+    """
+    if '/' in address:
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(':')
+    host = host.strip('[]')
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    return family, (host, int(port))
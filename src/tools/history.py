@@ -0,0 +1,447 @@
+# Author: FL42
+
+"""
+In-memory history of probe results
+
+Each target has a ring buffer of fixed-width columns (array module):
+timestamp (uint32, 4 bytes), status (uint8, 1 byte) and latency in
+milliseconds (uint16, 2 bytes, capped at 65.535 s), i.e. 7 bytes per
+sample. The capacity is retention / resolution samples and results closer
+than resolution seconds are merged (down if any is down, worst latency) so
+memory is bounded: columns grow as samples arrive and are only allocated
+for the history actually recorded. With the defaults (30 days at 1 minute
+resolution) a target takes up to about 300 KB, i.e. about 3 GB for 10k
+targets: lower retention or raise resolution for large configs.
+
+Queries (uptime, MTTR, latency percentiles over a window) select the
+window by bisection and work on whole columns (sum, sorted, bytes.find)
+instead of Python loops over samples.
+
+Gauges are computed from running statistics of each window of
+gauge_windows (WindowStats: count of samples, of successful samples and
+of latencies in log buckets, about 1 KB per target and window) updated as
+samples are added and leave the window, so a scrape does not sort
+latencies. Their percentiles are within LATENCY_GROWTH of the exact ones.
+
+Results are exposed:
+- as JSON on /history?probe=...&target=...&window=... (see handle),
+- as probe_uptime_ratio and probe_latency_seconds gauges for each
+  window of gauge_windows (targets above max_target_series of
+  src.tools.metrics are not exported).
+
+Options (common/history section of the config):
+    retention: (int) seconds of history to keep (default to 30 days)
+    resolution: (int) minimum seconds between samples (default to 60)
+    gauge_windows: (list of int) windows in seconds exported as gauges
+                   (default to [86400])
+"""
+
+import json
+import logging
+import math
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from time import time
+
+from prometheus_client.core import REGISTRY, GaugeMetricFamily
+
+from src.tools import metrics
+
+log = logging.getLogger(__name__)
+
+MAX_LATENCY_MS = 0xFFFF
+QUANTILES = (0.5, 0.9, 0.99)
+DOWN_TO_UP = b'\x00\x01'
+UP_TO_DOWN = b'\x01\x00'
+# Latency buckets of WindowStats: bucket i holds latencies (ms) from
+# LATENCY_GROWTH ** i - 1 to LATENCY_GROWTH ** (i + 1) - 1
+LATENCY_GROWTH = 1.05
+_LOG_GROWTH = math.log(LATENCY_GROWTH)
+LATENCY_BUCKETS = int(math.log1p(MAX_LATENCY_MS) / _LOG_GROWTH) + 1
+
+
+def _nearest_rank(quantile, count):
+    """
+    Return the rank (1 to count) of quantile in count samples
+    """
+    return min(count, max(1, int(quantile * count + 0.5)))
+
+
+class WindowStats:
+    """
+    Running statistics of the samples of a ResultHistory in the last
+    window seconds (see module docstring)
+    """
+
+    __slots__ = ('window', 'first', 'count', 'up', 'buckets')
+
+    def __init__(self, window):
+        """
+        Parameters:
+        window: (int) seconds
+        """
+        self.window = window
+        self.first = 0  # sequence number of the oldest sample counted
+        self.count = 0
+        self.up = 0
+        self.buckets = array('I', [0]) * LATENCY_BUCKETS
+
+    def add(self, status, latency, sign=1):
+        """
+        Count a sample (sign=1) or uncount it (sign=-1)
+
+        Parameters:
+        status: (int) 1 up, 0 down
+        latency: (int) milliseconds
+        sign: (int) 1 or -1
+        """
+        self.count += sign
+        self.up += sign * status
+        self.buckets[int(math.log1p(latency) / _LOG_GROWTH)] += sign
+
+    def percentiles(self, quantiles=QUANTILES):
+        """
+        Return the latencies in seconds at quantiles (nearest rank, middle
+        of its bucket), as a dict quantile -> latency (empty without
+        samples)
+        """
+        if not self.count:
+            return {}
+        cumulative = list(accumulate(self.buckets))
+        result = {}
+        for quantile in quantiles:
+            bucket = bisect_left(
+                cumulative, _nearest_rank(quantile, self.count)
+            )
+            result[quantile] = min(
+                math.expm1((bucket + 0.5) * _LOG_GROWTH), MAX_LATENCY_MS
+            ) / 1000
+        return result
+
+
+class ResultHistory:
+    """
+    Ring buffer of the results of a target
+    """
+
+    __slots__ = ('capacity', 'resolution', 'timestamps', 'statuses',
+                 'latencies', 'appended', 'stats')
+
+    def __init__(self, capacity, resolution=0, windows=()):
+        """
+        Parameters:
+        capacity: (int) maximum number of samples
+        resolution: (int) minimum seconds between samples
+        windows: (list of int) windows in seconds with running statistics
+        """
+        self.capacity = capacity
+        self.resolution = resolution
+        # Columns grow up to capacity, then oldest samples are overwritten
+        self.timestamps = array('I')
+        self.statuses = array('B')
+        self.latencies = array('H')
+        # Sample with sequence number n is at position n % capacity
+        self.appended = 0
+        self.stats = tuple(WindowStats(window) for window in windows)
+
+    def append(self, timestamp, success, duration):
+        """
+        Add a result
+
+        Parameters:
+        timestamp: (float) time of the result
+        success: (bool) result of the probe
+        duration: (float) duration of the probe in seconds
+        """
+
+        timestamp = int(timestamp)
+        latency = min(int(duration * 1000), MAX_LATENCY_MS)
+        index = self.appended % self.capacity  # next position to write
+        last = (index - 1) % self.capacity
+        if self.appended \
+                and timestamp - self.timestamps[last] < self.resolution:
+            self._merge(last, success, latency)
+            return
+
+        if self.appended < self.capacity:
+            self.timestamps.append(timestamp)
+            self.statuses.append(int(success))
+            self.latencies.append(latency)
+        else:
+            # Oldest sample is overwritten
+            for stats in self.stats:
+                if stats.first <= self.appended - self.capacity:
+                    stats.add(
+                        self.statuses[index],
+                        self.latencies[index],
+                        -1
+                    )
+                    stats.first += 1
+            self.timestamps[index] = timestamp
+            self.statuses[index] = int(success)
+            self.latencies[index] = latency
+        for stats in self.stats:
+            stats.add(int(success), latency)
+        self.appended += 1
+
+    def _merge(self, last, success, latency):
+        """
+        Merge a result into the sample at position last (the newest)
+        """
+        counted = [
+            stats for stats in self.stats if stats.first < self.appended
+        ]
+        for stats in counted:
+            stats.add(self.statuses[last], self.latencies[last], -1)
+        self.statuses[last] &= int(success)
+        self.latencies[last] = max(self.latencies[last], latency)
+        for stats in counted:
+            stats.add(self.statuses[last], self.latencies[last])
+
+    def expire(self, now):
+        """
+        Uncount samples which left the windows of stats
+        """
+        for stats in self.stats:
+            start = now - stats.window
+            while stats.first < self.appended:
+                position = stats.first % self.capacity
+                if self.timestamps[position] >= start:
+                    break
+                stats.add(
+                    self.statuses[position], self.latencies[position], -1
+                )
+                stats.first += 1
+
+    def _segments(self):
+        """
+        Return physical (start, end) ranges in chronological order
+        """
+        if self.appended < self.capacity:
+            return ((0, self.appended),)
+        index = self.appended % self.capacity
+        return ((index, self.capacity), (0, index))
+
+    def window(self, start, end):
+        """
+        Return (timestamps, statuses, latencies) arrays of the samples
+        with start <= timestamp <= end, in chronological order
+        """
+        timestamps = array('I')
+        statuses = array('B')
+        latencies = array('H')
+        for low, high in self._segments():
+            first = bisect_left(self.timestamps, start, low, high)
+            last = bisect_right(self.timestamps, end, first, high)
+            timestamps += self.timestamps[first:last]
+            statuses += self.statuses[first:last]
+            latencies += self.latencies[first:last]
+        return timestamps, statuses, latencies
+
+
+def uptime(statuses):
+    """
+    Return the ratio of successful samples (None without samples)
+    """
+    if not statuses:
+        return None
+    return sum(statuses) / len(statuses)
+
+
+def _transitions(status_bytes, pattern):
+    """
+    Return the indexes where status changes as pattern (second sample)
+    """
+    indexes = []
+    position = status_bytes.find(pattern)
+    while position != -1:
+        indexes.append(position + 1)
+        position = status_bytes.find(pattern, position + 1)
+    return indexes
+
+
+def mttr(timestamps, statuses):
+    """
+    Return the mean time to recovery in seconds of the outages which
+    started and ended in the window (None if none)
+    """
+    status_bytes = statuses.tobytes()
+    failures = _transitions(status_bytes, UP_TO_DOWN)
+    recoveries = _transitions(status_bytes, DOWN_TO_UP)
+    if recoveries and failures and recoveries[0] < failures[0]:
+        recoveries = recoveries[1:]  # outage started before the window
+    durations = [
+        timestamps[recovery] - timestamps[failure]
+        for failure, recovery in zip(failures, recoveries)
+    ]
+    if not durations:
+        return None
+    return sum(durations) / len(durations)
+
+
+def percentiles(latencies, quantiles=QUANTILES):
+    """
+    Return the latencies in seconds at quantiles (nearest rank),
+    as a dict quantile -> latency (empty without samples)
+    """
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    return {
+        quantile: ordered[_nearest_rank(quantile, len(ordered)) - 1] / 1000
+        for quantile in quantiles
+    }
+
+
+class HistoryStore:
+    """
+    Result histories of all targets
+    """
+
+    def __init__(self, retention=30 * 86400, resolution=60,
+                 gauge_windows=(86400,)):
+        """
+        See module docstring for parameters
+        """
+        self.options = {
+            'retention': retention,
+            'resolution': resolution,
+            'gauge_windows': list(gauge_windows)
+        }
+        self.capacity = max(1, retention // max(1, resolution))
+        self.resolution = resolution
+        self.gauge_windows = tuple(gauge_windows)
+        self.histories = {}  # (probe, target) -> ResultHistory
+        self._lock = threading.Lock()
+
+    def append(self, probe, target, timestamp, success, duration):
+        """
+        Add a result of target (see ResultHistory.append)
+        """
+        with self._lock:
+            history = self.histories.get((probe, target))
+            if history is None:
+                history = ResultHistory(
+                    self.capacity, self.resolution, self.gauge_windows
+                )
+                self.histories[(probe, target)] = history
+            history.append(timestamp, success, duration)
+
+    def summary(self, probe, target, window, now=None):
+        """
+        Return statistics of target over the last window seconds
+
+        Return:
+        (dict) samples, uptime, mttr_seconds and latency_seconds
+        (quantile -> latency) or None if target is unknown
+        """
+        now = time() if now is None else now
+        with self._lock:
+            history = self.histories.get((probe, target))
+            if history is None:
+                return None
+            timestamps, statuses, latencies = history.window(now - window, now)
+        return {
+            'samples': len(statuses),
+            'uptime': uptime(statuses),
+            'mttr_seconds': mttr(timestamps, statuses),
+            'latency_seconds': percentiles(latencies)
+        }
+
+    def collect(self):
+        """
+        Custom collector (see prometheus_client)
+        """
+        uptime_gauge = GaugeMetricFamily(
+            'probe_uptime_ratio',
+            'Ratio of successful probes over window',
+            labels=('probe', 'target', 'window')
+        )
+        latency_gauge = GaugeMetricFamily(
+            'probe_latency_seconds',
+            'Latency of probes at quantile over window',
+            labels=('probe', 'target', 'window', 'quantile')
+        )
+        now = time()
+        with self._lock:
+            for (probe, target), history in self.histories.items():
+                if metrics.target_label(probe, target) \
+                        == metrics.OVERFLOW_TARGET:
+                    continue
+                history.expire(now)
+                for stats in history.stats:
+                    if not stats.count:
+                        continue
+                    window = str(stats.window)
+                    uptime_gauge.add_metric(
+                        (probe, target, window),
+                        stats.up / stats.count
+                    )
+                    for quantile, latency in stats.percentiles().items():
+                        latency_gauge.add_metric(
+                            (probe, target, window, str(quantile)),
+                            latency
+                        )
+        yield uptime_gauge
+        yield latency_gauge
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(options=None):
+    """
+    Return the history store shared by all config threads
+    (created and registered in prometheus at first call)
+    """
+
+    global _store  # pylint: disable=global-statement
+
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore(**(options or {}))
+            REGISTRY.register(_store)
+        elif options and any(
+                _store.options[key] != value
+                for key, value in options.items()):
+            log.warning(
+                "History already created with options %s: options %s ignored",
+                _store.options,
+                options
+            )
+    return _store
+
+
+def handle(query):
+    """
+    Handler of /history (see src.tools.http_server)
+
+    Parameters (query):
+    probe: (str) probe name
+    target: (str) target of the probe
+    window: (int) seconds (default to 86400)
+    """
+
+    if _store is None:
+        return 404, 'text/plain', b'History is not enabled\n'
+    try:
+        window = int(query.get('window', 86400))
+        probe, target = query['probe'], query['target']
+    except (KeyError, ValueError):
+        return (
+            400,
+            'text/plain',
+            b'Parameters probe, target and window (int) are required\n'
+        )
+
+    summary = _store.summary(probe, target, window)
+    if summary is None:
+        return 404, 'text/plain', b'Unknown target\n'
+    summary['latency_seconds'] = {
+        str(quantile): latency
+        for quantile, latency in summary['latency_seconds'].items()
+    }
+    return 200, 'application/json', json.dumps(summary).encode()
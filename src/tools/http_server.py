@@ -0,0 +1,89 @@
+# Author: FL42
+
+"""
+HTTP server exposing prometheus metrics (/metrics) and other endpoints
+registered by path
+
+A handler is called with the query parameters of the request (dict of str)
+and returns (status code, content type, body as bytes).
+"""
+
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
+
+log = logging.getLogger(__name__)
+
+
+def metrics_handler(_query):
+    """
+    Prometheus metrics of the default registry
+    """
+    return 200, CONTENT_TYPE_LATEST, generate_latest(REGISTRY)
+
+
+# Registered handlers (path -> function)
+routes = {
+    '/metrics': metrics_handler
+}
+
+
+def register(path, function):
+    """
+    Register function as handler of path
+    """
+    routes[path] = function
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    Dispatch GET requests to registered handlers
+    """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Handle GET requests
+        """
+        url = urlparse(self.path)
+        path = url.path if url.path != '/' else '/metrics'
+        function = routes.get(path)
+        if function is None:
+            status_code, content_type, body = \
+                404, 'text/plain', b'Not found\n'
+        else:
+            try:
+                status_code, content_type, body = \
+                    function(dict(parse_qsl(url.query)))
+            except Exception as handler_exception:
+                log.exception(handler_exception)
+                status_code, content_type, body = \
+                    500, 'text/plain', b'Internal error\n'
+
+        self.send_response(status_code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        log.debug(format, *args)
+
+
+def start(port, address=''):
+    """
+    Start the HTTP server in a daemon thread
+
+    Return:
+    (ThreadingHTTPServer) server
+    """
+    server = ThreadingHTTPServer((address, port), RequestHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever,
+        name='http-server',
+        daemon=True
+    ).start()
+    return server
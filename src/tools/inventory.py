@@ -0,0 +1,184 @@
+# Author: FL42
+
+"""
+Certificate inventory of all TLS endpoints found in config files
+
+Endpoints are https urls and smtp hosts (STARTTLS), with a TLSA check for
+services with check_tlsa set (check_tlsa of dns services is ignored, see
+src.probes.dns).
+Certificates are fetched concurrently and described in a compact record:
+probe, host, port, subject, san, issuer, not_after, key_type, fingerprint,
+tlsa and error. Generated services (see src.tools.expansion) are expanded.
+"""
+
+import csv
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import urllib3
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from cryptography.x509 import (DNSName, ExtensionNotFound,
+                               SubjectAlternativeName)
+
+from src.probes import https, smtp
+from src.tools import TLSA, tls
+from src.tools.certificate import parse_asn1_time
+from src.tools.expansion import Expansion, is_expansion
+from src.tools.tlsa import get_fingerprint
+
+log = logging.getLogger(__name__)
+
+FIELDS = (
+    'probe', 'host', 'port', 'subject', 'san', 'issuer', 'not_after',
+    'key_type', 'fingerprint', 'tlsa', 'error'
+)
+
+
+def collect_endpoints(configs):
+    """
+    Parameters:
+    configs: (list of dict) parsed config files
+
+    Return:
+    (list of tuple) (probe, host, port, check_tlsa) without duplicates
+    """
+
+    endpoints = {}
+
+    def services(probe_name, probe_module):
+        for index, service in enumerate(config_probes.get(probe_name, [])):
+            if is_expansion(service):
+                yield from Expansion(
+                    probe_name, probe_module, service,
+                    "probes.{}[{}]".format(probe_name, index)
+                ).services()
+            else:
+                yield service
+
+    def add(probe, host, port, check_tlsa):
+        key = (probe, host, port)
+        endpoints[key] = endpoints.get(key, False) or check_tlsa
+
+    for config in configs:
+        config_probes = config.get('probes', {})
+
+        for service in services('https', https):
+            parsed_url = urllib3.util.parse_url(service['url'])
+            if parsed_url.scheme == 'https':
+                add(
+                    'https',
+                    parsed_url.host,
+                    parsed_url.port if parsed_url.port is not None else 443,
+                    service.get('check_tlsa', False)
+                )
+
+        for service in services('smtp', smtp):
+            add(
+                'smtp',
+                service['host'],
+                service.get('port', 25),
+                service.get('check_tlsa', False)
+            )
+
+    return [key + (check_tlsa,) for key, check_tlsa in endpoints.items()]
+
+
+def _key_type(public_key):
+    """
+    Return key type and size, e.g. RSA-2048
+    """
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return "RSA-{}".format(public_key.key_size)
+    if isinstance(public_key, ec.EllipticCurvePublicKey):
+        return "EC-{}".format(public_key.curve.name)
+    return type(public_key).__name__
+
+
+def describe(endpoint, cert):
+    """
+    Return the inventory record (dict) of cert fetched from endpoint
+    """
+
+    probe, host, port, check_tlsa = endpoint
+    x509 = cert.to_cryptography()
+
+    try:
+        san = x509.extensions.get_extension_for_class(
+            SubjectAlternativeName
+        ).value.get_values_for_type(DNSName)
+    except ExtensionNotFound:
+        san = []
+
+    if check_tlsa:
+        messages = TLSA("[{}] {}:{}".format(probe, host, port)).check_tlsa(
+            host, port, cert
+        )
+        tlsa = '; '.join(message.body for message in messages) or 'valid'
+    else:
+        tlsa = 'not checked'
+
+    return {
+        'probe': probe,
+        'host': host,
+        'port': port,
+        'subject': x509.subject.rfc4514_string(),
+        'san': ' '.join(san),
+        'issuer': x509.issuer.rfc4514_string(),
+        'not_after': datetime.fromtimestamp(
+            parse_asn1_time(cert.get_notAfter()), timezone.utc
+        ).isoformat(),
+        'key_type': _key_type(x509.public_key()),
+        'fingerprint': get_fingerprint(cert),
+        'tlsa': tlsa,
+        'error': ''
+    }
+
+
+def scan_endpoint(endpoint):
+    """
+    Fetch the certificate of endpoint and return its inventory record
+    """
+
+    probe, host, port, _ = endpoint
+    try:
+        if probe == 'smtp':
+            cert = smtp.get_certificate(host, port)
+        else:
+            cert = tls.get_certificate(host, port)
+        return describe(endpoint, cert)
+    except Exception as scan_exception:
+        log.warning("Failed to scan %s:%d: %s", host, port, scan_exception)
+        record = dict.fromkeys(FIELDS, '')
+        record.update(
+            probe=probe,
+            host=host,
+            port=port,
+            error=str(scan_exception)
+        )
+        return record
+
+
+def scan(endpoints, concurrency=32):
+    """
+    Fetch all certificates with at most concurrency connections at a time
+
+    Return:
+    (iterator of dict) inventory records (same order as endpoints)
+    """
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        yield from executor.map(scan_endpoint, endpoints)
+
+
+def write_inventory(records, output, output_format='jsonl'):
+    """
+    Write records to the output file object as JSON lines or CSV
+    """
+    if output_format == 'csv':
+        writer = csv.DictWriter(output, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+    else:
+        for record in records:
+            output.write(json.dumps(record, separators=(',', ':')) + '\n')
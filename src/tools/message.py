@@ -4,22 +4,49 @@
 Define useful classes
 """
 
+from typing import Optional
+
 
 class Message:
     """
     Provide Message abstratction to communicate probe results
+
+    Message objects are immutable and hashable (attributes are declared as
+    annotations as slots are set with object.__setattr__).
     """
 
+    __slots__ = ('service', 'body', 'severity', 'header')
+    service: str
+    body: str
+    severity: int
+    header: Optional[str]
+
     # Class attributes for severity
     ERROR = 40
     WARNING = 30
     INFO = 20
 
     def __init__(self, service, body, severity, header=None):
-        self.service = service
-        self.body = body
-        self.severity = severity  # Expects values defined above
-        self.header = header
+        object.__setattr__(self, 'service', service)
+        object.__setattr__(self, 'body', body)
+        object.__setattr__(self, 'severity', severity)  # Expects values above
+        object.__setattr__(self, 'header', header)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Message objects are immutable")
+
+    def __reduce__(self):
+        return (
+            Message,
+            (self.service, self.body, self.severity, self.header)
+        )
+
+    @property
+    def key(self):
+        """
+        (tuple) (service, body, severity) identifying the alert
+        """
+        return (self.service, self.body, self.severity)
 
     def __str__(self):
         return "{}{}: {}".format(
@@ -39,11 +66,34 @@ class Message:
 
     def __eq__(self, message):
 
-        if self.service == message.service \
-           and self.body == message.body \
-           and self.severity == message.severity \
-           and self.header == message.header:
+        if not isinstance(message, Message):
+            return NotImplemented
+
+        return self.service == message.service \
+            and self.body == message.body \
+            and self.severity == message.severity \
+            and self.header == message.header
 
-            return True
+    def __hash__(self):
+        return hash((self.service, self.body, self.severity, self.header))
 
-        return False
+
+class AlertState:
+    """
+    State of an alert (i.e. a Message sent as notification)
+    """
+
+    __slots__ = ('message', 'first_seen', 'last_seen')
+
+    def __init__(self, message, first_seen, last_seen=None):
+        self.message = message
+        self.first_seen = first_seen
+        self.last_seen = last_seen if last_seen is not None else first_seen
+
+    def __repr__(self):
+        return "AlertState: message: {!r}, first_seen: {}, " \
+               "last_seen: {}".format(
+                   self.message,
+                   self.first_seen,
+                   self.last_seen
+               )
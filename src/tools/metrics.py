@@ -0,0 +1,189 @@
+# Author: FL42
+
+"""
+Probe metrics
+
+- probe_duration_seconds: histogram of the duration of each probe attempt
+  (successful or not),
+- probe_up: result of the last probe of a target (1 up, 0 down),
+- probe_success_total / probe_failures_total: results of probes
+  (after retries),
+- probe_retries_total: attempts retried after an error or a warning.
+
+Prometheus buckets can not be changed once a histogram is created so the
+options of the first config win (shared by all config threads).
+
+The number of targets exported per probe is limited to guard against
+configs with thousands of targets: the durations and counters of targets
+above the limit are aggregated under the target "_other" and their
+probe_up is not exported (probe_up_overflow_targets counts them).
+
+Options (common section of the config):
+    duration_buckets: (list of float) buckets in seconds
+                      (default to DEFAULT_BUCKETS)
+    max_target_series: (int) maximum number of targets per probe
+                       (default to 1000)
+"""
+
+import logging
+import threading
+
+from prometheus_client import Counter, Gauge, Histogram
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DEFAULT_MAX_TARGET_SERIES = 1000
+OVERFLOW_TARGET = '_other'
+
+probe_up = Gauge(
+    "probe_up", "Result of the last probe (1 up, 0 down)", ("probe", "target")
+)
+probe_up_overflow_targets = Gauge(
+    "probe_up_overflow_targets",
+    "Number of targets above max_target_series (not exported)",
+    ("probe",)
+)
+probe_success_total = Counter(
+    "probe_success_total", "Number of successful probes", ("probe", "target")
+)
+probe_failures_total = Counter(
+    "probe_failures_total", "Number of failed probes", ("probe", "target")
+)
+probe_retries_total = Counter(
+    "probe_retries_total", "Number of retried probe attempts",
+    ("probe", "target")
+)
+
+
+class SeriesLimiter:
+    """
+    Limit the number of target label values per probe
+    """
+
+    def __init__(self, max_targets=DEFAULT_MAX_TARGET_SERIES):
+        self.max_targets = max_targets
+        self._targets = {}  # probe -> set of admitted targets
+        self._overflow = {}  # probe -> set of rejected targets
+        self._lock = threading.Lock()
+
+    def target_label(self, probe, target):
+        """
+        Return the label to use for target (target or OVERFLOW_TARGET)
+        """
+        with self._lock:
+            targets = self._targets.setdefault(probe, set())
+            if target in targets:
+                return target
+            if len(targets) < self.max_targets:
+                targets.add(target)
+                return target
+            overflow = self._overflow.setdefault(probe, set())
+            if target not in overflow:
+                overflow.add(target)
+                if len(overflow) == 1:
+                    log.warning(
+                        "More than %d targets for probe %s: "
+                        "metrics of new targets are aggregated",
+                        self.max_targets,
+                        probe
+                    )
+                probe_up_overflow_targets.labels(probe=probe) \
+                    .set(len(overflow))
+        return OVERFLOW_TARGET
+
+
+_probe_duration_seconds = None
+_limiter = None
+_options = None
+_lock = threading.Lock()
+
+
+def configure(common_config):
+    """
+    Create the metrics with the options of common_config
+    (first call wins, see module docstring)
+    """
+
+    # pylint: disable=global-statement
+    global _probe_duration_seconds, _limiter, _options
+
+    options = (
+        tuple(common_config.get('duration_buckets', DEFAULT_BUCKETS)),
+        common_config.get('max_target_series', DEFAULT_MAX_TARGET_SERIES)
+    )
+    with _lock:
+        if _options is None:
+            _options = options
+            _probe_duration_seconds = Histogram(
+                "probe_duration_seconds",
+                "Duration of probe attempts",
+                ("probe", "target"),
+                buckets=options[0]
+            )
+            _limiter = SeriesLimiter(options[1])
+        elif options != _options:
+            log.warning(
+                "Probe metrics already configured with %s: %s ignored",
+                _options,
+                options
+            )
+
+
+def target_label(probe, target):
+    """
+    Return the target label of target in probe metrics
+    (OVERFLOW_TARGET above max_target_series)
+    """
+
+    if _options is None:
+        configure({})
+
+    return _limiter.target_label(probe, target)
+
+
+def observe(probe, target, success, durations):
+    """
+    Record the result of a probe
+
+    Parameters:
+    probe: (str) probe name
+    target: (str) target of the probe
+    success: (bool) final result of the probe
+    durations: (list of float) duration of each attempt in seconds
+    """
+
+    if _options is None:
+        configure({})
+
+    label = _limiter.target_label(probe, target)
+    histogram = _probe_duration_seconds.labels(probe=probe, target=label)
+    for duration in durations:
+        histogram.observe(duration)
+    if len(durations) > 1:
+        probe_retries_total.labels(probe=probe, target=label) \
+            .inc(len(durations) - 1)
+    if success:
+        probe_success_total.labels(probe=probe, target=label).inc()
+    else:
+        probe_failures_total.labels(probe=probe, target=label).inc()
+    if label != OVERFLOW_TARGET:
+        probe_up.labels(probe=probe, target=label).set(int(success))
+
+
+def restore(results):
+    """
+    Export probe_up of results restored after a restart, until targets are
+    probed again (see src.tools.state_store)
+
+    Parameters:
+    results: (dict) (probe, target) -> (success, duration, timestamp)
+    """
+
+    if _options is None:
+        configure({})
+
+    for (probe, target), (success, _, _) in results.items():
+        label = _limiter.target_label(probe, target)
+        if label != OVERFLOW_TARGET:
+            probe_up.labels(probe=probe, target=label).set(int(success))
@@ -0,0 +1,308 @@
+# Author: FL42
+
+"""
+Optional process pool for CPU-bound probe stages
+
+Without process pool (default), run(function, *args) calls function in the
+current thread. With a process pool (process_pool section of common), calls
+of all threads are queued and a dispatcher thread submits them to the pool
+in batches (up to batch_size calls, waiting at most batch_delay seconds
+for a batch to fill up), so probe threads doing I/O don't compete for the
+GIL with hashing, certificate parsing and regex matching.
+
+bytes arguments (DER certificates) of a batch are copied once into a
+shared memory segment: workers read them through memoryviews instead of
+unpickling a copy of each argument. Functions must be defined at module
+level (picklable) and accept bytes-like objects.
+
+Workers are started by a fork server rather than forked from the
+monitor, whose other threads may hold locks (logging, SSL...) at the time
+of the fork.
+
+Options (process_pool section of common, first config wins):
+    workers: (int) number of processes (default to the number of CPUs)
+    batch_size: (int) maximum number of calls per batch (default to 64)
+    batch_delay: (float) maximum seconds to wait for a batch to fill up
+                 (default to 0.002)
+
+Functions run in the pool:
+    src.tools.tlsa.hash_certificate: hash of a certificate for a TLSA record
+    regex_search: pattern matching of a page (see src.probes.https)
+"""
+
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from time import monotonic
+
+from prometheus_client import Histogram
+
+log = logging.getLogger(__name__)
+
+offload_batch_size = Histogram(
+    "offload_batch_size",
+    "Number of calls per batch submitted to the process pool",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+
+
+def regex_search(regex, text):
+    """
+    Return True if regex (compiled pattern) matches text (str)
+    (compiled patterns are pickled as their source and recompiled by
+    workers, see the cache of the re module)
+    """
+    return regex.search(text) is not None
+
+
+def _init_worker():
+    """
+    Ignore signals sent to the process group: workers are stopped by the
+    monitor (see shutdown)
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    for signum in (signal.SIGINT, signal.SIGUSR1):
+        signal.signal(signum, signal.SIG_IGN)
+
+
+class _Shared:
+    """
+    Placeholder of a bytes argument stored in the shared memory of a batch
+    """
+
+    __slots__ = ('offset', 'length')
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+
+def _run_batch(memory_name, calls):
+    """
+    Run calls (list of (function, args)) in a worker
+
+    Return:
+    (list of tuples) (True, result) or (False, exception) for each call
+    """
+    memory = None
+    views = []
+    if memory_name is not None:
+        memory = shared_memory.SharedMemory(memory_name)
+    results = []
+    try:
+        for function, args in calls:
+            resolved = []
+            for arg in args:
+                if isinstance(arg, _Shared):
+                    view = memory.buf[arg.offset:arg.offset + arg.length]
+                    views.append(view)
+                    arg = view
+                resolved.append(arg)
+            try:
+                results.append((True, function(*resolved)))
+            except Exception as call_exception:
+                results.append((False, call_exception))
+    finally:
+        # Memoryviews must be released before closing the segment
+        for view in views:
+            view.release()
+        if memory is not None:
+            memory.close()
+    return results
+
+
+class Offloader:
+    """
+    See module docstring
+    """
+
+    def __init__(self, workers=None, batch_size=64, batch_delay=0.002):
+        self.options = {
+            'workers': workers,
+            'batch_size': batch_size,
+            'batch_delay': batch_delay
+        }
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # Workers are not forked from the monitor: a fork of a process
+        # running threads may copy locks held by other threads
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('forkserver'),
+            initializer=_init_worker
+        )
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(
+            target=self._dispatch, name='offload', daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, function, args):
+        """
+        Queue a call of function
+
+        Return:
+        (concurrent.futures.Future) result of the call
+        """
+        future = Future()
+        self.queue.put((function, args, future))
+        return future
+
+    def _next_batch(self):
+        """
+        Return up to batch_size queued calls (None to stop)
+        """
+        first = self.queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = monotonic() + self.batch_delay
+        while len(batch) < self.batch_size:
+            remaining = deadline - monotonic()
+            try:
+                call = self.queue.get(timeout=remaining) if remaining > 0 \
+                    else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if call is None:
+                self.queue.put(None)  # stop after this batch
+                break
+            batch.append(call)
+        return batch
+
+    def _dispatch(self):
+        """
+        Submit batches to the pool until shutdown
+        """
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            offload_batch_size.observe(len(batch))
+            try:
+                self._submit_batch(batch)
+            except Exception as submit_exception:
+                for _, _, future in batch:
+                    future.set_exception(submit_exception)
+
+    @staticmethod
+    def _pack(batch):
+        """
+        Copy bytes arguments of batch into shared memory
+
+        Return:
+        (tuple) shared memory (None without bytes arguments) and calls
+        (list of (function, args)) for _run_batch
+        """
+        size = sum(
+            len(arg) for _, args, _ in batch for arg in args
+            if isinstance(arg, bytes) and arg
+        )
+        memory = shared_memory.SharedMemory(create=True, size=size) \
+            if size else None
+        calls = []
+        offset = 0
+        for function, args, _ in batch:
+            packed = []
+            for arg in args:
+                if isinstance(arg, bytes) and arg:
+                    memory.buf[offset:offset + len(arg)] = arg
+                    arg = _Shared(offset, len(arg))
+                    offset += arg.length
+                packed.append(arg)
+            calls.append((function, tuple(packed)))
+        return memory, calls
+
+    @staticmethod
+    def _release(memory):
+        if memory is not None:
+            memory.close()
+            memory.unlink()
+
+    def _submit_batch(self, batch):
+        """
+        Submit batch to the pool (futures of its calls are completed when
+        the batch is done)
+        """
+        memory, calls = self._pack(batch)
+
+        def done(batch_future):
+            self._release(memory)
+            try:
+                results = batch_future.result()
+            except Exception as batch_exception:
+                results = [(False, batch_exception)] * len(batch)
+            for (_, _, future), (success, value) in zip(batch, results):
+                if success:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+        try:
+            batch_future = self.executor.submit(
+                _run_batch, memory.name if memory is not None else None, calls
+            )
+        except Exception:
+            self._release(memory)
+            raise
+        batch_future.add_done_callback(done)
+
+    def shutdown(self):
+        """
+        Run queued calls and stop the pool
+        """
+        self.queue.put(None)
+        self.thread.join()
+        self.executor.shutdown()
+
+
+_offloader = None
+_offloader_lock = threading.Lock()
+
+
+def configure(options):
+    """
+    Create the process pool shared by all config threads
+    (first call wins, see module docstring)
+    """
+
+    global _offloader  # pylint: disable=global-statement
+
+    with _offloader_lock:
+        if _offloader is None:
+            _offloader = Offloader(**(options or {}))
+            log.info("Process pool started: %s", _offloader.options)
+        elif options and any(
+                _offloader.options[key] != value
+                for key, value in options.items()):
+            log.warning(
+                "Process pool already started with %s: options %s ignored",
+                _offloader.options,
+                options
+            )
+
+
+def run(function, *args):
+    """
+    Return function(*args), computed in the process pool if configured
+    """
+    if _offloader is None:
+        return function(*args)
+    return _offloader.submit(function, args).result()
+
+
+def shutdown():
+    """
+    Stop the process pool (calls are then run in the calling thread)
+    """
+
+    global _offloader  # pylint: disable=global-statement
+
+    with _offloader_lock:
+        offloader, _offloader = _offloader, None
+    if offloader is not None:
+        offloader.shutdown()
@@ -0,0 +1,163 @@
+# Author: FL42
+
+"""
+On-demand probes (blackbox exporter style /probe endpoint)
+
+GET /probe?module=https&target=https://example.com runs the probe and
+returns its result in prometheus format, so prometheus can drive the
+probe schedule. Other query parameters are passed as options of the
+service (values are parsed as YAML, e.g. port=25 or check_tlsa=true).
+
+Results are cached per (module, service) for cache_ttl seconds and
+concurrent scrapes of the same target share one probe run.
+"""
+
+import json
+import logging
+from time import time
+
+import yaml
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Gauge,
+                               generate_latest)
+
+from src.tools import Message
+from src.tools.cache import LRUCache, SingleFlight
+from src.tools.spec import ConfigError
+
+log = logging.getLogger(__name__)
+
+SEVERITY_NAMES = {
+    Message.ERROR: 'ERROR',
+    Message.WARNING: 'WARNING',
+    Message.INFO: 'INFO'
+}
+
+
+class ProbeResult:
+    """
+    Result of an on-demand probe
+    """
+
+    __slots__ = ('messages', 'duration', 'timestamp')
+
+    def __init__(self, messages, duration, timestamp):
+        self.messages = messages
+        self.duration = duration
+        self.timestamp = timestamp
+
+
+class OnDemandProber:
+    """
+    Handler of the /probe endpoint (see src.tools.http_server)
+    """
+
+    def __init__(self, probe_mapping, cache_ttl=30, cache_size=4096):
+        """
+        Parameters:
+        probe_mapping: (dict) see ServicesMonitoring.probe_mapping
+        cache_ttl: (float) seconds during which a result is served from cache
+        cache_size: (int) maximum number of cached results
+        """
+        self.probe_mapping = probe_mapping
+        self.cache_ttl = cache_ttl
+        self.cache = LRUCache('probe_results', max_size=cache_size)
+        self.single_flight = SingleFlight()
+
+    def build_service(self, module, query):
+        """
+        Return the service (dict or str for ping) described by query
+        """
+        target_type = self.probe_mapping[module]["target_type"]
+        if target_type is None:
+            return query['target']
+        service = {target_type: query['target']}
+        for key, value in query.items():
+            if key not in ('module', 'target'):
+                service[key] = yaml.safe_load(value)
+        return service
+
+    def probe(self, module, service):
+        """
+        Run the probe
+
+        Return:
+        (ProbeResult)
+        """
+        start_time = time()
+        try:
+            messages = self.probe_mapping[module]["module"].test(service)
+        except Exception as probe_exception:
+            log.exception(probe_exception)
+            messages = [Message(
+                module,
+                "Exception: {}".format(probe_exception),
+                Message.ERROR
+            )]
+        return ProbeResult(messages, time() - start_time, time())
+
+    def get_result(self, module, service):
+        """
+        Return the cached result or run the probe (once for concurrent
+        callers)
+        """
+
+        key = (module, json.dumps(service, sort_keys=True))
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        def run_probe():
+            result = self.probe(module, service)
+            self.cache.set(key, result, ttl=self.cache_ttl)
+            return result
+
+        return self.single_flight.do(key, run_probe)
+
+    def handle(self, query):
+        """
+        See src.tools.http_server
+        """
+
+        module = query.get('module')
+        if module not in self.probe_mapping or 'target' not in query:
+            return (
+                400,
+                'text/plain',
+                "Parameters module (one of {}) and target are required\n"
+                .format(', '.join(self.probe_mapping)).encode()
+            )
+
+        try:
+            service = self.build_service(module, query)
+            # Validate options (see src.tools.spec)
+            self.probe_mapping[module]["module"].Spec(service)
+        except (yaml.YAMLError, ConfigError) as invalid_exception:
+            return 400, 'text/plain', str(invalid_exception).encode()
+        result = self.get_result(module, service)
+
+        registry = CollectorRegistry()
+        Gauge(
+            'probe_success', 'Whether the probe succeeded',
+            registry=registry
+        ).set(int(not result.messages))
+        Gauge(
+            'probe_duration_seconds', 'Duration of the probe',
+            registry=registry
+        ).set(result.duration)
+        Gauge(
+            'probe_result_age_seconds', 'Age of the (cached) result',
+            registry=registry
+        ).set(time() - result.timestamp)
+        message_gauge = Gauge(
+            'probe_message', 'Messages returned by the probe',
+            ('severity', 'body'),
+            registry=registry
+        )
+        for message in result.messages:
+            message_gauge.labels(
+                severity=SEVERITY_NAMES.get(message.severity,
+                                            message.severity),
+                body=message.body
+            ).set(1)
+
+        return 200, CONTENT_TYPE_LATEST, generate_latest(registry)
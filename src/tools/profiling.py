@@ -0,0 +1,339 @@
+# Author: FL42
+
+"""
+On-demand profiling of a running monitor
+
+Profiling is started by SIGUSR1 (see install_signal_handler) or on
+/profile?seconds=N or /profile?cycles=N (see handle) and lasts N seconds
+or N monitor cycles. While active:
+- each probe call is profiled with cProfile, one profile per
+  (thread, probe type) merged at the end,
+- a thread samples the stacks of all threads every sample_interval
+  seconds (labelled by the probe type running in the thread),
+- tracemalloc traces allocations, reported per probe type (allocations
+  made while a probe module is in the stack).
+
+Results are written to a profile-<date> directory of output_directory:
+report.txt (top functions, allocations and stacks per probe type),
+<probe>.pstats (see pstats module) and stacks.folded (flame graph input).
+
+While profiling is off, the only cost is a boolean test per probe call.
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import signal
+import sys
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import nullcontext
+from time import monotonic, sleep, strftime
+
+log = logging.getLogger(__name__)
+
+NULL_CONTEXT = nullcontext()
+DEFAULT_SECONDS = 30
+TRACEMALLOC_FRAMES = 25
+TOP = 25
+
+
+class _ProbeProfile:
+    """
+    Context manager profiling a probe call (see Profiler.probe)
+    """
+
+    __slots__ = ('profiler', 'probe_name', 'profile', 'thread_id')
+
+    def __init__(self, owner, probe_name):
+        self.profiler = owner
+        self.probe_name = probe_name
+        self.profile = None
+        self.thread_id = threading.get_ident()
+
+    def __enter__(self):
+        self.profile = self.profiler.enter(self.thread_id, self.probe_name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.exit(self.thread_id, self.profile)
+        return False
+
+
+def _merge_profiles(profiles, stream):
+    """
+    Return the pstats.Stats of profiles (None without data)
+    """
+    stats = None
+    for profile in profiles:
+        try:
+            if stats is None:
+                stats = pstats.Stats(profile, stream=stream)
+            else:
+                stats.add(profile)
+        except TypeError:  # no data (profile never enabled)
+            pass
+    return stats
+
+
+class Profiler:
+    """
+    See module docstring
+    """
+
+    def __init__(self, output_directory=None, sample_interval=0.01):
+        """
+        Parameters:
+        output_directory: (str) directory of reports
+                          (default to the temporary directory)
+        sample_interval: (float) seconds between two stack samples
+        """
+        self.output_directory = output_directory or tempfile.gettempdir()
+        self.sample_interval = sample_interval
+        self.active = False
+        self.last_report = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._deadline = None
+        self._cycles_left = None
+        self._profiles = {}  # (thread id, probe) -> cProfile.Profile
+        self._current = {}  # thread id -> probe running in the thread
+        self._running = 0  # probe calls in progress
+        self._samples = Counter()  # collapsed stack -> number of samples
+        self._stop_tracemalloc = False
+        self._thread = None
+
+    def start(self, seconds=None, cycles=None):
+        """
+        Start profiling for seconds or cycles (default to DEFAULT_SECONDS)
+
+        Return:
+        (bool) False if profiling is already active (or writing its report)
+        """
+        with self._lock:
+            if self.active or (self._thread is not None
+                               and self._thread.is_alive()):
+                return False
+            if seconds is None and cycles is None:
+                seconds = DEFAULT_SECONDS
+            self._deadline = monotonic() + seconds \
+                if seconds is not None else None
+            self._cycles_left = cycles
+            self._profiles = {}
+            self._current = {}
+            self._samples = Counter()
+            self._done.clear()
+            self._stop_tracemalloc = not tracemalloc.is_tracing()
+            if self._stop_tracemalloc:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.active = True
+            self._thread = threading.Thread(
+                target=self._run, name='profiler', daemon=True
+            )
+        log.warning(
+            "Profiling started for %s",
+            "{} seconds".format(seconds) if seconds is not None
+            else "{} cycles".format(cycles)
+        )
+        self._thread.start()
+        return True
+
+    def probe(self, probe_name):
+        """
+        Return a context manager profiling a call of probe_name
+        (a no-op context if profiling is off)
+        """
+        if not self.active:
+            return NULL_CONTEXT
+        return _ProbeProfile(self, probe_name)
+
+    def enter(self, thread_id, probe_name):
+        """
+        Start profiling a probe call in the current thread
+
+        Return:
+        (cProfile.Profile) enabled profile or None
+        """
+        with self._lock:
+            if not self.active:
+                return None
+            self._current[thread_id] = probe_name
+            profile = self._profiles.get((thread_id, probe_name))
+            if profile is None:
+                profile = cProfile.Profile()
+                self._profiles[(thread_id, probe_name)] = profile
+            self._running += 1
+        try:
+            profile.enable()
+        except ValueError:  # another profiler is active (python >= 3.12)
+            return None
+        return profile
+
+    def exit(self, thread_id, profile):
+        """
+        Stop profiling a probe call (see enter)
+        """
+        if profile is not None:
+            profile.disable()
+        with self._lock:
+            if self._current.pop(thread_id, None) is not None:
+                self._running -= 1
+
+    def cycle_done(self):
+        """
+        Call at the end of each monitor cycle
+        """
+        if self.active and self._cycles_left is not None:
+            with self._lock:
+                self._cycles_left -= 1
+                if self._cycles_left <= 0:
+                    self._done.set()
+
+    def stop(self):
+        """
+        Stop profiling now (the report is written)
+        """
+        self._done.set()
+
+    def _run(self):
+        """
+        Sample stacks until the end, then write the report
+        """
+        while not self._done.wait(self.sample_interval):
+            if self._deadline is not None and monotonic() >= self._deadline:
+                break
+            self._sample()
+
+        with self._lock:
+            self.active = False
+        # Wait for probe calls in progress (their profile is enabled)
+        for _ in range(1000):
+            if not self._running:
+                break
+            sleep(0.01)
+
+        snapshot = tracemalloc.take_snapshot()
+        if self._stop_tracemalloc:
+            tracemalloc.stop()
+        try:
+            self.last_report = self._write(snapshot)
+            log.warning("Profiling report written to %s", self.last_report)
+        except OSError as write_exception:
+            log.error("Failed to write profiling report: %s",
+                      write_exception)
+
+    def _sample(self):
+        """
+        Record the stacks of all threads (but the profiler)
+        """
+        own_id = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        for thread_id, frame in frames.items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append("{}:{}".format(
+                    os.path.basename(code.co_filename), code.co_name
+                ))
+                frame = frame.f_back
+            label = self._current.get(thread_id) \
+                or names.get(thread_id, str(thread_id))
+            stack.append(label)
+            self._samples[';'.join(reversed(stack))] += 1
+
+    def _write(self, snapshot):
+        """
+        Write the report
+
+        Return:
+        (str) directory of the report
+        """
+        directory = os.path.join(
+            self.output_directory,
+            'profile-{}'.format(strftime('%Y%m%d-%H%M%S'))
+        )
+        os.makedirs(directory, exist_ok=True)
+
+        by_probe = {}
+        for (_, probe_name), profile in self._profiles.items():
+            by_probe.setdefault(probe_name, []).append(profile)
+
+        report = io.StringIO()
+        for probe_name, profiles in sorted(by_probe.items()):
+            report.write("===== {} =====\n".format(probe_name))
+            stats = _merge_profiles(profiles, report)
+            if stats is not None:
+                stats.dump_stats(os.path.join(
+                    directory, '{}.pstats'.format(probe_name)
+                ))
+                stats.sort_stats('cumulative').print_stats(TOP)
+
+            report.write("Allocations (top {}):\n".format(TOP))
+            probe_snapshot = snapshot.filter_traces((
+                tracemalloc.Filter(
+                    True,
+                    '*{0}probes{0}{1}.py'.format(os.sep, probe_name),
+                    all_frames=True
+                ),
+            ))
+            for statistic in probe_snapshot.statistics('lineno')[:TOP]:
+                report.write("{}\n".format(statistic))
+            report.write("\n")
+
+        report.write("===== Stack samples (top {}) =====\n".format(TOP))
+        for stack, count in self._samples.most_common(TOP):
+            report.write("{} {}\n".format(count, stack))
+
+        with open(os.path.join(directory, 'report.txt'), 'wt',
+                  encoding='utf-8') as report_file:
+            report_file.write(report.getvalue())
+        with open(os.path.join(directory, 'stacks.folded'), 'wt',
+                  encoding='utf-8') as stacks_file:
+            for stack, count in self._samples.items():
+                stacks_file.write("{} {}\n".format(stack, count))
+        return directory
+
+
+profiler = Profiler()
+
+
+def install_signal_handler(signum=signal.SIGUSR1, seconds=DEFAULT_SECONDS):
+    """
+    Start profiling for seconds on signal signum (main thread only)
+    """
+    signal.signal(signum, lambda _signum, _frame: profiler.start(seconds))
+
+
+def handle(query):
+    """
+    Handler of /profile (see src.tools.http_server)
+
+    Parameters (query):
+    seconds: (int) start profiling for seconds
+    cycles: (int) start profiling for cycles
+    Without parameter, return the status of the profiler
+    """
+    try:
+        seconds = int(query['seconds']) if 'seconds' in query else None
+        cycles = int(query['cycles']) if 'cycles' in query else None
+    except ValueError:
+        return 400, 'text/plain', b'seconds and cycles must be integers\n'
+
+    if seconds is None and cycles is None:
+        status_code = 200
+    elif profiler.start(seconds, cycles):
+        status_code = 202
+    else:
+        status_code = 409
+    return status_code, 'application/json', json.dumps({
+        'active': profiler.active,
+        'last_report': profiler.last_report
+    }).encode()
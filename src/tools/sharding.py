@@ -0,0 +1,168 @@
+# Author: FL42
+
+"""
+Sharding of targets across monitor instances
+
+Each instance is given shard_index and shard_count and only probes the
+targets it owns. Owners are assigned by consistent hashing: every shard
+has vnodes points on a hash ring and a target (probe name and target)
+belongs to the shard of the first point following its hash. Adding or
+removing an instance only moves about 1/shard_count of the targets.
+
+Hashes are computed with MD5 (stable across processes, unlike hash()).
+
+Options (sharding section of common, overridden by the SHARD_INDEX and
+SHARD_COUNT environment variables):
+    shard_index: (int) index of this instance (0 to shard_count - 1)
+    shard_count: (int) number of instances
+    vnodes: (int) points per shard on the ring (default to 128)
+
+Targets an instance no longer owns (e.g. after shard_count changed) are
+forgotten: their alerts are dropped without notification, their new
+owner notifies.
+
+Owned targets are exported as the shard_owned_targets gauge (per config)
+and listed on /shard (see handle).
+"""
+
+import bisect
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from prometheus_client import Gauge
+
+log = logging.getLogger(__name__)
+
+shard_owned_targets = Gauge(
+    "shard_owned_targets",
+    "Number of targets owned by this instance",
+    ("config",)
+)
+shard_info = Gauge(
+    "shard_info",
+    "Shard of this instance",
+    ("shard_index", "shard_count")
+)
+
+
+def _hash(key):
+    """
+    Return the position of key (str) on the ring
+    """
+    return int.from_bytes(
+        hashlib.md5(key.encode('utf-8')).digest()[:8], 'big'
+    )
+
+
+class HashRing:
+    """
+    Consistent hash ring of shard_count shards
+    """
+
+    def __init__(self, shard_count, vnodes=128):
+        points = sorted(
+            (_hash("shard-{}-{}".format(shard, vnode)), shard)
+            for shard in range(shard_count)
+            for vnode in range(vnodes)
+        )
+        self.positions = [position for position, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def owner(self, key):
+        """
+        Return the shard (int) owning key (str)
+        """
+        index = bisect.bisect(self.positions, _hash(key))
+        return self.shards[index % len(self.shards)]
+
+
+class Shard:
+    """
+    Shard of this instance (see module docstring)
+    """
+
+    def __init__(self, shard_index, shard_count, vnodes=128):
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(
+                "shard_index must be between 0 and shard_count - 1"
+            )
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.ring = HashRing(shard_count, vnodes)
+        self.owned = {}  # config -> list of (probe name, target)
+        self._lock = threading.Lock()
+
+    def owns(self, probe_name, target):
+        """
+        Return True if target of probe_name belongs to this shard
+        """
+        return self.ring.owner(
+            "{}:{}".format(probe_name, target)
+        ) == self.shard_index
+
+    def publish(self, config, owned):
+        """
+        Record the targets owned in the last cycle of config
+
+        Parameters:
+        config: (str) config path
+        owned: (list of tuples) (probe name, target)
+        """
+        with self._lock:
+            self.owned[config] = owned
+        shard_owned_targets.labels(config=str(config)).set(len(owned))
+
+
+_shard = None
+_shard_lock = threading.Lock()
+
+
+def get_shard(options=None):
+    """
+    Return the shard of this instance shared by all config threads
+    (None if sharding is not configured)
+
+    Parameters:
+    options: (dict) sharding section of common (see module docstring)
+    """
+
+    global _shard  # pylint: disable=global-statement
+
+    options = dict(options or {})
+    if 'SHARD_INDEX' in os.environ:
+        options['shard_index'] = int(os.environ['SHARD_INDEX'])
+    if 'SHARD_COUNT' in os.environ:
+        options['shard_count'] = int(os.environ['SHARD_COUNT'])
+    with _shard_lock:
+        if _shard is None and options:
+            _shard = Shard(**options)
+            shard_info.labels(
+                shard_index=str(_shard.shard_index),
+                shard_count=str(_shard.shard_count)
+            ).set(1)
+            log.info("Shard %d of %d", _shard.shard_index,
+                     _shard.shard_count)
+    return _shard
+
+
+def handle(_query):
+    """
+    Handler of /shard (see src.tools.http_server): targets owned by this
+    instance per config
+    """
+
+    if _shard is None:
+        return 404, 'text/plain', b'Sharding is not enabled\n'
+    with _shard._lock:  # pylint: disable=protected-access
+        owned = {
+            str(config): [list(key) for key in targets]
+            for config, targets in _shard.owned.items()
+        }
+    return 200, 'application/json', json.dumps({
+        'shard_index': _shard.shard_index,
+        'shard_count': _shard.shard_count,
+        'targets': owned
+    }).encode()
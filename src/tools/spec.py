@@ -0,0 +1,245 @@
+# Author: FL42
+
+"""
+Compilation of probe configs into specs
+
+Each probe module defines a Spec class (subclass of ProbeSpec) listing its
+options. When a config is loaded, every service is validated against it
+and turned into an immutable spec object: defaults are resolved once and
+derived values (service name, compiled regexes, request headers...) are
+computed once, so the per-cycle work of a probe is only its I/O.
+
+All errors of a config are collected and raised together as a ConfigError.
+"""
+
+from types import MappingProxyType
+
+REQUIRED = object()
+NUMBER = (int, float)
+
+
+class ConfigError(Exception):
+    """
+    Invalid config (errors is the list of all errors found)
+    """
+
+    def __init__(self, errors):
+        Exception.__init__(self, "\n".join(errors))
+        self.errors = errors
+
+
+class Option:
+    """
+    Option of a probe
+    """
+
+    __slots__ = ('name', 'types', 'default', 'convert')
+
+    def __init__(self, name, types, default=REQUIRED, convert=None):
+        """
+        Parameters:
+        name: (str) name of the option in config
+        types: (type or tuple of types) accepted types
+        default: default value (REQUIRED if the option is mandatory,
+                 None allows null values)
+        convert: (function) applied to the value once validated
+        """
+        self.name = name
+        self.types = types if isinstance(types, tuple) else (types,)
+        self.default = default
+        self.convert = convert
+
+    def check(self, value):
+        """
+        Return an error (str) if value is invalid else None
+        """
+        if value is None and self.default is None:
+            return None
+        # bool is a subclass of int but a boolean is not a valid number
+        if isinstance(value, bool) and bool not in self.types:
+            valid = False
+        else:
+            valid = isinstance(value, self.types)
+        if not valid:
+            return "{} must be {} (got {!r})".format(
+                self.name,
+                " or ".join(type_.__name__ for type_ in self.types),
+                value
+            )
+        return None
+
+
+def freeze(value):
+    """
+    Return an immutable copy of value (dict or list)
+    """
+    if isinstance(value, dict):
+        return MappingProxyType(dict(value))
+    return tuple(value)
+
+
+class ProbeSpec:
+    """
+    Base class of probe specs
+
+    Subclasses define:
+    options: (tuple of Option objects)
+    target_option: (str) option identifying the target
+    __slots__: option names and derived attributes set in compile(),
+               also declared as annotations (slots are set with
+               object.__setattr__ so linters can not infer them)
+    """
+
+    __slots__ = ()
+    options = ()
+    target_option = None
+
+    def __init__(self, service, path='service'):
+        """
+        Parameters:
+        service: (dict, or str for the target option only)
+        path: (str) location of the service in config (used in errors)
+
+        Raise ConfigError if service is invalid
+        """
+        if isinstance(service, str) and self.target_option is not None:
+            service = {self.target_option: service}
+        errors = self.validate(service, path)
+        if errors:
+            raise ConfigError(errors)
+        for option in self.options:
+            value = service.get(option.name, option.default)
+            if option.convert is not None and value is not None:
+                value = option.convert(value)
+            object.__setattr__(self, option.name, value)
+        self.compile()
+
+    @classmethod
+    def validate(cls, service, path):
+        """
+        Return the list of errors (str) of service
+        """
+        if not isinstance(service, dict):
+            return ["{}: must be a mapping (got {!r})".format(path, service)]
+        errors = []
+        names = {option.name for option in cls.options}
+        for name in service:
+            if name not in names:
+                errors.append("{}: unknown option {}".format(path, name))
+        for option in cls.options:
+            if option.name not in service:
+                if option.default is REQUIRED:
+                    errors.append(
+                        "{}: missing option {}".format(path, option.name)
+                    )
+                continue
+            error = option.check(service[option.name])
+            if error is not None:
+                errors.append("{}: {}".format(path, error))
+        return errors
+
+    def compile(self):
+        """
+        Compute derived attributes (see set)
+        """
+
+    def set(self, name, value):
+        """
+        Set a derived attribute (only in compile)
+        """
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Spec objects are immutable")
+
+    @property
+    def target(self):
+        """
+        (str) target of the probe
+        """
+        return str(getattr(self, self.target_option))
+
+    def __repr__(self):
+        return "{}({})".format(
+            type(self).__name__,
+            ", ".join(
+                "{}={!r}".format(option.name, getattr(self, option.name))
+                for option in self.options
+            )
+        )
+
+
+def _compile_service(probe_name, probe_module, service, path):
+    """
+    Return the compiled service (see compile_probes)
+    """
+    # Imported here as src.tools.expansion depends on this module
+    from src.tools.expansion import Expansion, is_expansion
+
+    if is_expansion(service):
+        return Expansion(probe_name, probe_module, service, path)
+    return probe_name, probe_module, probe_module.Spec(service, path)
+
+
+def compile_probes(config_probes, probe_mapping):
+    """
+    Compile the probes section of a config
+
+    Parameters:
+    config_probes: (dict) probes section (probe name -> list of services)
+    probe_mapping: (dict) see ServicesMonitoring.probe_mapping
+
+    Return:
+    (list) in config order, tuples (probe name, probe module, spec) and
+    Expansion objects for generated services (see src.tools.expansion,
+    iter_specs and count_targets)
+
+    Raise ConfigError with all errors of the section
+    """
+    compiled = []
+    errors = []
+    if not isinstance(config_probes, dict):
+        raise ConfigError(["probes: must be a mapping"])
+    for probe_name, services in config_probes.items():
+        if probe_name not in probe_mapping:
+            errors.append("probes: unknown probe {}".format(probe_name))
+            continue
+        if not isinstance(services, list):
+            errors.append("probes.{}: must be a list".format(probe_name))
+            continue
+        probe_module = probe_mapping[probe_name]["module"]
+        for index, service in enumerate(services):
+            path = "probes.{}[{}]".format(probe_name, index)
+            try:
+                compiled.append(
+                    _compile_service(probe_name, probe_module, service, path)
+                )
+            except ConfigError as config_error:
+                errors += config_error.errors
+            except Exception as spec_error:
+                errors.append("{}: {}".format(path, spec_error))
+    if errors:
+        raise ConfigError(errors)
+    return compiled
+
+
+def iter_specs(compiled):
+    """
+    Yield (probe name, probe module, spec) of compiled probes
+    (see compile_probes), generated services being expanded lazily
+    """
+    for item in compiled:
+        if isinstance(item, tuple):
+            yield item
+        else:
+            yield from item
+
+
+def count_targets(compiled):
+    """
+    Return the number of services of compiled probes (see compile_probes)
+    without expanding them
+    """
+    return sum(
+        1 if isinstance(item, tuple) else len(item) for item in compiled
+    )
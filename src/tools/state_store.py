@@ -0,0 +1,131 @@
+# Author: FL42
+
+"""
+Persistent store for alert state and last probe results
+
+State is saved in a SQLite database after each cycle and loaded in bulk at
+startup, so a restart neither sends duplicate notifications for services
+still down nor starts from scratch: restored results are exported as
+probe_up (see src.tools.metrics.restore) until targets are probed again.
+Several config threads may share the same file (rows are indexed by config).
+"""
+
+import logging
+import sqlite3
+
+from src.tools.message import AlertState, Message
+
+log = logging.getLogger(__name__)
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS alerts (
+        config TEXT NOT NULL,
+        service TEXT NOT NULL,
+        body TEXT NOT NULL,
+        severity INTEGER NOT NULL,
+        first_seen REAL NOT NULL,
+        last_seen REAL NOT NULL,
+        PRIMARY KEY (config, service, body, severity)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS results (
+        config TEXT NOT NULL,
+        probe TEXT NOT NULL,
+        target TEXT NOT NULL,
+        success INTEGER NOT NULL,
+        duration REAL NOT NULL,
+        timestamp REAL NOT NULL,
+        PRIMARY KEY (config, probe, target)
+    )'''
+)
+
+
+class StateStore:
+    """
+    SQLite store of one config (a connection must be used by one thread)
+    """
+
+    def __init__(self, path, config):
+        """
+        Parameters:
+        path: (str) path to the database file
+        config: (str) config identifier (e.g. path to config file)
+        """
+        self.config = config
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    def load_alerts(self):
+        """
+        Return:
+        (dict) Message.key -> AlertState
+        """
+        alerts = {}
+        for service, body, severity, first_seen, last_seen in \
+                self.connection.execute(
+                    'SELECT service, body, severity, first_seen, last_seen '
+                    'FROM alerts WHERE config = ?',
+                    (self.config,)
+                ):
+            message = Message(service, body, severity)
+            alerts[message.key] = AlertState(message, first_seen, last_seen)
+        log.debug("%d alerts loaded", len(alerts))
+        return alerts
+
+    def load_results(self):
+        """
+        Return:
+        (dict) (probe, target) -> (success, duration, timestamp)
+        """
+        return {
+            (probe, target): (bool(success), duration, timestamp)
+            for probe, target, success, duration, timestamp in
+            self.connection.execute(
+                'SELECT probe, target, success, duration, timestamp '
+                'FROM results WHERE config = ?',
+                (self.config,)
+            )
+        }
+
+    def save(self, alerts, results):
+        """
+        Replace stored state by alerts and results (in one transaction)
+
+        Parameters:
+        alerts: (dict) Message.key -> AlertState
+        results: (dict) (probe, target) -> (success, duration, timestamp)
+        """
+        with self.connection:
+            self.connection.execute(
+                'DELETE FROM alerts WHERE config = ?',
+                (self.config,)
+            )
+            self.connection.executemany(
+                'INSERT INTO alerts VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    (self.config,) + key + (alert.first_seen, alert.last_seen)
+                    for key, alert in alerts.items()
+                )
+            )
+            # Results of targets which are gone are deleted too
+            self.connection.execute(
+                'DELETE FROM results WHERE config = ?',
+                (self.config,)
+            )
+            self.connection.executemany(
+                'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    (self.config, probe, target, int(success), duration,
+                     timestamp)
+                    for (probe, target), (success, duration, timestamp)
+                    in results.items()
+                )
+            )
+
+    def close(self):
+        """
+        Close the database
+        """
+        self.connection.close()
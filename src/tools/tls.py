@@ -2,27 +2,158 @@
 
 """
 Tools for TLS connection
+
+TLSFetcher retrieves peer certificates with bounded connect and handshake
+durations (a black-holed host can't hang the caller), supports TLS 1.2 and
+1.3 over IPv4 and IPv6 and resumes TLS sessions across calls.
+
+A resumed session returns the certificate of the session (the server sends
+none), so a renewed certificate would go unnoticed: certificate checks
+(get_certificate) always do a full handshake.
 """
 
-from socket import socket
-from OpenSSL.SSL import TLSv1_2_METHOD, Context, Connection
+import socket
+from collections import namedtuple
+from ipaddress import ip_address
+from select import select
+from time import monotonic
 
+from OpenSSL.SSL import (SESS_CACHE_CLIENT, TLS1_2_VERSION, TLS_CLIENT_METHOD,
+                         Connection, Context, Error, WantReadError,
+                         WantWriteError)
+from prometheus_client import Histogram
 
-def get_certificate(hostname, port=443):
+from src.tools.cache import LRUCache
+
+tls_handshake_duration = Histogram(
+    "tls_handshake_duration_seconds",
+    "Duration of TLS handshakes done to fetch certificates",
+    ("protocol",)
+)
+
+TLSResult = namedtuple('TLSResult', ('cert', 'duration', 'protocol'))
+
+
+class TLSFetcher:
     """
-    Return TLS certificate (f.i. for https or smtps)
+    Reusable TLS certificate fetcher
     """
 
-    client = socket()
-    client.connect((hostname, port))
+    def __init__(self, connect_timeout=5, handshake_timeout=5,
+                 session_lifetime=3600):
+        """
+        Parameters:
+        connect_timeout: (float) max duration of TCP connection in seconds
+        handshake_timeout: (float) max duration of TLS handshake in seconds
+        session_lifetime: (int) how long a TLS session is kept for resumption
+        """
+        self.connect_timeout = connect_timeout
+        self.handshake_timeout = handshake_timeout
+        self.session_lifetime = session_lifetime
+        self.context = Context(TLS_CLIENT_METHOD)
+        self.context.set_min_proto_version(TLS1_2_VERSION)
+        self.context.set_session_cache_mode(SESS_CACHE_CLIENT)
+        self.sessions = LRUCache('tls_sessions')
 
-    client_ssl = Connection(Context(TLSv1_2_METHOD), client)
-    client_ssl.set_connect_state()
-    client_ssl.set_tlsext_host_name(hostname.encode("ascii"))  # SNI
-    client_ssl.do_handshake()
+    def fetch(self, hostname, port=443, resume=True):
+        """
+        Return a TLSResult (cert, handshake duration, protocol name)
+        for hostname:port (resume=False forces a full handshake, see module
+        docstring)
+        Raise socket.timeout if the connection or the handshake is too long
+        """
 
-    cert = client_ssl.get_peer_certificate()
+        hostname = hostname.strip('[]')  # IPv6 in URL
+        client = socket.create_connection(
+            (hostname, port),
+            timeout=self.connect_timeout
+        )
+        client.setblocking(False)
 
-    client_ssl.close()
+        try:
+            client_ssl = Connection(self.context, client)
+            client_ssl.set_connect_state()
+            if not _is_ip_address(hostname):
+                client_ssl.set_tlsext_host_name(hostname.encode("idna"))  # SNI
+            session = self.sessions.get((hostname, port)) if resume else None
+            if session is not None:
+                client_ssl.set_session(session)
+
+            start_time = monotonic()
+            deadline = start_time + self.handshake_timeout
+            _retry(client_ssl.do_handshake, client, deadline)
+            duration = monotonic() - start_time
+            protocol = client_ssl.get_protocol_version_name()
+            tls_handshake_duration.labels(protocol=protocol).observe(duration)
+
+            # TLS 1.3 session tickets are sent after the handshake:
+            # wait for them only if there is no session to resume yet
+            # (TLS 1.2 sessions are set up by the handshake)
+            if session is None and protocol == 'TLSv1.3':
+                _read_tickets(
+                    client_ssl, client, min(deadline, monotonic() + 0.2)
+                )
+            self.sessions.set(
+                (hostname, port),
+                client_ssl.get_session(),
+                ttl=self.session_lifetime
+            )
+
+            cert = client_ssl.get_peer_certificate()
+            try:
+                client_ssl.shutdown()
+            except Error:
+                pass  # may fail on a non-blocking socket: not an issue
+        finally:
+            client.close()
+
+        return TLSResult(cert, duration, protocol)
+
+
+def _is_ip_address(hostname):
+    """
+    Return True if hostname is an IP address (no SNI in that case)
+    """
+    try:
+        ip_address(hostname)
+    except ValueError:
+        return False
+    return True
 
-    return cert
+
+def _retry(function, sock, deadline):
+    """
+    Call function on a non-blocking connection until it succeeds
+    or until deadline is reached
+    """
+    while True:
+        try:
+            return function()
+        except (WantReadError, WantWriteError) as want_error:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                raise socket.timeout("TLS handshake timed out")
+            if isinstance(want_error, WantReadError):
+                select([sock], [], [], remaining)
+            else:
+                select([], [sock], [], remaining)
+
+
+def _read_tickets(client_ssl, sock, deadline):
+    """
+    Process data (session tickets) received before deadline
+    """
+    try:
+        _retry(lambda: client_ssl.recv(1), sock, deadline)
+    except (socket.timeout, Error):
+        pass
+
+
+default_fetcher = TLSFetcher()
+
+
+def get_certificate(hostname, port=443):
+    """
+    Return TLS certificate (f.i. for https or smtps)
+    """
+    return default_fetcher.fetch(hostname, port, resume=False).cert
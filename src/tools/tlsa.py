@@ -2,6 +2,12 @@
 
 """
 Tools for TLSA records
+
+TLSA RRsets are cached for their DNS TTL, certificate hashes are memoized by
+certificate fingerprint and the verdict is cached per
+(host, port, certificate fingerprint, TLSA RRset): when neither the
+certificate nor the record changed, the full check is skipped.
+Hashes are computed in the process pool if configured (see offload).
 """
 
 
@@ -11,10 +17,47 @@ import logging
 import dns.resolver
 import OpenSSL.crypto
 
+from src.tools import offload
+from src.tools.cache import LRUCache
 from src.tools.message import Message
 
 log = logging.getLogger(__name__)
 
+# Caches shared by all TLSA objects
+records_cache = LRUCache('tlsa_records')
+hash_cache = LRUCache('tlsa_hash')
+verdict_cache = LRUCache('tlsa_verdict')
+
+HASH_FUNCTIONS = {1: hashlib.sha256, 2: hashlib.sha1}
+
+
+def hash_certificate(der, selector, matching_type):
+    """
+    Return the hex digest of a certificate for a TLSA record
+    (defined at module level to run in the process pool, see offload)
+
+    Parameters:
+    der: (bytes-like) certificate in DER
+    selector: (int) 0 for the entire certificate, 1 for the public key
+    matching_type: (int) 1 for SHA-256, 2 for SHA-1
+    """
+    if selector == 1:
+        der = OpenSSL.crypto.dump_publickey(
+            OpenSSL.crypto.FILETYPE_ASN1,
+            OpenSSL.crypto.load_certificate(
+                OpenSSL.crypto.FILETYPE_ASN1,
+                bytes(der)
+            ).get_pubkey()
+        )
+    return HASH_FUNCTIONS[matching_type](der).hexdigest()
+
+
+def get_fingerprint(cert):
+    """
+    Return the SHA256 fingerprint (str) of an OpenSSL certificate
+    """
+    return cert.digest('sha256').decode('ascii')
+
 
 class TLSA:
     """
@@ -46,6 +89,18 @@ class TLSA:
         if not dns_records:
             return self.messages
 
+        fingerprint = get_fingerprint(cert)
+        verdict_key = (host, port, fingerprint, dns_records)
+        verdict = verdict_cache.get(verdict_key)
+        if verdict is not None:
+            log.debug("[TLSA] cert and records unchanged: reusing verdict")
+            self.messages += [
+                Message(self.service_name, body, severity)
+                for body, severity in verdict
+            ]
+            return self.messages
+
+        first_message = len(self.messages)
         one_match = False
         log.debug('dns_records: %s', str(dns_records))
         for record in dns_records:
@@ -87,7 +142,9 @@ class TLSA:
                     "certificate will not be verified (not implemented)"
                 )
 
-            cert_hash = self._get_hash(cert, selector, matching_type)
+            cert_hash = self._get_hash(
+                cert, selector, matching_type, fingerprint=fingerprint
+            )
 
             is_matching = tlsa_hash == cert_hash
             log.debug("TLSA record matches cert: %s", str(is_matching))
@@ -101,6 +158,11 @@ class TLSA:
                 Message.ERROR
             ))
 
+        verdict_cache.set(verdict_key, tuple(
+            (message.body, message.severity)
+            for message in self.messages[first_message:]
+        ))
+
         return self.messages
 
     def _get_records(self, host, port, protocol='tcp'):
@@ -111,9 +173,14 @@ class TLSA:
             protocol: (str) Protocol of service (default to 'tcp')
 
         Return:
-        (list of str) e.g. ['1 0 1 2f9bc...']
+        (tuple of str) e.g. ('1 0 1 2f9bc...',)
         """
 
+        records_key = (host, port, protocol.lower())
+        records = records_cache.get(records_key)
+        if records is not None:
+            return records
+
         try:
             dns_answer = dns.resolver.query(
                 '_{}._{}.{}'.format(port, protocol.lower(), host),
@@ -126,7 +193,7 @@ class TLSA:
                 "TLSA record does not exist",
                 Message.ERROR
             ))
-            return []
+            return ()
 
         except Exception as dns_resolver_exception:
             self.messages.append(Message(
@@ -135,11 +202,15 @@ class TLSA:
                 .format(dns_resolver_exception),
                 Message.ERROR
             ))
-            return []
+            return ()
 
-        return [record.to_text() for record in dns_answer[0].items]
+        records = tuple(sorted(
+            record.to_text() for record in dns_answer[0].items
+        ))
+        records_cache.set(records_key, records, ttl=dns_answer[0].ttl)
+        return records
 
-    def _get_hash(self, cert, selector, matching_type):
+    def _get_hash(self, cert, selector, matching_type, fingerprint=None):
         """
         Compute the hash of the certificate
 
@@ -147,26 +218,20 @@ class TLSA:
         cert: (OpenSSL cert) TLS certificate
         selector: (int) TLSA selector
         matching_type: (int) TLSA matching type
+        fingerprint: (str) fingerprint of cert (computed if not given)
 
         Return:
         (str) hash or '' on error
         """
 
-        if selector == 0:  # entire cert
-            x509_dump = OpenSSL.crypto.dump_certificate(
-                OpenSSL.crypto.FILETYPE_ASN1,
-                cert
-            )
-            log.debug("Hashing entire cert")
+        if fingerprint is None:
+            fingerprint = get_fingerprint(cert)
+        hash_key = (fingerprint, selector, matching_type)
+        digest = hash_cache.get(hash_key)
+        if digest is not None:
+            return digest
 
-        elif selector == 1:  # public key only
-            x509_dump = OpenSSL.crypto.dump_publickey(
-                OpenSSL.crypto.FILETYPE_ASN1,
-                cert.get_pubkey()
-            )
-            log.debug("Hashing public key only")
-
-        else:  # invalid selector
+        if selector not in (0, 1):  # 0: entire cert, 1: public key only
             self.messages.append(Message(
                 self.service_name,
                 "Invalid selector in TLSA record",
@@ -175,13 +240,7 @@ class TLSA:
             log.debug("Invalid selector: %d", selector)
             return ''
 
-        if matching_type == 1:
-            hash_algo = hashlib.sha256()
-            log.debug("Hashing with sha256")
-        elif matching_type == 2:
-            hash_algo = hashlib.sha1()
-            log.debug("Hashing with sha1")
-        else:
+        if matching_type not in (1, 2):  # 1: sha256, 2: sha1
             self.messages.append(Message(
                 self.service_name,
                 "Invalid matching type in TLSA record",
@@ -190,9 +249,17 @@ class TLSA:
             log.debug("Invalid matching type: %d", matching_type)
             return ''
 
-        hash_algo.update(x509_dump)
-
-        digest = hash_algo.hexdigest()
+        # Parsing and hashing may run in the process pool (see offload)
+        digest = offload.run(
+            hash_certificate,
+            OpenSSL.crypto.dump_certificate(
+                OpenSSL.crypto.FILETYPE_ASN1,
+                cert
+            ),
+            selector,
+            matching_type
+        )
         log.debug("hexdigest: %s", digest)
 
+        hash_cache.set(hash_key, digest)
         return digest
@@ -0,0 +1,241 @@
+# Author: FL42
+
+"""
+Aggregation of results of several vantage points
+
+Vantage agents are monitors streaming their results to the aggregator
+with the aggregator sink (see src.sinks.aggregator): they don't send
+notifications. The aggregator (a monitor with an aggregator section)
+keeps the last result of each agent for each target and, at each cycle,
+reports a target as down only if a quorum of agents sees it down, so a
+failure seen from a single vantage point (e.g. its uplink) is ignored.
+Notifications, alert damping and flap detection are then done as for
+local probes (see ServicesMonitoring.monitor).
+
+Results older than max_age seconds are ignored (the agent is considered
+gone).
+
+Anyone able to connect can report results: listen on a public address
+only with a secret shared with the agents, which then sign their frames
+(see src.tools.framing).
+
+Options (aggregator section of the config):
+    listen: (str) 'host:port' or path of a Unix socket
+            (default to 127.0.0.1:9100)
+    secret: (str) shared secret of the agents (frames are not
+            authenticated without secret)
+    quorum: (int) number of agents seeing a target down to report it down
+            (default to a majority of the agents reporting the target)
+    max_age: (float) seconds before a result expires (default to 1800)
+"""
+
+import logging
+import os
+import socket
+import socketserver
+import statistics
+import threading
+from time import time
+
+from prometheus_client import Counter, Gauge
+
+from src.sinks.pipeline import SEVERITY_NAMES
+from src.tools import Message, framing
+
+log = logging.getLogger(__name__)
+
+vantage_records_total = Counter(
+    "vantage_records_total", "Number of records received", ("agent",)
+)
+vantage_agents = Gauge(
+    "vantage_agents", "Number of agents with results not expired"
+)
+
+SEVERITIES = {name: severity for severity, name in SEVERITY_NAMES.items()}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """
+    Read frames of an agent connection
+    """
+
+    def handle(self):
+        while True:
+            try:
+                document = framing.read_frame(
+                    self.rfile, self.server.aggregator.secret
+                )
+            except (OSError, ValueError) as frame_exception:
+                log.warning("Connection of agent closed: %s",
+                            frame_exception)
+                return
+            if document is None:
+                return
+            try:
+                self.server.aggregator.receive(
+                    document['agent'], document['records']
+                )
+            except (KeyError, TypeError) as document_exception:
+                log.warning("Invalid document from agent: %r",
+                            document_exception)
+                return
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, aggregator):
+        self.aggregator = aggregator  # see _Handler
+        socketserver.ThreadingTCPServer.__init__(self, address, _Handler)
+
+
+class _TCPServer6(_TCPServer):
+    address_family = socket.AF_INET6
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, address, aggregator):
+        self.aggregator = aggregator  # see _Handler
+        socketserver.ThreadingUnixStreamServer.__init__(
+            self, address, _Handler
+        )
+
+
+class VantageAggregator:
+    """
+    See module docstring
+    """
+
+    def __init__(self, listen='127.0.0.1:9100', quorum=None, max_age=1800,
+                 secret=None):
+        self.listen = listen
+        self.quorum = quorum
+        self.max_age = max_age
+        self.secret = secret
+        # (probe, target) -> {agent: (timestamp, success, latency, messages)}
+        self.reports = {}
+        self._lock = threading.Lock()
+        self.server = None
+
+    @property
+    def address(self):
+        """
+        Address the server is bound to (port chosen if 0 in listen)
+        """
+        return self.server.server_address
+
+    def start(self):
+        """
+        Listen for agents in a daemon thread
+        """
+        family, address = framing.parse_address(self.listen)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.remove(address)  # left by a previous run
+            server_class = _UnixServer
+        elif family == socket.AF_INET6:
+            server_class = _TCPServer6
+        else:
+            server_class = _TCPServer
+        self.server = server_class(address, self)
+        threading.Thread(
+            target=self.server.serve_forever, name='vantage', daemon=True
+        ).start()
+        log.info("Listening for agents on %s", self.listen)
+        if self.secret is None and family != socket.AF_UNIX:
+            log.warning("No secret: results of agents are not authenticated")
+
+    def receive(self, agent, records):
+        """
+        Record results of agent
+
+        Parameters:
+        agent: (str) name of the agent
+        records: (list of dict) see src.sinks.pipeline.make_record
+        """
+        now = time()
+        with self._lock:
+            for record in records:
+                messages = tuple(
+                    Message(
+                        message['service'],
+                        message['body'],
+                        SEVERITIES.get(message['severity'],
+                                       message['severity'])
+                    )
+                    for message in record.get('messages', ())
+                )
+                self.reports.setdefault(
+                    (record['probe'], record['target']), {}
+                )[agent] = (
+                    now,
+                    record['status'] == 'up',
+                    record.get('latency_seconds', 0),
+                    messages
+                )
+        vantage_records_total.labels(agent=agent).inc(len(records))
+
+    def evaluate(self, now=None):
+        """
+        Apply the quorum to the results not expired
+
+        Return:
+        (list of tuples) (probe, target, messages, latency) for each target,
+        messages is empty if the target is up; latency is the median
+        latency seen by agents
+        """
+        now = time() if now is None else now
+        results = []
+        agents = set()
+        with self._lock:
+            for key, by_agent in list(self.reports.items()):
+                fresh = {
+                    agent: report for agent, report in by_agent.items()
+                    if now - report[0] <= self.max_age
+                }
+                if not fresh:
+                    del self.reports[key]
+                    continue
+                agents.update(fresh)
+                down = sorted(
+                    agent for agent, report in fresh.items() if not report[1]
+                )
+                quorum = self.quorum if self.quorum is not None \
+                    else len(fresh) // 2 + 1
+                messages = []
+                if down and len(down) >= quorum:
+                    header = "down from {}/{} vantage points".format(
+                        len(down), len(fresh)
+                    )
+                    seen = set()
+                    for agent in down:
+                        for message in fresh[agent][3]:
+                            if message.key not in seen:
+                                seen.add(message.key)
+                                messages.append(Message(
+                                    message.service,
+                                    message.body,
+                                    message.severity,
+                                    header=header
+                                ))
+                    log.info("%s %s %s: %s", key[0], key[1], header,
+                             ", ".join(down))
+                results.append((
+                    key[0],
+                    key[1],
+                    messages,
+                    statistics.median(report[2] for report in fresh.values())
+                ))
+        vantage_agents.set(len(agents))
+        return results
+
+    def shutdown(self):
+        """
+        Stop listening
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,124 @@
+"""
+Helpers shared by tests
+"""
+
+import os
+import socketserver
+import ssl
+import tempfile
+import threading
+
+import OpenSSL.crypto
+
+
+def make_certificate(common_name='localhost', lifetime=86400):
+    """
+    Return a self-signed OpenSSL certificate valid for lifetime seconds
+    and its private key
+    """
+    key = OpenSSL.crypto.PKey()
+    key.generate_key(OpenSSL.crypto.TYPE_RSA, 2048)
+    cert = OpenSSL.crypto.X509()
+    cert.get_subject().CN = common_name
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(lifetime)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, 'sha256')
+    return cert, key
+
+
+def make_server_context(cert, key):
+    """
+    Return a server ssl.SSLContext using the given certificate and key
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        cert_path = os.path.join(directory, 'cert.pem')
+        key_path = os.path.join(directory, 'key.pem')
+        with open(cert_path, 'wb') as cert_file:
+            cert_file.write(OpenSSL.crypto.dump_certificate(
+                OpenSSL.crypto.FILETYPE_PEM, cert
+            ))
+        with open(key_path, 'wb') as key_file:
+            key_file.write(OpenSSL.crypto.dump_privatekey(
+                OpenSSL.crypto.FILETYPE_PEM, key
+            ))
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_path, key_path)
+    return context
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """
+    Minimal SMTP server (STARTTLS if server.tls_context is set)
+    """
+
+    def _reply(self, line):
+        self.wfile.write("{}\r\n".format(line).encode('ascii'))
+        self.wfile.flush()
+
+    def _starttls(self):
+        self._reply('220 Ready to start TLS')
+        self.request = self.server.tls_context.wrap_socket(
+            self.request, server_side=True
+        )
+        self.rfile = self.request.makefile('rb')
+        self.wfile = self.request.makefile('wb')
+
+    def _data(self):
+        self._reply('354 End data with <CR><LF>.<CR><LF>')
+        data = b''
+        while True:
+            line = self.rfile.readline()
+            if not line or line == b'.\r\n':
+                break
+            data += line
+        self.server.messages.append(data)
+        self._reply('250 OK')
+
+    def handle(self):
+        self.server.connections += 1
+        self.server.sessions.append(self.request)
+        tls = False
+        self._reply('220 localhost ESMTP')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self._reply('250-localhost')
+                if self.server.tls_context is not None and not tls:
+                    self._reply('250-STARTTLS')
+                self._reply('250 AUTH PLAIN')
+            elif command == 'STARTTLS':
+                self._starttls()
+                tls = True
+            elif command.startswith('AUTH'):
+                self._reply('235 Authentication successful')
+            elif command == 'DATA':
+                self._data()
+            elif command == 'QUIT':
+                self._reply('221 Bye')
+                return
+            else:  # MAIL, RCPT, NOOP, RSET
+                self._reply('250 OK')
+
+
+def start_smtp_server(tls_context=None):
+    """
+    Start a SMTP server on localhost in a thread
+
+    Return:
+    (socketserver.ThreadingTCPServer) with attributes connections (int),
+    sessions (list of sockets) and messages (list of bytes)
+    """
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPHandler)
+    server.daemon_threads = True
+    server.tls_context = tls_context
+    server.connections = 0
+    server.sessions = []
+    server.messages = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
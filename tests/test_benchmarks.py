@@ -0,0 +1,56 @@
+# Author: FL42
+
+"""
+Tests for the benchmark harness
+"""
+
+import unittest
+
+from benchmarks import run
+
+
+class TestBenchmarks(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def test_run(self):
+        """
+        Should work
+        """
+        report = run.run_benchmark([4, 8], cycles=1)
+        self.assertEqual(report['format_version'], run.FORMAT_VERSION)
+        self.assertEqual(
+            [result['targets'] for result in report['results']],
+            [4, 8]
+        )
+        for result in report['results']:
+            self.assertEqual(result['failed_targets'], 0)
+            self.assertTrue(result['throughput_probes_per_second'] > 0)
+
+    def test_failures(self):
+        """
+        Failing raw TCP targets use a closed port
+        """
+        ports = {'raw_tcp': 1000, 'closed': 1001}
+        config = run.build_config(4, ['raw_tcp'], ports, failure_rate=0.5)
+        self.assertEqual(
+            [service['port'] for service in config['probes']['raw_tcp']],
+            [1001, 1000, 1001, 1000]
+        )
+
+    def test_compare(self):
+        """
+        Regressions are detected
+        """
+        baseline = {'results': [
+            {'targets': 10, 'mean_cycle_seconds': 1.0},
+            {'targets': 100, 'mean_cycle_seconds': 10.0}
+        ]}
+        report = {'results': [
+            {'targets': 10, 'mean_cycle_seconds': 1.05},
+            {'targets': 100, 'mean_cycle_seconds': 12.0}
+        ]}
+        lines, regressions = run.compare(report, baseline, threshold=0.1)
+        self.assertEqual(regressions, 1)
+        self.assertIn('REGRESSION', lines[1])
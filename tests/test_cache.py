@@ -0,0 +1,50 @@
+# Author: FL42
+
+"""
+Tests for the cache tool
+"""
+
+import unittest
+from unittest import mock
+
+from src.tools.cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def test_get_set(self):
+        """
+        Stored value is returned
+        """
+        cache = LRUCache('test_get_set')
+        cache.set('key', 'value')
+        self.assertEqual(cache.get('key'), 'value')
+        self.assertIsNone(cache.get('missing'))
+
+    def test_eviction(self):
+        """
+        Least recently used entry is evicted first
+        """
+        cache = LRUCache('test_eviction', max_size=2)
+        cache.set(1, 1)
+        cache.set(2, 2)
+        cache.get(1)
+        cache.set(3, 3)
+        self.assertEqual(cache.get(1), 1)
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(len(cache), 2)
+
+    def test_expiration(self):
+        """
+        Expired entries are not returned
+        """
+        cache = LRUCache('test_expiration')
+        with mock.patch('src.tools.cache.monotonic', return_value=100):
+            cache.set('key', 'value', ttl=10)
+        with mock.patch('src.tools.cache.monotonic', return_value=105):
+            self.assertEqual(cache.get('key'), 'value')
+        with mock.patch('src.tools.cache.monotonic', return_value=111):
+            self.assertIsNone(cache.get('key'))
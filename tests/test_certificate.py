@@ -0,0 +1,103 @@
+# Author: FL42
+
+"""
+Tests for the certificate tool
+"""
+
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+from src.tools import Message, certificate
+from tests.helpers import make_certificate
+
+
+class TestCertificate(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def _state(self, lifetime):
+        """
+        Return the CertificateState of a cert valid for lifetime seconds
+        """
+        cert, _ = make_certificate(lifetime=lifetime)
+        return certificate.CertificateStore().get_state(
+            'https', 'localhost:443', cert
+        )
+
+    def test_valid(self):
+        """
+        Certificate valid for 30 days
+        """
+        state = self._state(30 * 86400)
+        self.assertEqual(
+            certificate.check_expiry('test', state, 48, 168), []
+        )
+
+    def test_warning_window(self):
+        """
+        Certificate valid for 5 days
+        """
+        state = self._state(5 * 86400)
+        results = certificate.check_expiry('test', state, 48, 168)
+        self.assertEqual(results, [Message(
+            'test', 'Certificate will expire in less than 7 days',
+            Message.WARNING
+        )])
+        self.assertEqual(certificate.check_expiry('test', state, 48), [])
+
+    def test_error_window(self):
+        """
+        Certificate valid for 1 day
+        """
+        state = self._state(86400)
+        results = certificate.check_expiry('test', state, 72)
+        self.assertEqual(results, [Message(
+            'test', 'Certificate will expire in less than 72 hours',
+            Message.ERROR
+        )])
+
+    def test_expiry_gauge(self):
+        """
+        Expiration timestamp is exported
+        """
+        state = self._state(86400)
+        self.assertEqual(
+            REGISTRY.get_sample_value(
+                'cert_expiry_timestamp_seconds',
+                {'probe': 'https', 'target': 'localhost:443'}
+            ),
+            state.not_after
+        )
+
+    def test_state_reused(self):
+        """
+        Certificate is parsed only when its fingerprint changes
+        """
+        store = certificate.CertificateStore()
+        cert, _ = make_certificate()
+        state = store.get_state('smtp', 'localhost:25', cert)
+        self.assertIs(store.get_state('smtp', 'localhost:25', cert), state)
+        other_cert, _ = make_certificate()
+        self.assertIsNot(
+            store.get_state('smtp', 'localhost:25', other_cert), state
+        )
+
+    def test_revalidation_interval(self):
+        """
+        Validation is only done again once interval has elapsed
+        """
+        state = self._state(86400)
+        validate_function = mock.Mock(return_value=['message'])
+        with mock.patch('src.tools.certificate.time', return_value=1000):
+            state.validate('test', 60, validate_function)
+        with mock.patch('src.tools.certificate.time', return_value=1030):
+            self.assertEqual(
+                state.validate('test', 60, validate_function), ['message']
+            )
+        self.assertEqual(validate_function.call_count, 1)
+        with mock.patch('src.tools.certificate.time', return_value=1060):
+            state.validate('test', 60, validate_function)
+        self.assertEqual(validate_function.call_count, 2)
@@ -0,0 +1,88 @@
+# Author: FL42
+
+"""
+Tests for the notification digest
+"""
+
+import unittest
+from unittest import mock
+
+from src.notification import digest
+from src.tools import Message
+
+SMTP_CONFIG = {
+    'host': 'smtp.example.com',
+    'recipient_address': 'root@localhost'
+}
+
+
+class TestDigest(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def setUp(self):
+        self.deliver_function = mock.Mock()
+        self.aggregator = digest.DigestAggregator(self.deliver_function)
+
+    def _add(self, now, messages, window=60, error_max_delay=10):
+        """
+        Add messages at time now
+        """
+        with mock.patch('src.notification.digest.monotonic', return_value=now):
+            self.aggregator.add(messages, SMTP_CONFIG, window, error_max_delay)
+
+    def _flush(self, now):
+        """
+        Flush at time now
+        """
+        with mock.patch('src.notification.digest.monotonic', return_value=now):
+            self.aggregator.flush()
+
+    def test_one_digest_per_recipient(self):
+        """
+        Messages of several configs are merged until the window ends
+        """
+        self._add(0, [Message('Service 1', 'Message 1', Message.WARNING)])
+        self._add(5, [Message('Service 2', 'Message 2', Message.WARNING)])
+        self._flush(30)
+        self.deliver_function.assert_not_called()
+        self._flush(60)
+        self.deliver_function.assert_called_once()
+        body = self.deliver_function.call_args[0][1]
+        self.assertIn('Message 1', body)
+        self.assertIn('Message 2', body)
+
+    def test_error_max_delay(self):
+        """
+        ERROR messages are sent after error_max_delay
+        """
+        self._add(0, [Message('Service 1', 'Message 1', Message.WARNING)])
+        self._add(5, [Message('Service 2', 'Message 2', Message.ERROR)])
+        self._flush(14)
+        self.deliver_function.assert_not_called()
+        self._flush(15)
+        self.deliver_function.assert_called_once()
+
+    def test_format(self):
+        """
+        Messages are grouped by severity and service
+        """
+        body = digest.format_digest([
+            Message('Service 2', 'Message 2', Message.WARNING),
+            Message('Service 1', 'Message 1', Message.ERROR),
+            Message('Service 1', 'Message 3', Message.ERROR,
+                    header='back online')
+        ])
+        self.assertEqual(
+            body,
+            "== ERROR ==\n"
+            "Service 1\n"
+            "  - Message 1\n"
+            "  - [back online] Message 3\n"
+            "\n"
+            "== WARNING ==\n"
+            "Service 2\n"
+            "  - Message 2\n"
+            "\n"
+        )
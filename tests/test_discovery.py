@@ -0,0 +1,208 @@
+# Author: FL42
+
+"""
+Tests for service discovery
+"""
+
+import json
+import os
+import socket
+import tempfile
+import unittest
+from time import sleep
+from types import SimpleNamespace
+from unittest import mock
+
+import dns.name
+from prometheus_client import REGISTRY
+
+from src.monitoring import ServicesMonitoring
+from src.tools import AlertState, Message
+from src.tools.discovery import Discovery, FileProvider, SRVProvider
+
+
+class FailingProvider:
+    """
+    Provider whose fetch fails
+    """
+
+    name = 'failing'
+
+    def fetch(self):
+        raise OSError("unavailable")
+
+
+class ListProvider:
+    """
+    Provider returning a list instead of a mapping
+    """
+
+    name = 'list'
+
+    def fetch(self):
+        return ['a.example.com']
+
+
+class TestDiscovery(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'targets.json')
+        self.provider = FileProvider(self.path)
+        self.discovery = Discovery(
+            [(self.provider, 60)], ServicesMonitoring.probe_mapping
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, services, mtime):
+        with open(self.path, 'wt', encoding='utf-8') as targets_file:
+            json.dump(services, targets_file)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_incremental(self):
+        """
+        Only added and removed services change
+        """
+        self.write({'raw_tcp': [
+            {'host': 'a.example.com', 'port': 22},
+            {'host': 'b.example.com', 'port': 22}
+        ]}, 1000)
+        self.assertEqual(self.discovery.refresh(self.provider), (2, 0))
+        kept = self.discovery.specs[1][2]
+
+        self.write({'raw_tcp': [
+            {'host': 'b.example.com', 'port': 22},
+            {'expand': {'host': ['c.example.com'], 'port': [22, 443]}},
+            {'host': 'invalid.example.com', 'port': '22'}
+        ]}, 2000)
+        self.assertEqual(self.discovery.refresh(self.provider), (2, 1))
+        self.assertEqual(
+            [spec.target for _, _, spec in self.discovery.specs],
+            ['b.example.com:22', 'c.example.com:22', 'c.example.com:443']
+        )
+        self.assertIs(self.discovery.specs[0][2], kept)
+        self.assertEqual(
+            self.discovery.removed_targets(), [('raw_tcp', 'a.example.com:22')]
+        )
+        self.assertEqual(self.discovery.removed_targets(), [])
+
+        # Unmodified file is not parsed again
+        with mock.patch('yaml.safe_load') as safe_load:
+            self.assertEqual(self.discovery.refresh(self.provider), (0, 0))
+        safe_load.assert_not_called()
+
+    def test_failure(self):
+        """
+        Services of a failing provider are kept
+        """
+        self.write({'ping': ['a.example.com']}, 1000)
+        self.discovery.refresh(self.provider)
+        os.remove(self.path)
+        self.assertEqual(self.discovery.refresh(self.provider), (0, 0))
+        self.assertEqual(len(self.discovery.specs), 1)
+        discovery = Discovery([(FailingProvider(), 60)], {})
+        self.assertEqual(discovery.refresh(FailingProvider()), (0, 0))
+
+    def test_errors(self):
+        """
+        Any error of a service or a refresh is logged, the thread goes on
+        """
+        def broken_spec(service, path):
+            raise ValueError("broken")
+
+        probe_mapping = dict(ServicesMonitoring.probe_mapping)
+        probe_mapping['broken'] = {
+            'module': SimpleNamespace(Spec=broken_spec)
+        }
+        self.discovery.probe_mapping = probe_mapping
+        self.write({'broken': ['a'], 'ping': ['b.example.com']}, 1000)
+        with self.assertLogs('src.tools.discovery', 'ERROR'):
+            self.assertEqual(self.discovery.refresh(self.provider), (1, 0))
+
+        discovery = Discovery([(ListProvider(), 60)], {})
+        with self.assertLogs('src.tools.discovery', 'ERROR'):
+            discovery.start()
+            for _ in range(50):
+                if REGISTRY.get_sample_value(
+                        'discovery_failures_total', {'provider': 'list'}):
+                    break
+                sleep(0.1)
+        self.assertTrue(discovery.is_alive())
+        discovery.stop()
+        discovery.join(5)
+
+    def test_srv(self):
+        """
+        One service per SRV record, with a template or host and port
+        """
+        records = [
+            SimpleNamespace(target=dns.name.from_text(host), port=port,
+                            priority=10, weight=5)
+            for host, port in (('mx1.example.com', 25),
+                               ('mx2.example.com', 587))
+        ]
+        provider = SRVProvider('_submission._tcp.example.com', 'smtp',
+                               options={'check_tlsa': True},
+                               nameservers=['127.0.0.1'])
+        with mock.patch.object(provider.resolver, 'query',
+                               return_value=records) as query:
+            self.assertEqual(provider.fetch(), {'smtp': [
+                {'check_tlsa': True, 'host': 'mx1.example.com', 'port': 25},
+                {'check_tlsa': True, 'host': 'mx2.example.com', 'port': 587}
+            ]})
+        query.assert_called_once_with('_submission._tcp.example.com', 'SRV')
+
+        provider = SRVProvider('_https._tcp.example.com', 'https',
+                               template='https://{host}:{port}/')
+        discovery = Discovery(
+            [(provider, 60)], ServicesMonitoring.probe_mapping
+        )
+        with mock.patch.object(provider.resolver, 'query',
+                               return_value=records):
+            self.assertEqual(discovery.refresh(provider), (2, 0))
+        self.assertEqual(
+            [spec.target for _, _, spec in discovery.specs],
+            ['https://mx1.example.com:25/', 'https://mx2.example.com:587/']
+        )
+
+    def test_monitor(self):
+        """
+        Discovered services are probed, state of removed ones is dropped
+        (their alerts too: they are not back online)
+        """
+        with socket.socket() as server:
+            server.bind(('127.0.0.1', 0))
+            server.listen(8)
+            port = server.getsockname()[1]
+            self.write({'raw_tcp': [{'host': '127.0.0.1', 'port': port}]},
+                       1000)
+
+            services_monitoring = ServicesMonitoring(None)
+            services_monitoring.config = {'probes': {}}
+            services_monitoring.discovery = self.discovery
+            self.discovery.refresh(self.provider)
+            services_monitoring.monitor(send_notification=False)
+            key = ('raw_tcp', '127.0.0.1:{}'.format(port))
+            self.assertTrue(services_monitoring.last_results[key][0])
+
+            message = Message('[raw_tcp] {}'.format(key[1]), 'Timeout',
+                              Message.ERROR)
+            services_monitoring.down_services = {
+                message.key: AlertState(message, 0)
+            }
+            self.write({'raw_tcp': []}, 2000)
+            self.discovery.refresh(self.provider)
+            services_monitoring.monitor(send_notification=False)
+            self.assertEqual(services_monitoring.down_services, {})
+            self.assertEqual(services_monitoring.manage_notifications([]), [])
+            self.assertNotIn(key, services_monitoring.last_results)
+            self.assertNotIn(key, services_monitoring.flap_detector.targets)
+
+
+if __name__ == '__main__':
+    unittest.main()
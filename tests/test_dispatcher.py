@@ -0,0 +1,130 @@
+# Author: FL42
+
+"""
+Tests for the notification dispatcher
+"""
+
+import os
+import tempfile
+import unittest
+from time import sleep
+
+from src.notification.dispatcher import NotificationDispatcher
+
+
+class FakeSender:
+    """
+    Send function failing the first `failures` times
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.sent = []
+
+    def __call__(self, subject, body, smtp_config):
+        if self.failures > 0:
+            self.failures -= 1
+            return False
+        self.sent.append((subject, body, smtp_config))
+        return True
+
+
+def wait_for(condition, timeout=5):
+    """
+    Wait until condition() is True
+    """
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        sleep(0.01)
+    return False
+
+
+class TestNotificationDispatcher(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def setUp(self):
+        self.dispatchers = []
+
+    def tearDown(self):
+        for dispatcher in self.dispatchers:
+            dispatcher.exit_event.set()
+
+    def _dispatcher(self, sender, **options):
+        """
+        Return a dispatcher using sender (not started)
+        """
+        dispatcher = NotificationDispatcher(send_function=sender, **options)
+        self.dispatchers.append(dispatcher)
+        return dispatcher
+
+    def test_delivery(self):
+        """
+        Queued notification is delivered
+        """
+        sender = FakeSender()
+        dispatcher = self._dispatcher(sender)
+        dispatcher.start()
+        self.assertTrue(dispatcher.enqueue('subject', 'body', {}))
+        self.assertTrue(wait_for(lambda: sender.sent))
+        self.assertEqual(sender.sent, [('subject', 'body', {})])
+
+    def test_retry(self):
+        """
+        Failed delivery is retried with backoff
+        """
+        sender = FakeSender(failures=2)
+        dispatcher = self._dispatcher(sender, backoff=0.01)
+        dispatcher.start()
+        dispatcher.enqueue('subject', 'body', {})
+        self.assertTrue(wait_for(lambda: sender.sent))
+
+    def test_queue_full(self):
+        """
+        Enqueue never blocks and drops notification if queue is full
+        """
+        dispatcher = self._dispatcher(FakeSender(), max_size=1)
+        self.assertTrue(dispatcher.enqueue('subject', 'body 1', {}))
+        self.assertFalse(dispatcher.enqueue('subject', 'body 2', {}))
+
+    def test_spool_failure(self):
+        """
+        A spool error drops the notification without raising
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            spool_directory = os.path.join(directory, 'spool')
+            dispatcher = self._dispatcher(
+                FakeSender(), max_size=1, spool_directory=spool_directory
+            )
+            os.rmdir(spool_directory)
+            self.assertTrue(dispatcher.enqueue('subject', 'body 1', {}))
+            self.assertFalse(dispatcher.enqueue('subject', 'body 2', {}))
+
+    def test_spool(self):
+        """
+        Undelivered notification is spooled and delivered after restart
+        """
+        with tempfile.TemporaryDirectory() as spool_directory:
+            dispatcher = self._dispatcher(
+                FakeSender(failures=1),
+                max_retries=1,
+                spool_directory=spool_directory
+            )
+            dispatcher.start()
+            dispatcher.enqueue('subject', 'body', {'host': 'localhost'})
+            self.assertTrue(wait_for(lambda: os.listdir(spool_directory)))
+            dispatcher.exit_event.set()
+
+            sender = FakeSender()
+            self._dispatcher(
+                sender,
+                spool_directory=spool_directory
+            ).start()
+            self.assertTrue(wait_for(lambda: sender.sent))
+            self.assertEqual(
+                sender.sent,
+                [('subject', 'body', {'host': 'localhost'})]
+            )
+            self.assertTrue(wait_for(lambda: not os.listdir(spool_directory)))
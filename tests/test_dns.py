@@ -5,7 +5,13 @@ Tests for the dns probe
 """
 
 import unittest
-from src.probes import dns
+from unittest import mock
+
+import dns.message
+import dns.rrset
+
+from src.probes import dns as dns_probe
+from src.tools import Message
 
 
 class TestDNS(unittest.TestCase):
@@ -17,7 +23,7 @@ class TestDNS(unittest.TestCase):
         """
         Should work
         """
-        results = dns.test({
+        results = dns_probe.test({
             'domain': 'google.fr',
             'ns_IPs': ['8.8.8.8']
         })
@@ -27,7 +33,7 @@ class TestDNS(unittest.TestCase):
         """
         Should work
         """
-        results = dns.test({
+        results = dns_probe.test({
             'domain': 'google.fr'
         })
         self.assertEqual(len(results), 0)
@@ -36,7 +42,7 @@ class TestDNS(unittest.TestCase):
         """
         Should not work (nx domain)
         """
-        results = dns.test({
+        results = dns_probe.test({
             'domain': 'ImD5elFzdR77QDl7.com',
             'ns_IPs': ['8.8.8.8']
         })
@@ -46,7 +52,7 @@ class TestDNS(unittest.TestCase):
         """
         Should work
         """
-        results = dns.test({
+        results = dns_probe.test({
             'domain': 'internetsociety.org',
             'ns_IPs': ['8.8.8.8'],
             'dnssec': True
@@ -57,7 +63,7 @@ class TestDNS(unittest.TestCase):
         """
         Should not work (invalid dnssec)
         """
-        results = dns.test({
+        results = dns_probe.test({
             'domain': 'dnssec-failed.org',
             'ns_IPs': ['8.8.8.8'],
             'dnssec': True
@@ -68,9 +74,74 @@ class TestDNS(unittest.TestCase):
         """
         Should work (DNSSEC disabled)
         """
-        results = dns.test({
+        results = dns_probe.test({
             'domain': 'dnssec-failed.org',
             'ns_IPs': ['8.8.8.8'],
             'dnssec': False
         })
         self.assertTrue(len(results) > 0)
+
+
+class TestDNSMocked(unittest.TestCase):
+    """
+    Tests for the dns probe against mocked nameservers
+    """
+
+    serials = {'192.0.2.1': 2020010101, '192.0.2.2': 2020010101}
+
+    def _fake_query(self, request, ns_ip, **_options):
+        """
+        Answer like a nameserver using self.serials
+        """
+        response = dns.message.make_response(request)
+        question = request.question[0]
+        if question.rdtype == dns.rdatatype.SOA:
+            response.answer.append(dns.rrset.from_text(
+                question.name, 3600, 'IN', 'SOA',
+                'ns1.example.com. root.example.com. {} 7200 3600 1209600 3600'
+                .format(self.serials[ns_ip])
+            ))
+        else:
+            response.answer.append(dns.rrset.from_text(
+                question.name, 3600, 'IN', 'A', '192.0.2.10'
+            ))
+        return response
+
+    def _test(self):
+        """
+        Run the probe with mocked UDP and TCP queries
+        """
+        with mock.patch('dns.query.udp', side_effect=self._fake_query), \
+                mock.patch('dns.query.tcp', side_effect=self._fake_query):
+            return dns_probe.test({
+                'domain': 'example.com',
+                'ns_IPs': list(self.serials)
+            })
+
+    def test_consistent_serials(self):
+        """
+        Should work
+        """
+        self.assertEqual(len(self._test()), 0)
+
+    def test_inconsistent_serials(self):
+        """
+        Nameserver lagging behind must be flagged
+        """
+        self.serials = {'192.0.2.1': 2020010102, '192.0.2.2': 2020010101}
+        results = self._test()
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].severity, Message.WARNING)
+        self.assertIn('192.0.2.2', results[0].body)
+
+    def test_all_nameservers_checked(self):
+        """
+        Every nameserver must be queried (not only the first one)
+        """
+        with mock.patch('dns.query.udp', side_effect=self._fake_query), \
+                mock.patch('dns.query.tcp', side_effect=Exception('down')):
+            results = dns_probe.test({
+                'domain': 'example.com',
+                'ns_IPs': list(self.serials)
+            })
+        self.assertEqual(len(results), 2)
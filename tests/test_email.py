@@ -0,0 +1,99 @@
+# Author: FL42
+
+"""
+Tests for the email notification
+"""
+
+import socket
+import unittest
+
+from src.notification import email
+from tests.helpers import (make_certificate, make_server_context,
+                           start_smtp_server)
+
+
+class TestEmail(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def setUp(self):
+        self.server = None
+        email.pool.close_all()
+
+    def tearDown(self):
+        email.pool.close_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _smtp_config(self, **options):
+        """
+        Return smtp_config for self.server
+        """
+        smtp_config = {
+            'host': '127.0.0.1',
+            'port': self.server.server_address[1],
+            'starttls': False,
+            'sender_address': 'monitoring@localhost',
+            'recipient_address': 'root@localhost'
+        }
+        smtp_config.update(options)
+        return smtp_config
+
+    def test_one_session(self):
+        """
+        Several messages are sent using the same connection
+        """
+        self.server = start_smtp_server()
+        smtp_config = self._smtp_config(user='user', password='password')
+        for i in range(3):
+            self.assertTrue(email.send_email(
+                'subject {}'.format(i), 'body', smtp_config
+            ))
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.messages), 3)
+
+    def test_starttls(self):
+        """
+        Message is sent after STARTTLS
+        """
+        cert, key = make_certificate()
+        self.server = start_smtp_server(make_server_context(cert, key))
+        self.assertTrue(email.send_email(
+            'subject', 'body', self._smtp_config(starttls=True)
+        ))
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_reconnect(self):
+        """
+        Connection closed by server is opened again
+        """
+        self.server = start_smtp_server()
+        smtp_config = self._smtp_config()
+        self.assertTrue(email.send_email('subject', 'body', smtp_config))
+        self.server.sessions[0].shutdown(socket.SHUT_RDWR)
+        self.assertTrue(email.send_email('subject', 'body', smtp_config))
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_config_respected(self):
+        """
+        Different smtp_config do not share a connection
+        """
+        self.server = start_smtp_server()
+        email.send_email('subject', 'body', self._smtp_config(user='a',
+                                                              password='a'))
+        email.send_email('subject', 'body', self._smtp_config(user='b',
+                                                              password='b'))
+        self.assertEqual(self.server.connections, 2)
+
+    def test_unreachable(self):
+        """
+        Failure is reported
+        """
+        self.server = start_smtp_server()
+        closed = socket.socket()
+        closed.bind(('127.0.0.1', 0))
+        smtp_config = self._smtp_config(port=closed.getsockname()[1])
+        self.assertFalse(email.send_email('subject', 'body', smtp_config))
+        closed.close()
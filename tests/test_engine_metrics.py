@@ -0,0 +1,69 @@
+# Author: FL42
+
+"""
+Tests for engine metrics
+"""
+
+import socket
+import unittest
+
+from prometheus_client import REGISTRY
+
+from src.tools import engine_metrics
+
+
+class TestEngineMetrics(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def test_open_sockets(self):
+        """
+        Opened sockets are counted
+        """
+        before = engine_metrics.count_open_sockets()
+        with socket.socket():
+            self.assertEqual(engine_metrics.count_open_sockets(), before + 1)
+
+    def test_cycle_timer(self):
+        """
+        Lag, duration and busy ratio
+        """
+        labels = {'config': 'unittest'}
+        cycle_timer = engine_metrics.CycleTimer('unittest', delay=10)
+
+        cycle_timer.start(100)
+        self.assertEqual(cycle_timer.end(105), 5)
+        cycle_timer.start(117)
+
+        # Due at 110 (fixed rate)
+        self.assertEqual(
+            REGISTRY.get_sample_value(
+                'monitor_scheduler_lag_seconds_sum', labels
+            ),
+            7
+        )
+        self.assertEqual(
+            REGISTRY.get_sample_value(
+                'monitor_cycle_duration_seconds_sum', labels
+            ),
+            5
+        )
+        self.assertAlmostEqual(
+            REGISTRY.get_sample_value('monitor_busy_ratio', labels),
+            5 / 17
+        )
+
+        # A long cycle delays the next one: lag, and no wait
+        self.assertEqual(cycle_timer.end(122), 0)
+        cycle_timer.start(122)
+        self.assertEqual(
+            REGISTRY.get_sample_value(
+                'monitor_scheduler_lag_seconds_sum', labels
+            ),
+            7 + 2
+        )
+        # Missed cycles are skipped
+        self.assertEqual(cycle_timer.end(150), 0)
+        cycle_timer.start(150)
+        self.assertEqual(cycle_timer.end(151), 9)
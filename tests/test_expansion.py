@@ -0,0 +1,189 @@
+# Author: FL42
+
+"""
+Tests for target expansion
+"""
+
+import os
+import tempfile
+import unittest
+
+import yaml
+
+from src.monitoring import ServicesMonitoring
+from src.tools.inventory import collect_endpoints
+from src.tools.spec import (ConfigError, compile_probes, count_targets,
+                            iter_specs)
+
+
+class TestExpansion(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.hosts_path = os.path.join(self.directory.name, 'hosts.txt')
+        with open(self.hosts_path, 'wt', encoding='utf-8') as hosts_file:
+            hosts_file.write("# Web servers\nweb1.example.com\n\n"
+                             "web2.example.com\n")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_matrix(self):
+        """
+        Every combination of CIDR hosts, values and ranges is generated
+        """
+        compiled = compile_probes(
+            {'raw_tcp': [
+                {'host': 'example.com', 'port': 22},
+                {
+                    'expand': {
+                        'host': [{'cidr': '192.0.2.0/30'}, 'example.org'],
+                        'port': [22, {'range': [8080, 8081]}]
+                    },
+                    'timeout': 2
+                }
+            ]},
+            ServicesMonitoring.probe_mapping
+        )
+        self.assertEqual(count_targets(compiled), 10)
+        specs = list(iter_specs(compiled))
+        self.assertEqual(len(specs), 10)
+        self.assertEqual(
+            [(spec.host, spec.port) for _, _, spec in specs[:5]],
+            [('example.com', 22), ('192.0.2.1', 22), ('192.0.2.1', 8080),
+             ('192.0.2.1', 8081), ('192.0.2.2', 22)]
+        )
+        self.assertTrue(all(spec.timeout == 2 for _, _, spec in specs[1:]))
+
+    def test_template(self):
+        """
+        Templates are formatted with values of a file
+        """
+        compiled = compile_probes(
+            {'https': [{
+                'expand': {
+                    'host': {'file': self.hosts_path},
+                    'port': [443, 8443]
+                },
+                'template': 'https://{host}:{port}/health',
+                'pattern': 'OK'
+            }]},
+            ServicesMonitoring.probe_mapping
+        )
+        self.assertEqual(count_targets(compiled), 4)
+        self.assertEqual(
+            [spec.target for _, _, spec in iter_specs(compiled)],
+            ['https://web1.example.com:443/health',
+             'https://web1.example.com:8443/health',
+             'https://web2.example.com:443/health',
+             'https://web2.example.com:8443/health']
+        )
+
+    def test_lazy(self):
+        """
+        Large ranges are counted without being materialized
+        """
+        compiled = compile_probes(
+            {'ping': [{'expand': {'host': {'cidr': '10.0.0.0/16'}}}]},
+            ServicesMonitoring.probe_mapping
+        )
+        self.assertEqual(count_targets(compiled), 2 ** 16 - 2)
+        specs = iter_specs(compiled)
+        self.assertEqual(next(specs)[2].target, '10.0.0.1')
+        self.assertEqual(next(specs)[2].target, '10.0.0.2')
+
+    def test_errors(self):
+        """
+        All errors of expansions are reported
+        """
+        with self.assertRaises(ConfigError) as context:
+            compile_probes(
+                {
+                    'raw_tcp': [{
+                        'expand': {
+                            'host': [{'cidr': '10.0.0.0/33'},
+                                     {'cidr': '2001:db8::/64'}],
+                            'port': {'range': [1, 'x']}
+                        }
+                    }],
+                    'https': [
+                        {
+                            'expand': {'host': {'file': '/nonexistent'}},
+                            'template': 'https://{host}/{path}'
+                        },
+                        {'expand': {'url': ['https://a']}, 'timout': 1}
+                    ]
+                },
+                ServicesMonitoring.probe_mapping
+            )
+        errors = context.exception.errors
+        self.assertEqual(len(errors), 6)
+        self.assertIn(
+            "probes.raw_tcp[0].expand.host: invalid source "
+            "{'cidr': '2001:db8::/64'}: more than 65536 addresses",
+            errors
+        )
+        self.assertIn(
+            'probes.https[0]: template of url uses undefined variable path',
+            errors
+        )
+        self.assertIn('probes.https[1][expanded]: unknown option timout',
+                      errors)
+
+    def test_generation_errors(self):
+        """
+        Errors while generating services skip the bad entries
+        """
+        compiled = compile_probes(
+            {
+                'raw_tcp': [{
+                    'expand': {'port': [22, 'ssh', 443]},
+                    'host': 'localhost'
+                }],
+                'ping': [
+                    {'expand': {'host': {'file': self.hosts_path}}},
+                    '127.0.0.1'
+                ]
+            },
+            ServicesMonitoring.probe_mapping
+        )
+        os.remove(self.hosts_path)
+        with self.assertLogs('src.tools.expansion', 'ERROR') as logs:
+            targets = [spec.target for _, _, spec in iter_specs(compiled)]
+        self.assertEqual(targets, ['localhost:22', 'localhost:443',
+                                   '127.0.0.1'])
+        self.assertEqual(len(logs.output), 2)
+
+    def test_example(self):
+        """
+        Expansions of example.yaml are valid
+        """
+        with open('example.yaml', 'rt', encoding='utf-8') as config_file:
+            config = yaml.safe_load(config_file)
+        compiled = compile_probes(
+            config['probes'], ServicesMonitoring.probe_mapping
+        )
+        self.assertEqual(
+            count_targets(compiled), len(list(iter_specs(compiled)))
+        )
+
+    def test_inventory(self):
+        """
+        Generated services are part of the inventory
+        """
+        endpoints = collect_endpoints([{'probes': {'https': [{
+            'expand': {'host': {'file': self.hosts_path}},
+            'template': 'https://{host}'
+        }]}}])
+        self.assertEqual(
+            sorted(endpoints),
+            [('https', 'web1.example.com', 443, False),
+             ('https', 'web2.example.com', 443, False)]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
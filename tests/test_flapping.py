@@ -0,0 +1,104 @@
+# Author: FL42
+
+"""
+Tests for alert damping and flap detection
+"""
+
+import unittest
+from unittest import mock
+
+from src.monitoring import ServicesMonitoring
+from src.tools import Message
+from src.tools.flapping import FlapDetector
+
+FAILURE = [Message('[ping] host', 'Host is not reachable', Message.ERROR)]
+
+
+class TestFlapDetector(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    @staticmethod
+    def _run(flap_detector, results):
+        """
+        Return reported messages for each result (True means success)
+        """
+        return [
+            flap_detector.update('ping', 'host', [] if success else FAILURE)
+            for success in results
+        ]
+
+    def test_default_behaviour(self):
+        """
+        Without damping, results are reported as is
+        """
+        reported = self._run(FlapDetector(flap_threshold=0),
+                             [True, False, True])
+        self.assertEqual(reported, [[], FAILURE, []])
+
+    def test_failure_threshold(self):
+        """
+        Target is down after failure_threshold consecutive failures
+        """
+        reported = self._run(
+            FlapDetector(failure_threshold=3),
+            [False, False, True, False, False, False]
+        )
+        self.assertEqual(reported, [[], [], [], [], [], FAILURE])
+
+    def test_success_threshold(self):
+        """
+        Target is back up after success_threshold consecutive successes
+        """
+        reported = self._run(
+            FlapDetector(success_threshold=2),
+            [False, True, False, True, True]
+        )
+        self.assertEqual(reported, [FAILURE, FAILURE, FAILURE, FAILURE, []])
+
+    def test_flapping(self):
+        """
+        Flapping target is reported once as flapping
+        """
+        flap_detector = FlapDetector(flap_window=6, flap_threshold=4)
+        reported = self._run(
+            flap_detector,
+            [False, True, False, True, False, True, True, True, True]
+        )
+        self.assertEqual(reported[:4], [FAILURE, [], FAILURE, []])
+        # 4 changes: flapping, state frozen (up)
+        self.assertEqual(len(reported[4]), 1)
+        self.assertIn('flapping', reported[4][0].body)
+        self.assertEqual(reported[4], reported[5])
+        self.assertEqual(reported[5], reported[6])
+        # back to stable state
+        self.assertEqual(reported[8], [])
+        self.assertFalse(flap_detector.targets[('ping', 'host')].flapping)
+
+    def test_ports(self):
+        """
+        Each port of a host has its own state
+        """
+        services_monitoring = ServicesMonitoring('config.yaml')
+        services_monitoring.config = {'probes': {'raw_tcp': [
+            {'host': 'host', 'port': 22}, {'host': 'host', 'port': 443}
+        ]}}
+        services_monitoring.flap_detector = FlapDetector(failure_threshold=2)
+
+        def test(service):
+            if service.port == 22:
+                return [Message(service.service_name, 'Connection refused',
+                                Message.ERROR)]
+            return []
+
+        with mock.patch('src.probes.raw_tcp.test', side_effect=test), \
+                mock.patch('src.monitoring.sleep'):
+            for _ in range(2):
+                services_monitoring.monitor(send_notification=False)
+        targets = services_monitoring.flap_detector.targets
+        self.assertEqual(sorted(targets), [('raw_tcp', 'host:22'),
+                                           ('raw_tcp', 'host:443')])
+        self.assertTrue(targets[('raw_tcp', 'host:22')].down)
+        self.assertFalse(targets[('raw_tcp', 'host:22')].flapping)
+        self.assertFalse(targets[('raw_tcp', 'host:443')].down)
@@ -0,0 +1,131 @@
+# Author: FL42
+
+"""
+Tests for the history of results
+"""
+
+import json
+import unittest
+from time import time
+
+from src.tools import history
+
+
+class TestResultHistory(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def test_ring_buffer(self):
+        """
+        Columns grow up to capacity, then oldest samples are overwritten
+        """
+        result_history = history.ResultHistory(capacity=3)
+        result_history.append(1, True, 0.1)
+        self.assertEqual(len(result_history.timestamps), 1)
+        for timestamp in range(2, 6):
+            result_history.append(timestamp, True, 0.1)
+        timestamps, _, _ = result_history.window(0, 10)
+        self.assertEqual(list(timestamps), [3, 4, 5])
+        timestamps, _, _ = result_history.window(4, 4)
+        self.assertEqual(list(timestamps), [4])
+
+    def test_resolution(self):
+        """
+        Close results are merged
+        """
+        result_history = history.ResultHistory(capacity=10, resolution=60)
+        result_history.append(0, True, 0.1)
+        result_history.append(30, False, 0.5)
+        result_history.append(60, True, 0.2)
+        _, statuses, latencies = result_history.window(0, 100)
+        self.assertEqual(list(statuses), [0, 1])
+        self.assertEqual(list(latencies), [500, 200])
+
+    def test_statistics(self):
+        """
+        Uptime, MTTR and percentiles
+        """
+        result_history = history.ResultHistory(capacity=100)
+        # Down at 0, 1 (outage before window), 10-12 and 20-23
+        for timestamp in range(30):
+            success = not (timestamp < 2 or 10 <= timestamp < 13
+                           or 20 <= timestamp < 24)
+            result_history.append(timestamp, success, timestamp / 1000)
+        timestamps, statuses, latencies = result_history.window(0, 29)
+
+        self.assertAlmostEqual(history.uptime(statuses), 21 / 30)
+        self.assertEqual(history.mttr(timestamps, statuses), 3.5)
+        self.assertEqual(
+            history.percentiles(latencies),
+            {0.5: 0.014, 0.9: 0.026, 0.99: 0.029}
+        )
+        self.assertIsNone(history.uptime([]))
+        self.assertEqual(history.percentiles([]), {})
+
+    def test_window_stats(self):
+        """
+        Running statistics follow samples added, merged, overwritten
+        and leaving the window
+        """
+        result_history = history.ResultHistory(
+            capacity=5, resolution=10, windows=(30, 1000)
+        )
+        short, long = result_history.stats
+        result_history.append(0, True, 0.1)
+        result_history.append(5, False, 0.2)  # merged
+        self.assertEqual((long.count, long.up), (1, 0))
+        for timestamp in range(10, 70, 10):
+            result_history.append(timestamp, True, timestamp / 1000)
+        # Capacity 5: samples 0 and 10 overwritten
+        self.assertEqual((long.count, long.up), (5, 5))
+        result_history.expire(70)
+        self.assertEqual((short.count, short.up), (3, 3))
+        self.assertEqual(long.count, 5)
+
+        _, _, latencies = result_history.window(40, 70)
+        for quantile, latency in short.percentiles().items():
+            exact = history.percentiles(latencies)[quantile]
+            self.assertLessEqual(
+                abs(latency - exact),
+                exact * (history.LATENCY_GROWTH - 1)
+            )
+        result_history.expire(1000)
+        self.assertEqual(short.count, 0)
+        self.assertEqual(short.percentiles(), {})
+
+    def test_store(self):
+        """
+        Summary and HTTP handler
+        """
+        now = time()
+        store = history.get_store({'retention': 3600, 'resolution': 1})
+        store.append('ping', 'unittest', now - 20, True, 0.1)
+        store.append('ping', 'unittest', now - 10, False, 0.3)
+
+        summary = store.summary('ping', 'unittest', 15, now=now)
+        self.assertEqual(summary['samples'], 1)
+        self.assertEqual(summary['uptime'], 0)
+
+        status_code, _, body = history.handle(
+            {'probe': 'ping', 'target': 'unittest', 'window': '60'}
+        )
+        self.assertEqual(status_code, 200)
+        self.assertEqual(json.loads(body)['samples'], 2)
+        self.assertEqual(history.handle({'probe': 'ping'})[0], 400)
+        self.assertEqual(
+            history.handle({'probe': 'ping', 'target': 'unknown'})[0],
+            404
+        )
+
+        gauges = {
+            metric.name: metric.samples for metric in store.collect()
+        }
+        self.assertIn(
+            ('ping', 'unittest', '86400'),
+            [
+                (sample.labels['probe'], sample.labels['target'],
+                 sample.labels['window'])
+                for sample in gauges['probe_uptime_ratio']
+            ]
+        )
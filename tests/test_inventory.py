@@ -0,0 +1,109 @@
+# Author: FL42
+
+"""
+Tests for the inventory tool
+"""
+
+import io
+import json
+import socket
+import threading
+import unittest
+
+from src.tools import inventory
+from tests.helpers import make_certificate, make_server_context
+
+
+class TestInventory(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def test_collect_endpoints(self):
+        """
+        All TLS endpoints are collected without duplicates
+        (dns services are not TLS endpoints)
+        """
+        configs = [
+            {'probes': {
+                'https': [
+                    {'url': 'https://example.com'},
+                    {'url': 'http://example.com'},
+                    {'url': 'https://example.com:8443/path'}
+                ],
+                'smtp': [{'host': 'mail.example.com', 'check_tlsa': True}],
+                'ping': ['example.com']
+            }},
+            {'probes': {
+                'https': [{'url': 'https://example.com', 'check_tlsa': True}],
+                'dns': [{'domain': 'example.org', 'check_tlsa': True}]
+            }}
+        ]
+        self.assertEqual(
+            sorted(inventory.collect_endpoints(configs)),
+            [
+                ('https', 'example.com', 443, True),
+                ('https', 'example.com', 8443, False),
+                ('smtp', 'mail.example.com', 25, True)
+            ]
+        )
+
+    def test_scan(self):
+        """
+        Scan a local TLS server and an unreachable endpoint
+        """
+        cert, key = make_certificate(common_name='inventory.test')
+        context = make_server_context(cert, key)
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        port = server.getsockname()[1]
+
+        def serve():
+            connection, _ = server.accept()
+            try:
+                with context.wrap_socket(connection, server_side=True) as tls:
+                    tls.recv(1)
+            except OSError:
+                pass
+
+        thread = threading.Thread(target=serve)
+        thread.start()
+        closed_port = socket.socket()
+        closed_port.bind(('127.0.0.1', 0))
+        records = list(inventory.scan([
+            ('https', '127.0.0.1', port, False),
+            ('https', '127.0.0.1', closed_port.getsockname()[1], False)
+        ], concurrency=2))
+        thread.join()
+        server.close()
+        closed_port.close()
+
+        self.assertEqual(records[0]['subject'], 'CN=inventory.test')
+        self.assertEqual(records[0]['key_type'], 'RSA-2048')
+        self.assertEqual(
+            records[0]['fingerprint'],
+            cert.digest('sha256').decode('ascii')
+        )
+        self.assertEqual(records[0]['tlsa'], 'not checked')
+        self.assertEqual(records[0]['error'], '')
+        self.assertNotEqual(records[1]['error'], '')
+
+    def test_write_inventory(self):
+        """
+        JSON lines and CSV outputs
+        """
+        record = dict.fromkeys(inventory.FIELDS, '')
+        record.update(probe='https', host='example.com', port=443)
+
+        output = io.StringIO()
+        inventory.write_inventory([record, record], output, 'jsonl')
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0]), record)
+
+        output = io.StringIO()
+        inventory.write_inventory([record], output, 'csv')
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], ','.join(inventory.FIELDS))
+        self.assertTrue(lines[1].startswith('https,example.com,443,'))
@@ -4,6 +4,7 @@
 Tests for the message module
 """
 
+import pickle
 import unittest
 from src.tools import Message
 
@@ -102,3 +103,28 @@ class TestMessage(unittest.TestCase):
             "Message: service: Service name 0, body: Message body, "
             "severity: 40, header: None"
         )
+
+    def test_message_hash(self):
+        """
+        Equal messages have the same hash (usable in sets and dicts)
+        """
+        message1 = Message('Service name', 'Message body', Message.ERROR)
+        message2 = Message('Service name', 'Message body', Message.ERROR)
+        self.assertEqual(hash(message1), hash(message2))
+        self.assertEqual(len({message1, message2}), 1)
+        self.assertEqual(message1.key, message2.key)
+
+    def test_message_immutable(self):
+        """
+        Message attributes can't be modified
+        """
+        message = Message('Service name', 'Message body', Message.ERROR)
+        with self.assertRaises(AttributeError):
+            message.body = 'Other body'
+
+    def test_message_pickle(self):
+        """
+        Message can be pickled
+        """
+        message = Message('Service name', 'Message body', Message.ERROR, 'H')
+        self.assertEqual(pickle.loads(pickle.dumps(message)), message)
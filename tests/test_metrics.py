@@ -0,0 +1,59 @@
+# Author: FL42
+
+"""
+Tests for probe metrics
+"""
+
+import unittest
+
+from prometheus_client import REGISTRY
+
+from src.tools import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def test_series_limiter(self):
+        """
+        Targets above the limit are aggregated
+        """
+        limiter = metrics.SeriesLimiter(max_targets=2)
+        self.assertEqual(limiter.target_label('ping', 'a'), 'a')
+        self.assertEqual(limiter.target_label('ping', 'b'), 'b')
+        self.assertEqual(
+            limiter.target_label('ping', 'c'),
+            metrics.OVERFLOW_TARGET
+        )
+        self.assertEqual(limiter.target_label('ping', 'a'), 'a')
+        self.assertEqual(limiter.target_label('raw_tcp', 'c'), 'c')
+
+    def test_observe(self):
+        """
+        Durations are recorded on success and failure
+        """
+        labels = {'probe': 'unittest', 'target': 'host'}
+
+        metrics.observe('unittest', 'host', True, [0.2])
+        self.assertEqual(REGISTRY.get_sample_value('probe_up', labels), 1)
+
+        metrics.observe('unittest', 'host', False, [1.0, 1.0, 1.0])
+        self.assertEqual(REGISTRY.get_sample_value('probe_up', labels), 0)
+        self.assertEqual(
+            REGISTRY.get_sample_value('probe_duration_seconds_count', labels),
+            4
+        )
+        self.assertEqual(
+            REGISTRY.get_sample_value('probe_retries_total', labels),
+            2
+        )
+        self.assertEqual(
+            REGISTRY.get_sample_value('probe_success_total', labels),
+            1
+        )
+        self.assertEqual(
+            REGISTRY.get_sample_value('probe_failures_total', labels),
+            1
+        )
@@ -7,7 +7,7 @@ Tests for main file
 import unittest
 
 from src.monitoring import ServicesMonitoring
-from src.tools import Message
+from src.tools import AlertState, Message
 
 
 class TestNotificationManagementLogic(unittest.TestCase):
@@ -21,20 +21,37 @@ class TestNotificationManagementLogic(unittest.TestCase):
         """
         self.services_monitoring = ServicesMonitoring('unittest')
 
+    def set_down_services(self, messages):
+        """
+        Set messages as already sent
+        """
+        self.services_monitoring.down_services = {
+            message.key: AlertState(message, 0) for message in messages
+        }
+
+    def get_down_services(self):
+        """
+        Return messages already sent
+        """
+        return [
+            alert.message
+            for alert in self.services_monitoring.down_services.values()
+        ]
+
     def test_one_notification(self):
         """
         Test with one notification
         """
         message1 = Message('Service 1', 'Message 1', Message.ERROR)
         notifications = [message1]
-        self.services_monitoring.down_services = []
+        self.set_down_services([])
 
         notifications_to_send = \
             self.services_monitoring.manage_notifications(notifications)
 
         self.assertTrue(notifications_to_send == [message1])
         self.assertTrue(
-            self.services_monitoring.down_services == [message1]
+            self.get_down_services() == [message1]
         )
 
     def test_few_notifications(self):
@@ -44,14 +61,14 @@ class TestNotificationManagementLogic(unittest.TestCase):
         message1 = Message('Service 1', 'Message 1', Message.ERROR)
         message2 = Message('Service 2', 'Message 2', Message.ERROR)
         notifications = [message1, message2]
-        self.services_monitoring.down_services = []
+        self.set_down_services([])
 
         notifications_to_send = \
             self.services_monitoring.manage_notifications(notifications)
 
         self.assertTrue(notifications_to_send == [message1, message2])
         self.assertTrue(
-            self.services_monitoring.down_services == [message1, message2]
+            self.get_down_services() == [message1, message2]
         )
 
     def test_back_online(self):
@@ -68,13 +85,13 @@ class TestNotificationManagementLogic(unittest.TestCase):
             )
         ]
         notifications = []
-        self.services_monitoring.down_services = [message1]
+        self.set_down_services([message1])
 
         notifications_to_send = \
             self.services_monitoring.manage_notifications(notifications)
 
         self.assertTrue(notifications_to_send == expected_notifications)
-        self.assertTrue(not self.services_monitoring.down_services)
+        self.assertTrue(not self.get_down_services())
 
     def test_back_online_multiple_services(self):
         """
@@ -98,14 +115,14 @@ class TestNotificationManagementLogic(unittest.TestCase):
             )
         ]
         notifications = [message3]
-        self.services_monitoring.down_services = [message1, message2, message3]
+        self.set_down_services([message1, message2, message3])
 
         notifications_to_send = \
             self.services_monitoring.manage_notifications(notifications)
 
         self.assertTrue(notifications_to_send == expected_notifications)
         self.assertTrue(
-            self.services_monitoring.down_services == [message3]
+            self.get_down_services() == [message3]
         )
 
     def test_still_down(self):
@@ -114,14 +131,14 @@ class TestNotificationManagementLogic(unittest.TestCase):
         """
         message1 = Message('Service 1', 'Message 1', Message.ERROR)
         notifications = [message1]
-        self.services_monitoring.down_services = [message1]
+        self.set_down_services([message1])
 
         notifications_to_send = \
             self.services_monitoring.manage_notifications(notifications)
 
         self.assertTrue(not notifications_to_send)
         self.assertTrue(
-            self.services_monitoring.down_services == [message1]
+            self.get_down_services() == [message1]
         )
 
     def test_still_down_multiple_services(self):
@@ -131,12 +148,36 @@ class TestNotificationManagementLogic(unittest.TestCase):
         message1 = Message('Service 1', 'Message 1', Message.ERROR)
         message2 = Message('Service 2', 'Message 2', Message.ERROR)
         notifications = [message1, message2]
-        self.services_monitoring.down_services = [message1]
+        self.set_down_services([message1])
 
         notifications_to_send = \
             self.services_monitoring.manage_notifications(notifications)
 
         self.assertTrue(notifications_to_send == [message2])
         self.assertTrue(
-            self.services_monitoring.down_services == [message1, message2]
+            self.get_down_services() == [message1, message2]
         )
+
+    def test_alert_timestamps(self):
+        """
+        First-seen is kept and last-seen updated while service is down
+        """
+        message1 = Message('Service 1', 'Message 1', Message.ERROR)
+        self.set_down_services([message1])
+
+        self.services_monitoring.manage_notifications([message1])
+
+        alert = self.services_monitoring.down_services[message1.key]
+        self.assertEqual(alert.first_seen, 0)
+        self.assertTrue(alert.last_seen > 0)
+
+    def test_duplicate_notifications(self):
+        """
+        Same message returned twice is sent once
+        """
+        message1 = Message('Service 1', 'Message 1', Message.ERROR)
+
+        notifications_to_send = \
+            self.services_monitoring.manage_notifications([message1, message1])
+
+        self.assertTrue(notifications_to_send == [message1])
@@ -0,0 +1,125 @@
+# Author: FL42
+
+"""
+Tests for the process pool offload
+"""
+
+import hashlib
+import re
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import OpenSSL.crypto
+
+from src.tools import TLSA, offload
+from src.tools.offload import Offloader, regex_search
+from src.tools.tlsa import hash_cache, hash_certificate
+from tests.helpers import make_certificate
+
+
+class TestOffload(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cert, _ = make_certificate()
+        cls.der = OpenSSL.crypto.dump_certificate(
+            OpenSSL.crypto.FILETYPE_ASN1, cls.cert
+        )
+        public_key = OpenSSL.crypto.dump_publickey(
+            OpenSSL.crypto.FILETYPE_ASN1, cls.cert.get_pubkey()
+        )
+        cls.expected = {
+            (0, 1): hashlib.sha256(cls.der).hexdigest(),
+            (0, 2): hashlib.sha1(cls.der).hexdigest(),
+            (1, 1): hashlib.sha256(public_key).hexdigest(),
+            (1, 2): hashlib.sha1(public_key).hexdigest()
+        }
+
+    def test_hash_certificate(self):
+        """
+        Digests match OpenSSL dumps of the certificate and public key
+        """
+        for (selector, matching_type), digest in self.expected.items():
+            self.assertEqual(
+                hash_certificate(memoryview(self.der), selector,
+                                 matching_type),
+                digest
+            )
+
+    def test_inline(self):
+        """
+        Without process pool, functions run in the calling thread
+        """
+        self.assertIsNone(offload._offloader)  # pylint: disable=W0212
+        self.assertTrue(
+            offload.run(regex_search, re.compile('b+'), 'abbc')
+        )
+
+    def test_pool(self):
+        """
+        Calls of many threads are batched, bytes go through shared memory
+        and exceptions are raised in the calling thread
+        """
+        offloader = Offloader(workers=2, batch_size=16, batch_delay=0.05)
+        cases = list(self.expected.items()) * 10
+        try:
+            with mock.patch.object(offload.offload_batch_size,
+                                   'observe') as observe, \
+                    ThreadPoolExecutor(len(cases)) as executor:
+                futures = [
+                    executor.submit(
+                        lambda args: offloader.submit(
+                            hash_certificate, args
+                        ).result(timeout=30),
+                        (self.der,) + key
+                    )
+                    for key, _ in cases
+                ]
+                results = [future.result() for future in futures]
+            self.assertEqual(results, [digest for _, digest in cases])
+            sizes = [call.args[0] for call in observe.call_args_list]
+            self.assertEqual(sum(sizes), len(cases))
+            self.assertLess(len(sizes), len(cases))
+
+            with self.assertRaises(KeyError):
+                offloader.submit(hash_certificate, (self.der, 0, 3)) \
+                    .result(timeout=30)
+            self.assertFalse(offloader.submit(
+                regex_search, (re.compile('^x'), 'abc')
+            ).result(timeout=30))
+        finally:
+            offloader.shutdown()
+
+    def test_tlsa(self):
+        """
+        TLSA hashes are the same inline and in the pool (selectors 0 and 1,
+        matching types 1 and 2)
+        """
+
+        def hashes():
+            """
+            Return hashes of self.cert for the keys of self.expected
+            """
+            hash_cache.clear()
+            return {
+                key: TLSA('test')._get_hash(  # pylint: disable=W0212
+                    self.cert, *key
+                )
+                for key in self.expected
+            }
+
+        self.assertEqual(hashes(), self.expected)
+        offload.configure({'workers': 1})
+        try:
+            self.assertEqual(hashes(), self.expected)
+        finally:
+            offload.shutdown()
+        self.assertIsNone(offload._offloader)  # pylint: disable=W0212
+
+
+if __name__ == '__main__':
+    unittest.main()
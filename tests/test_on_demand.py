@@ -0,0 +1,135 @@
+# Author: FL42
+
+"""
+Tests for on-demand probes and the HTTP server
+"""
+
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from time import sleep
+from unittest import mock
+
+from src.monitoring import ServicesMonitoring
+from src.tools import Message, http_server
+from src.tools.cache import SingleFlight
+from src.tools.on_demand import OnDemandProber
+
+
+class TestOnDemandProber(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def setUp(self):
+        self.probe_module = mock.Mock()
+        self.probe_module.test.return_value = []
+        self.prober = OnDemandProber({
+            'raw_tcp': {'module': self.probe_module, 'target_type': 'host'},
+            'ping': {'module': self.probe_module, 'target_type': None}
+        })
+
+    def test_service(self):
+        """
+        Query parameters are parsed as service options
+        """
+        status_code, _, body = self.prober.handle({
+            'module': 'raw_tcp', 'target': 'localhost', 'port': '22'
+        })
+        self.assertEqual(status_code, 200)
+        self.probe_module.test.assert_called_once_with(
+            {'host': 'localhost', 'port': 22}
+        )
+        self.assertIn(b'probe_success 1.0', body)
+
+        self.prober.handle({'module': 'ping', 'target': 'localhost'})
+        self.probe_module.test.assert_called_with('localhost')
+
+    def test_failure(self):
+        """
+        Messages are returned
+        """
+        self.probe_module.test.return_value = [
+            Message('[ping] localhost', 'Host is not reachable', Message.ERROR)
+        ]
+        _, _, body = self.prober.handle({'module': 'ping', 'target': 'host'})
+        self.assertIn(b'probe_success 0.0', body)
+        self.assertIn(
+            b'probe_message{body="Host is not reachable",'
+            b'severity="ERROR"} 1.0',
+            body
+        )
+
+    def test_invalid_module(self):
+        """
+        Unknown module
+        """
+        status_code, _, _ = self.prober.handle({'module': 'x', 'target': 'y'})
+        self.assertEqual(status_code, 400)
+
+    def test_invalid_options(self):
+        """
+        Options are validated
+        """
+        prober = OnDemandProber(ServicesMonitoring.probe_mapping)
+        status_code, _, body = prober.handle({
+            'module': 'raw_tcp', 'target': 'localhost', 'port': 'ssh'
+        })
+        self.assertEqual(status_code, 400)
+        self.assertIn(b'port must be int', body)
+
+    def test_cache(self):
+        """
+        Result is cached
+        """
+        for _ in range(3):
+            self.prober.handle({'module': 'ping', 'target': 'localhost'})
+        self.assertEqual(self.probe_module.test.call_count, 1)
+
+    def test_single_flight(self):
+        """
+        Concurrent calls share one run
+        """
+        single_flight = SingleFlight()
+        calls = []
+
+        def function():
+            calls.append(1)
+            sleep(0.2)
+            return 'result'
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(
+                    single_flight.do('key', function)
+                )
+            )
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ['result'] * 5)
+
+    def test_http_server(self):
+        """
+        /metrics and /probe are served
+        """
+        http_server.register('/probe', self.prober.handle)
+        server = http_server.start(0, '127.0.0.1')
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertIn(b'cache_hits_total', response.read())
+            with urllib.request.urlopen(
+                    url + '/probe?module=ping&target=localhost') as response:
+                self.assertIn(b'probe_success 1.0', response.read())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '/unknown')
+        finally:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,75 @@
+# Author: FL42
+
+"""
+Tests for on-demand profiling
+"""
+
+import json
+import os
+import tempfile
+import unittest
+from time import sleep
+
+from src.probes import raw_tcp
+from src.tools import profiling
+
+
+class TestProfiler(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiler = profiling.Profiler(
+            output_directory=self.directory.name,
+            sample_interval=0.001
+        )
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_off(self):
+        """
+        No-op while profiling is off
+        """
+        self.assertIs(
+            self.profiler.probe('raw_tcp'),
+            profiling.NULL_CONTEXT
+        )
+
+    def test_cycles(self):
+        """
+        Profile one cycle
+        """
+        self.assertTrue(self.profiler.start(cycles=1))
+        self.assertFalse(self.profiler.start(cycles=1))
+        for _ in range(20):
+            with self.profiler.probe('raw_tcp'):
+                raw_tcp.test({'host': '127.0.0.1', 'port': 1})
+            sleep(0.001)
+        self.profiler.cycle_done()
+        self.profiler._thread.join(10)  # pylint: disable=protected-access
+
+        directory = self.profiler.last_report
+        self.assertTrue(os.path.isfile(os.path.join(directory, 'report.txt')))
+        self.assertTrue(
+            os.path.isfile(os.path.join(directory, 'raw_tcp.pstats'))
+        )
+        report_path = os.path.join(directory, 'report.txt')
+        with open(report_path, encoding='utf-8') as report_file:
+            report = report_file.read()
+        self.assertIn('===== raw_tcp =====', report)
+        self.assertIn('raw_tcp.py', report)
+        self.assertTrue(
+            os.path.isfile(os.path.join(directory, 'stacks.folded'))
+        )
+
+    def test_handle(self):
+        """
+        HTTP handler
+        """
+        self.assertEqual(profiling.handle({'seconds': 'x'})[0], 400)
+        status_code, _, body = profiling.handle({})
+        self.assertEqual(status_code, 200)
+        self.assertFalse(json.loads(body)['active'])
@@ -0,0 +1,158 @@
+# Author: FL42
+
+"""
+Tests for sharding of targets
+"""
+
+import json
+import multiprocessing
+import os
+import unittest
+from unittest import mock
+
+from src.monitoring import ServicesMonitoring
+from src.tools import AlertState, Message, sharding
+from src.tools.sharding import Shard
+
+TARGETS = [
+    ('https', 'https://host{}.example.com/'.format(index))
+    for index in range(3000)
+]
+
+
+def owned_targets(shard_index, shard_count):
+    """
+    Return the targets owned by a shard (run in a child process)
+    """
+    shard = Shard(shard_index, shard_count)
+    return {target for target in TARGETS if shard.owns(*target)}
+
+
+def assign(shard_count):
+    """
+    Return the list of owned targets of each shard (one process per shard)
+    """
+    with multiprocessing.Pool(shard_count) as pool:
+        return pool.starmap(
+            owned_targets,
+            [(index, shard_count) for index in range(shard_count)]
+        )
+
+
+class TestSharding(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def test_shards(self):
+        """
+        Shards of separate processes never overlap, cover all targets,
+        are balanced and adding a shard only moves about 1/N of targets
+        """
+        before = assign(3)
+        self.assertEqual(sum(len(owned) for owned in before), len(TARGETS))
+        self.assertEqual(set().union(*before), set(TARGETS))
+        for owned in before:
+            self.assertGreater(len(owned), len(TARGETS) / 3 * 0.7)
+
+        after = assign(4)
+        self.assertEqual(sum(len(owned) for owned in after), len(TARGETS))
+        moved = len(TARGETS) - sum(
+            len(before[index] & after[index]) for index in range(3)
+        )
+        # Moved targets all go to the new shard
+        self.assertEqual(moved, len(after[3]))
+        self.assertLess(moved, len(TARGETS) / 4 * 1.3)
+
+    def test_invalid(self):
+        """
+        shard_index must be lower than shard_count
+        """
+        with self.assertRaises(ValueError):
+            Shard(3, 3)
+
+    def test_get_shard(self):
+        """
+        Environment overrides config, first call wins
+        """
+        with mock.patch.object(sharding, '_shard', None), \
+                mock.patch.dict(os.environ, {'SHARD_INDEX': '1'}):
+            self.assertEqual(sharding.handle({})[0], 404)
+            shard = sharding.get_shard({'shard_index': 0, 'shard_count': 2})
+            self.assertEqual((shard.shard_index, shard.shard_count), (1, 2))
+            self.assertIs(sharding.get_shard(), shard)
+
+            shard.publish('config.yaml', [('ping', '127.0.0.1')])
+            status_code, _, body = sharding.handle({})
+            self.assertEqual(status_code, 200)
+            self.assertEqual(
+                json.loads(body)['targets'],
+                {'config.yaml': [['ping', '127.0.0.1']]}
+            )
+
+        with mock.patch.object(sharding, '_shard', None):
+            self.assertIsNone(sharding.get_shard())
+
+    def test_monitor(self):
+        """
+        Only owned targets are probed
+        """
+        shard = Shard(0, 2)
+        hosts = ['host{}.invalid'.format(index) for index in range(20)]
+        services_monitoring = ServicesMonitoring('config.yaml')
+        services_monitoring.config = {'probes': {'raw_tcp': [
+            {'host': host, 'port': 1, 'timeout': 0.1} for host in hosts
+        ]}}
+        services_monitoring.shard = shard
+        with mock.patch('src.probes.raw_tcp.test', return_value=[]):
+            services_monitoring.monitor(send_notification=False)
+        expected = [
+            ('raw_tcp', '{}:1'.format(host)) for host in hosts
+            if shard.owns('raw_tcp', '{}:1'.format(host))
+        ]
+        self.assertTrue(0 < len(expected) < len(hosts))
+        self.assertEqual(list(services_monitoring.last_results), expected)
+        self.assertEqual(shard.owned['config.yaml'], expected)
+
+    def test_not_owned(self):
+        """
+        State of targets owned by another shard is dropped without
+        notification (their new owner notifies)
+        """
+        hosts = ['host{}.invalid'.format(index) for index in range(20)]
+        services_monitoring = ServicesMonitoring('config.yaml')
+        services_monitoring.config = {'probes': {'raw_tcp': [
+            {'host': host, 'port': 1, 'timeout': 0.1} for host in hosts
+        ]}}
+        services_monitoring.shard = Shard(0, 1)
+        with mock.patch('src.probes.raw_tcp.test', return_value=[]):
+            services_monitoring.monitor(send_notification=False)
+        self.assertEqual(len(services_monitoring.last_results), 20)
+        for host in hosts:
+            message = Message('[raw_tcp] {}:1'.format(host), 'Timeout',
+                              Message.ERROR)
+            services_monitoring.down_services[message.key] = \
+                AlertState(message, 0)
+
+        shard = Shard(0, 2)
+        services_monitoring.shard = shard
+        with mock.patch('src.probes.raw_tcp.test', return_value=[]):
+            services_monitoring.monitor(send_notification=False)
+        self.assertEqual(
+            list(services_monitoring.last_results), shard.owned['config.yaml']
+        )
+        self.assertEqual(
+            [alert.message.service
+             for alert in services_monitoring.down_services.values()],
+            ['[raw_tcp] {}'.format(target)
+             for _, target in shard.owned['config.yaml']]
+        )
+        # Owned targets are back online, others are not
+        self.assertEqual(
+            len(services_monitoring.manage_notifications([])),
+            len(shard.owned['config.yaml'])
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+# Author: FL42
+
+"""
+Tests for result sinks
+"""
+
+import json
+import os
+import socket
+import tempfile
+import unittest
+
+from src.sinks.jsonl import JSONLinesSink
+from src.sinks.pipeline import ResultPipeline, make_record
+from src.sinks.unix_socket import UnixSocketSink
+from src.tools import Message
+
+
+class TestSinks(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'results.jsonl')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_record(self):
+        """
+        Should work
+        """
+        record = make_record(
+            'https', 'https://example.com', False, 0.5,
+            [Message('https://example.com', 'Timeout', Message.ERROR)],
+            cycle_id='abc'
+        )
+        self.assertEqual(record['status'], 'down')
+        self.assertEqual(record['cycle_id'], 'abc')
+        self.assertEqual(record['messages'][0]['severity'], 'ERROR')
+
+    def test_jsonl_rotation(self):
+        """
+        File is rotated when it exceeds max_bytes
+        """
+        sink = JSONLinesSink(self.path, max_bytes=100, backup_count=2)
+        for index in range(5):
+            sink.write([{'index': index, 'padding': 'x' * 100}])
+        sink.close()
+
+        self.assertFalse(os.path.exists(self.path))
+        self.assertTrue(os.path.exists(self.path + '.2'))
+        self.assertFalse(os.path.exists(self.path + '.3'))
+        with open(self.path + '.1', encoding='utf-8') as rotated_file:
+            self.assertEqual(json.loads(rotated_file.read())['index'], 4)
+
+    def test_unix_socket(self):
+        """
+        Records are streamed to the consumer
+        """
+        socket_path = os.path.join(self.directory.name, 'results.sock')
+        sink = UnixSocketSink(socket_path)
+        with self.assertRaises(OSError):
+            sink.write([{'index': 0}])
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(socket_path)
+            server.listen(1)
+            sink.write([{'index': 1}, {'index': 2}])
+            connection, _ = server.accept()
+            with connection, connection.makefile('r') as stream:
+                self.assertEqual(json.loads(stream.readline())['index'], 1)
+                self.assertEqual(json.loads(stream.readline())['index'], 2)
+        sink.close()
+
+    def test_pipeline(self):
+        """
+        Records are written in batches and flushed on stop
+        """
+        pipeline = ResultPipeline.from_config({
+            'sinks': [{'type': 'jsonl', 'path': self.path}],
+            'batch_size': 10,
+            'flush_interval': 0.1
+        })
+        pipeline.start()
+        for index in range(25):
+            self.assertTrue(pipeline.emit({'index': index}))
+        pipeline.stop()
+        pipeline.join(5)
+
+        with open(self.path, encoding='utf-8') as result_file:
+            indexes = [json.loads(line)['index'] for line in result_file]
+        self.assertEqual(indexes, list(range(25)))
+
+    def test_failing_sink(self):
+        """
+        An error of a sink doesn't prevent writing to other sinks
+        """
+
+        class FailingSink:
+            """
+            Sink raising an unexpected error
+            """
+
+            def write(self, records):
+                """
+                Fail
+                """
+                raise ValueError(records)
+
+            def close(self):
+                """
+                Nothing to close
+                """
+
+        sink = JSONLinesSink(self.path)
+        pipeline = ResultPipeline([FailingSink(), sink])
+        pipeline._write([{'index': 0}])  # pylint: disable=protected-access
+        sink.close()
+        with open(self.path, encoding='utf-8') as result_file:
+            self.assertEqual(json.loads(result_file.read())['index'], 0)
+
+    def test_invalid_sink(self):
+        """
+        Unknown sink type
+        """
+        with self.assertRaises(ValueError):
+            ResultPipeline.from_config({'sinks': [{'type': 'unknown'}]})
@@ -0,0 +1,134 @@
+# Author: FL42
+
+"""
+Tests for config compilation
+"""
+
+import unittest
+from types import SimpleNamespace
+
+from src.monitoring import ServicesMonitoring
+from src.probes import dns, https, ping, raw_tcp
+from src.tools.spec import ConfigError, compile_probes
+
+
+class TestSpec(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def test_defaults(self):
+        """
+        Defaults are resolved and derived values computed
+        """
+        spec = https.Spec({
+            'url': 'https://example.com:8443/path',
+            'headers': {'X-Test': '1'},
+            'pattern': 'Example'
+        })
+        self.assertTrue(spec.verify_certificate)
+        self.assertEqual(
+            spec.service_name,
+            '[https] https://example.com:8443/path'
+        )
+        self.assertEqual(spec.tls_endpoint, 'example.com:8443')
+        self.assertEqual(
+            dict(spec.request_headers),
+            {'user-agent': 'services-monitoring/v1', 'X-Test': '1'}
+        )
+        self.assertTrue(spec.regex.search('An Example page'))
+        self.assertEqual(spec.target, 'https://example.com:8443/path')
+
+        spec = https.Spec({'url': 'http://example.com'})
+        self.assertIsNone(spec.tls_host)
+
+    def test_immutable(self):
+        """
+        Specs can't be modified
+        """
+        spec = raw_tcp.Spec({'host': 'localhost', 'port': 22})
+        with self.assertRaises(AttributeError):
+            spec.port = 23
+        with self.assertRaises(AttributeError):
+            spec.other = 1
+        spec = dns.Spec({'domain': 'example.com', 'ns_IPs': ['127.0.0.1']})
+        self.assertEqual(spec.ns_IPs, ('127.0.0.1',))
+
+    def test_string(self):
+        """
+        Ping services are strings
+        """
+        spec = ping.Spec('127.0.0.1')
+        self.assertEqual(spec.target, '127.0.0.1')
+        self.assertEqual(spec.service_name, '[ping] 127.0.0.1')
+
+    def test_errors(self):
+        """
+        All errors are reported
+        """
+        with self.assertRaises(ConfigError) as context:
+            compile_probes(
+                {
+                    'raw_tcp': [
+                        {'host': 'localhost', 'port': 22},
+                        {'host': 'localhost', 'port': '22', 'timout': 1},
+                        {'port': 22}
+                    ],
+                    'https': [{'url': 'https://example.com', 'pattern': '('}],
+                    'dns': [{'domain': 'example.com', 'dnssec': 1}],
+                    'unknown': []
+                },
+                ServicesMonitoring.probe_mapping
+            )
+        self.assertEqual(len(context.exception.errors), 6)
+        self.assertIn(
+            'probes.raw_tcp[1]: unknown option timout',
+            context.exception.errors
+        )
+        self.assertIn(
+            'probes.raw_tcp[2]: missing option host',
+            context.exception.errors
+        )
+
+    def test_spec_exceptions(self):
+        """
+        Any exception of a Spec is reported with the other errors
+        """
+        def broken_spec(service, path):
+            raise ValueError("broken {}".format(service))
+
+        probe_mapping = dict(ServicesMonitoring.probe_mapping)
+        probe_mapping['broken'] = {
+            'module': SimpleNamespace(Spec=broken_spec)
+        }
+        with self.assertRaises(ConfigError) as context:
+            compile_probes(
+                {
+                    'https': [{'url': 'https://bad host/'}, {'url': 5}],
+                    'raw_tcp': [{'host': 'x'}],
+                    'broken': ['service']
+                },
+                probe_mapping
+            )
+        errors = context.exception.errors
+        self.assertEqual(len(errors), 4)
+        self.assertTrue(
+            errors[0].startswith('probes.https[0]: invalid url: ')
+        )
+        self.assertTrue(errors[1].startswith('probes.https[1]: url must be'))
+        self.assertEqual(errors[2], 'probes.raw_tcp[0]: missing option port')
+        self.assertEqual(errors[3], 'probes.broken[0]: broken service')
+
+    def test_compile(self):
+        """
+        Should work
+        """
+        specs = compile_probes(
+            {'ping': ['127.0.0.1'], 'smtp': [{'host': 'mail.example.com'}]},
+            ServicesMonitoring.probe_mapping
+        )
+        self.assertEqual(
+            [(probe_name, spec.target) for probe_name, _, spec in specs],
+            [('ping', '127.0.0.1'), ('smtp', 'mail.example.com:25')]
+        )
+        self.assertEqual(specs[1][2].port, 25)
@@ -0,0 +1,148 @@
+# Author: FL42
+
+"""
+Tests for the state store
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from prometheus_client import REGISTRY
+
+from src.monitoring import ServicesMonitoring
+from src.tools import AlertState, Message, metrics
+from src.tools.flapping import FlapDetector
+from src.tools.state_store import StateStore
+
+
+class TestStateStore(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'state.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        """
+        Saved state is loaded back
+        """
+        message = Message('Service 1', 'Message 1', Message.ERROR)
+        store = StateStore(self.path, 'config.yaml')
+        store.save(
+            {message.key: AlertState(message, 10, 20)},
+            {('ping', 'localhost'): (False, 0.5, 20)}
+        )
+        store.close()
+
+        store = StateStore(self.path, 'config.yaml')
+        alerts = store.load_alerts()
+        self.assertEqual(list(alerts), [message.key])
+        self.assertEqual(alerts[message.key].message, message)
+        self.assertEqual(alerts[message.key].first_seen, 10)
+        self.assertEqual(alerts[message.key].last_seen, 20)
+        self.assertEqual(
+            store.load_results(),
+            {('ping', 'localhost'): (False, 0.5, 20)}
+        )
+        store.close()
+
+    def test_results_pruned(self):
+        """
+        Results of targets which are gone are not restored
+        """
+        store = StateStore(self.path, 'config.yaml')
+        store.save({}, {('ping', 'a'): (True, 0.1, 10),
+                        ('ping', 'b'): (False, 0.2, 10)})
+        store.save({}, {('ping', 'a'): (True, 0.3, 20)})
+        self.assertEqual(
+            store.load_results(), {('ping', 'a'): (True, 0.3, 20)}
+        )
+        store.close()
+
+    def test_results_exported(self):
+        """
+        Restored results are exported before targets are probed again
+        """
+        metrics.restore({('ping', 'restored.example.com'): (False, 0.5, 20)})
+        self.assertEqual(
+            REGISTRY.get_sample_value('probe_up', {
+                'probe': 'ping', 'target': 'restored.example.com'
+            }),
+            0
+        )
+
+    def test_configs_isolated(self):
+        """
+        Each config only sees its own state and saving replaces alerts
+        """
+        message = Message('Service 1', 'Message 1', Message.ERROR)
+        store1 = StateStore(self.path, 'config1.yaml')
+        store2 = StateStore(self.path, 'config2.yaml')
+        store1.save({message.key: AlertState(message, 10)}, {})
+        self.assertEqual(store2.load_alerts(), {})
+        store1.save({}, {})
+        self.assertEqual(store1.load_alerts(), {})
+        store1.close()
+        store2.close()
+
+    def test_no_duplicate_after_restart(self):
+        """
+        Service still down after restart is not notified again
+        """
+        message = Message('Service 1', 'Message 1', Message.ERROR)
+        store = StateStore(self.path, 'unittest')
+        store.save({message.key: AlertState(message, 10)}, {})
+
+        services_monitoring = ServicesMonitoring('unittest')
+        services_monitoring.down_services = store.load_alerts()
+        store.close()
+        self.assertEqual(
+            services_monitoring.manage_notifications([message]), []
+        )
+
+    def test_damping_after_restart(self):
+        """
+        Target down before restart is neither back online nor notified
+        again while it is still down
+        """
+        message = Message('[raw_tcp] host:22', 'Connection refused',
+                          Message.ERROR)
+        store = StateStore(self.path, 'unittest')
+        store.save({message.key: AlertState(message, 10)}, {})
+
+        services_monitoring = ServicesMonitoring('unittest')
+        services_monitoring.config = {'probes': {'raw_tcp': [
+            {'host': 'host', 'port': 22}
+        ]}}
+        services_monitoring.flap_detector = FlapDetector(failure_threshold=3)
+        services_monitoring.down_services = store.load_alerts()
+        store.close()
+        services_monitoring.flap_detector.restore(
+            services_monitoring.down_services
+        )
+
+        sent = []
+        with mock.patch.object(
+                services_monitoring, 'send_notification',
+                side_effect=lambda notifications: sent.append(
+                    services_monitoring.manage_notifications(notifications)
+                )), \
+                mock.patch('src.monitoring.sleep'):
+            with mock.patch('src.probes.raw_tcp.test',
+                            return_value=[message]):
+                services_monitoring.monitor(send_notification=True)
+            with mock.patch('src.probes.raw_tcp.test', return_value=[]):
+                services_monitoring.monitor(send_notification=True)
+        self.assertEqual(sent[0], [])
+        self.assertEqual(
+            [(sent_message.service, sent_message.header)
+             for sent_message in sent[1]],
+            [('[raw_tcp] host:22', 'back online')]
+        )
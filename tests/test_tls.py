@@ -0,0 +1,123 @@
+"""
+Tests for the tls tool
+"""
+
+import socket
+import ssl
+import threading
+import unittest
+from time import monotonic
+
+from src.tools import tls
+from tests.helpers import make_certificate, make_server_context
+
+
+class TestTLSFetcher(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cert, key = make_certificate()
+        cls.context = make_server_context(cls.cert, key)
+
+    def setUp(self):
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(8)
+        self.port = self.server.getsockname()[1]
+        self.resumed = []
+
+    def tearDown(self):
+        self.server.close()
+
+    def _serve(self, count, contexts=None):
+        """
+        Accept count TLS connections (with the next of contexts if given)
+        """
+        for index in range(count):
+            context = self.context if contexts is None else contexts[index]
+            connection, _ = self.server.accept()
+            try:
+                with context.wrap_socket(
+                        connection, server_side=True) as tls_connection:
+                    self.resumed.append(tls_connection.session_reused)
+                    tls_connection.recv(1)
+            except (OSError, ValueError):
+                pass
+
+    def test_fetch(self):
+        """
+        Certificate is fetched and handshake duration reported
+        """
+        thread = threading.Thread(target=self._serve, args=(1,))
+        thread.start()
+        result = tls.TLSFetcher().fetch('127.0.0.1', self.port)
+        thread.join()
+        self.assertEqual(
+            result.cert.digest('sha256'),
+            self.cert.digest('sha256')
+        )
+        self.assertGreater(result.duration, 0)
+        self.assertEqual(result.protocol, 'TLSv1.3')
+
+    def test_session_resumption(self):
+        """
+        Second handshake resumes the session of the first one
+        """
+        thread = threading.Thread(target=self._serve, args=(2,))
+        thread.start()
+        fetcher = tls.TLSFetcher()
+        fetcher.fetch('localhost', self.port)
+        fetcher.fetch('localhost', self.port)
+        thread.join()
+        self.assertEqual(self.resumed, [False, True])
+
+    def test_handshake_timeout(self):
+        """
+        A host accepting TCP connections but never answering
+        must not hang the caller
+        """
+        start_time = monotonic()
+        with self.assertRaises(socket.timeout):
+            tls.TLSFetcher(handshake_timeout=0.5).fetch(
+                '127.0.0.1', self.port
+            )
+        self.assertLess(monotonic() - start_time, 2)
+
+    def test_tls12_no_ticket_wait(self):
+        """
+        No wait for session tickets on TLS 1.2 connections
+        """
+        self.context.maximum_version = ssl.TLSVersion.TLSv1_2
+        try:
+            thread = threading.Thread(target=self._serve, args=(1,))
+            thread.start()
+            start_time = monotonic()
+            result = tls.TLSFetcher().fetch('127.0.0.1', self.port)
+            elapsed = monotonic() - start_time
+            thread.join()
+        finally:
+            self.context.maximum_version = ssl.TLSVersion.MAXIMUM_SUPPORTED
+        self.assertEqual(result.protocol, 'TLSv1.2')
+        self.assertLess(elapsed, 0.2)
+
+    def test_renewed_certificate(self):
+        """
+        Certificate checks see a renewed certificate (no resumption)
+        """
+        renewed_cert, key = make_certificate()
+        thread = threading.Thread(target=self._serve, args=(2, [
+            self.context, make_server_context(renewed_cert, key)
+        ]))
+        thread.start()
+        fetcher = tls.TLSFetcher()
+        fetcher.fetch('localhost', self.port)
+        result = fetcher.fetch('localhost', self.port, resume=False)
+        thread.join()
+        self.assertEqual(self.resumed, [False, False])
+        self.assertEqual(
+            result.cert.digest('sha256'),
+            renewed_cert.digest('sha256')
+        )
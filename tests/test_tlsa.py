@@ -2,9 +2,14 @@
 Tests for the tlsa tool
 """
 
+import hashlib
 import unittest
+from unittest import mock
 
-from src.tools import TLSA, tls
+import OpenSSL.crypto
+
+from src.tools import TLSA, tls, tlsa
+from tests.helpers import make_certificate
 
 
 class TestTLSA(unittest.TestCase):
@@ -87,3 +92,60 @@ class TestTLSA(unittest.TestCase):
         results = tlsa_checker.check_tlsa(hostname, 443, cert)
 
         self.assertTrue(len(results) > 0)
+
+
+class TestTLSAMocked(unittest.TestCase):
+    """
+    Tests for the tlsa tool with a mocked DNS resolver
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cert, _ = make_certificate()
+
+    def setUp(self):
+        tlsa.records_cache.clear()
+        tlsa.hash_cache.clear()
+        tlsa.verdict_cache.clear()
+
+    def _check(self, records):
+        """
+        Check self.cert against the given TLSA records
+        """
+        rrset = mock.Mock(ttl=300)
+        rrset.items = [mock.Mock(**{'to_text.return_value': record})
+                       for record in records]
+        answer = mock.Mock()
+        answer.response.answer = [rrset]
+        with mock.patch('dns.resolver.query', return_value=answer) as query:
+            results = TLSA("test").check_tlsa('localhost', 443, self.cert)
+        return results, query
+
+    def test_good_tlsa(self):
+        """
+        Good TLSA (cert matching)
+        """
+        digest = hashlib.sha256(OpenSSL.crypto.dump_certificate(
+            OpenSSL.crypto.FILETYPE_ASN1, self.cert
+        )).hexdigest()
+        results, _ = self._check(['3 0 1 {}'.format(digest)])
+        self.assertEqual(len(results), 0)
+
+    def test_bad_hash_tlsa(self):
+        """
+        Bad TLSA (bad hash)
+        """
+        results, _ = self._check(['3 1 1 {}'.format('00' * 32)])
+        self.assertEqual(len(results), 1)
+
+    def test_cached_verdict(self):
+        """
+        Records and verdict must be reused on the second check
+        """
+        self._check(['3 1 1 {}'.format('00' * 32)])
+        with mock.patch.object(TLSA, '_get_hash') as get_hash:
+            results, query = self._check(['3 1 1 {}'.format('00' * 32)])
+            get_hash.assert_not_called()
+        query.assert_not_called()
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].service, "test")
@@ -0,0 +1,227 @@
+# Author: FL42
+
+"""
+Tests for vantage agents and the aggregator
+"""
+
+import io
+import multiprocessing
+import os
+import socket
+import tempfile
+import unittest
+from time import sleep, time
+from unittest import mock
+
+import yaml
+
+from src.monitoring import ServicesMonitoring
+from src.sinks.pipeline import ResultPipeline
+from src.tools import Message, framing
+from src.tools.spec import compile_probes
+from src.tools.vantage import VantageAggregator
+
+
+def run_agent(agent, address, port, down, secret=None):
+    """
+    Child process: probe 127.0.0.1 on port once and send the result
+    (the agent sees the port closed if down)
+    """
+    services_monitoring = ServicesMonitoring(agent)
+    services_monitoring.config = {
+        'common': {'delay': 0},
+        'probes': {'raw_tcp': [
+            {'host': '127.0.0.1', 'port': port, 'timeout': 1}
+        ]}
+    }
+    services_monitoring.pipeline = ResultPipeline.from_config({
+        'flush_interval': 0.05,
+        'sinks': [{'type': 'aggregator', 'address': address,
+                   'agent': agent, 'secret': secret}]
+    })
+    services_monitoring.pipeline.start()
+    if down:
+        with mock.patch('src.probes.raw_tcp.test', return_value=[Message(
+                '[raw_tcp] 127.0.0.1:{}'.format(port), 'Connection refused',
+                Message.ERROR)]):
+            services_monitoring.monitor(send_notification=False)
+    else:
+        services_monitoring.monitor(send_notification=False)
+    services_monitoring.pipeline.stop()
+    services_monitoring.pipeline.join(5)
+
+
+def wait_for_reports(aggregator, count, timeout=30):
+    """
+    Wait until the aggregator received count reports
+    """
+    deadline = time() + timeout
+    while time() < deadline:
+        if sum(len(agents) for agents in aggregator.reports.values()) \
+                >= count:
+            return
+        sleep(0.05)
+
+
+class TestVantage(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def test_framing(self):
+        """
+        Frames are decoded, large ones compressed, invalid ones rejected
+        """
+        small = {'agent': 'a', 'records': []}
+        large = {'agent': 'a', 'records': [{'target': 'x' * 10}] * 500}
+        stream = io.BytesIO(framing.encode(small) + framing.encode(large))
+        self.assertEqual(framing.read_frame(stream), small)
+        self.assertEqual(framing.read_frame(stream), large)
+        self.assertIsNone(framing.read_frame(stream))
+        self.assertLess(len(framing.encode(large)), 1000)
+
+        with self.assertRaises(ValueError):
+            framing.read_frame(io.BytesIO(framing.encode(small)[:-1]))
+        with self.assertRaises(ValueError):
+            framing.read_frame(io.BytesIO(
+                framing.HEADER.pack(framing.MAX_FRAME_SIZE + 1, 0)
+            ))
+
+        # Signed frames
+        signed = framing.encode(small, 'secret')
+        self.assertEqual(
+            framing.read_frame(io.BytesIO(signed), 'secret'), small
+        )
+        for frame, secret in ((signed, 'other'), (signed, None),
+                              (framing.encode(small), 'secret'),
+                              (signed[:-1], 'secret')):
+            with self.assertRaises(ValueError):
+                framing.read_frame(io.BytesIO(frame), secret)
+
+        self.assertEqual(
+            framing.parse_address('[::1]:9100'),
+            (socket.AF_INET6, ('::1', 9100))
+        )
+
+    def test_quorum(self):
+        """
+        A target is down only if a quorum of fresh agents sees it down
+        """
+        aggregator = VantageAggregator('127.0.0.1:0', max_age=60)
+        down = {'probe': 'ping', 'target': 'example.com', 'status': 'down',
+                'latency_seconds': 1, 'messages': [{
+                    'service': '[ping] example.com', 'body': 'Timeout',
+                    'severity': 'ERROR'}]}
+        up = {'probe': 'ping', 'target': 'example.com', 'status': 'up',
+              'latency_seconds': 0.1, 'messages': []}
+        aggregator.receive('a', [down])
+        aggregator.receive('b', [up])
+        aggregator.receive('c', [up])
+        self.assertEqual(
+            aggregator.evaluate(), [('ping', 'example.com', [], 0.1)]
+        )
+
+        aggregator.receive('b', [down])
+        _, _, messages, _ = aggregator.evaluate()[0]
+        self.assertEqual(
+            messages,
+            [Message('[ping] example.com', 'Timeout', Message.ERROR,
+                     header='down from 2/3 vantage points')]
+        )
+
+        # Results of a and b expire
+        aggregator.receive('c', [up])
+        for agent in ('a', 'b'):
+            report = aggregator.reports[('ping', 'example.com')][agent]
+            aggregator.reports[('ping', 'example.com')][agent] = \
+                (report[0] - 120,) + report[1:]
+        self.assertEqual(aggregator.evaluate()[0][2], [])
+        self.assertEqual(aggregator.evaluate(time() + 120), [])
+
+    def test_examples(self):
+        """
+        Agent and aggregator examples are valid, agents don't notify
+        """
+        with open('example-agent.yaml', 'rt',
+                  encoding='utf-8') as config_file:
+            agent_config = yaml.safe_load(config_file)
+        with open('example-aggregator.yaml', 'rt',
+                  encoding='utf-8') as config_file:
+            aggregator_config = yaml.safe_load(config_file)
+        self.assertNotIn('notifications', agent_config)
+        compile_probes(agent_config['probes'],
+                       ServicesMonitoring.probe_mapping)
+        pipeline = ResultPipeline.from_config(agent_config['results'])
+        aggregator = VantageAggregator(**aggregator_config['aggregator'])
+        self.assertEqual(pipeline.sinks[0].secret, aggregator.secret)
+        self.assertEqual(VantageAggregator().listen, '127.0.0.1:9100')
+
+    def test_agents(self):
+        """
+        Agents in separate processes, over TCP and a Unix socket
+        """
+        with socket.socket() as server, tempfile.TemporaryDirectory() \
+                as directory:
+            server.bind(('127.0.0.1', 0))
+            server.listen(8)
+            port = server.getsockname()[1]
+            target = '127.0.0.1:{}'.format(port)
+
+            tcp_aggregator = VantageAggregator(
+                '127.0.0.1:0', quorum=2, secret='secret'
+            )
+            tcp_aggregator.start()
+            unix_aggregator = VantageAggregator(
+                os.path.join(directory, 'aggregator.sock')
+            )
+            unix_aggregator.start()
+            try:
+                tcp_address = '127.0.0.1:{}'.format(
+                    tcp_aggregator.address[1]
+                )
+                agents = [
+                    ('agent-1', tcp_address, port, True, 'secret'),
+                    ('agent-2', tcp_address, port, False, 'secret'),
+                    ('agent-3', tcp_address, port, False, 'secret'),
+                    ('agent-4', unix_aggregator.listen, port, True),
+                    # Rejected: not signed with the secret
+                    ('agent-5', tcp_address, port, True, 'other'),
+                    ('agent-6', tcp_address, port, True)
+                ]
+                processes = [
+                    multiprocessing.Process(target=run_agent, args=agent)
+                    for agent in agents
+                ]
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    process.join(30)
+                wait_for_reports(tcp_aggregator, 3)
+                wait_for_reports(unix_aggregator, 1)
+
+                # 1 of 3 agents sees the target down: no quorum
+                self.assertEqual(
+                    [(probe, target, messages) for probe, target, messages, _
+                     in tcp_aggregator.evaluate()],
+                    [('raw_tcp', target, [])]
+                )
+                _, _, messages, _ = unix_aggregator.evaluate()[0]
+                self.assertEqual(messages[0].header,
+                                 'down from 1/1 vantage points')
+
+                # The aggregator notifies (see ServicesMonitoring.monitor)
+                services_monitoring = ServicesMonitoring('aggregator')
+                services_monitoring.config = {'probes': {}}
+                services_monitoring.aggregator = unix_aggregator
+                services_monitoring.monitor(send_notification=False)
+                self.assertFalse(
+                    services_monitoring.last_results[
+                        ('raw_tcp', target)][0]
+                )
+            finally:
+                tcp_aggregator.shutdown()
+                unix_aggregator.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+# Author: FL42
+
+"""
+Tests for the webhook notification (against a local HTTP server)
+"""
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+
+import yaml
+
+from src.monitoring import ServicesMonitoring
+from src.notification import webhook
+from src.notification.webhook import WebhookNotifier, validate
+from src.tools import Message
+from src.tools.spec import ConfigError
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """
+    Record posted payloads, answer with the next status code of
+    server.status_codes (200 when empty)
+    """
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        Handle POST requests
+        """
+        payload = json.loads(
+            self.rfile.read(int(self.headers['Content-Length']))
+        )
+        status_code = self.server.status_codes.pop(0) \
+            if self.server.status_codes else 200
+        if status_code == 200:
+            self.server.payloads.append((monotonic(), payload))
+        self.send_response(status_code)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *_args):  # pylint: disable=arguments-differ
+        """
+        Silence logs
+        """
+
+
+def wait_for(condition, timeout=5):
+    """
+    Wait until condition() is True
+    """
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        sleep(0.01)
+    return False
+
+
+class TestWebhook(unittest.TestCase):
+    """
+    See module docstring
+    """
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), WebhookHandler)
+        self.server.payloads = []
+        self.server.status_codes = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/hook'.format(
+            self.server.server_address[1]
+        )
+        self.notifiers = []
+
+    def tearDown(self):
+        for notifier in self.notifiers:
+            notifier.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _notifier(self, **options):
+        """
+        Return a started notifier posting to the local server
+        """
+        notifier = WebhookNotifier(self.url, **options)
+        notifier.start()
+        self.notifiers.append(notifier)
+        return notifier
+
+    def test_batch(self):
+        """
+        Messages are posted in one request
+        """
+        notifier = self._notifier(batch_interval=0.2)
+        notifier.enqueue([
+            Message('Service {}'.format(i), 'Message', Message.ERROR)
+            for i in range(5)
+        ])
+        self.assertTrue(wait_for(lambda: self.server.payloads))
+        sleep(0.3)
+        self.assertEqual(len(self.server.payloads), 1)
+        payload = self.server.payloads[0][1]
+        self.assertEqual(len(payload['messages']), 5)
+        self.assertEqual(payload['messages'][0]['severity'], 'ERROR')
+
+    def test_slack_format(self):
+        """
+        Slack payload
+        """
+        notifier = self._notifier(format='slack', batch_interval=0)
+        notifier.enqueue([Message('Service', 'Message', Message.WARNING)])
+        self.assertTrue(wait_for(lambda: self.server.payloads))
+        self.assertEqual(
+            self.server.payloads[0][1],
+            {'text': "Monitoring alert!\nWARNING: Service: Message"}
+        )
+
+    def test_retry(self):
+        """
+        Failed request is retried
+        """
+        self.server.status_codes = [500, 429]
+        notifier = self._notifier(batch_interval=0, backoff=0.01,
+                                  rate_limit=100)
+        notifier.enqueue([Message('Service', 'Message', Message.ERROR)])
+        self.assertTrue(wait_for(lambda: self.server.payloads))
+
+    def test_rate_limit(self):
+        """
+        Requests are spaced according to rate limit
+        """
+        notifier = self._notifier(batch_size=1, batch_interval=0,
+                                  rate_limit=5)
+        notifier.enqueue([
+            Message('Service {}'.format(i), 'Message', Message.ERROR)
+            for i in range(3)
+        ])
+        self.assertTrue(wait_for(lambda: len(self.server.payloads) == 3))
+        times = [posted_at for posted_at, _ in self.server.payloads]
+        self.assertGreaterEqual(times[2] - times[0], 0.35)
+
+    def test_queue_full(self):
+        """
+        The oldest messages are dropped when the queue is full
+        """
+        notifier = WebhookNotifier(self.url, max_queue_size=2)
+        notifier.enqueue([
+            Message('Service {}'.format(i), 'Message', Message.ERROR)
+            for i in range(3)
+        ])
+        self.assertEqual(
+            [notifier.queue.get_nowait().service for _ in range(2)],
+            ['Service 1', 'Service 2']
+        )
+
+    def test_validate(self):
+        """
+        Invalid settings are reported at startup
+        """
+        self.assertEqual(validate({'url': self.url, 'format': 'slack'}), [])
+        self.assertEqual(len(validate({'format': 'teams', 'retry': 1})), 3)
+        self.assertEqual(
+            validate({'url': self.url, 'rate_limit': 0, 'batch_size': '10',
+                      'batch_interval': 0, 'backoff': True}),
+            [
+                "notifications/webhook: backoff must be a number >= 0 "
+                "(got True)",
+                "notifications/webhook: batch_size must be a positive "
+                "integer (got '10')",
+                "notifications/webhook: rate_limit must be a positive "
+                "number (got 0)"
+            ]
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            config_path = os.path.join(directory, 'config.yaml')
+            with open(config_path, 'wt', encoding='utf-8') as config_file:
+                yaml.safe_dump({
+                    'common': {},
+                    'probes': {},
+                    'notifications': {'webhook': [{'url': self.url,
+                                                   'format': 'teams'}]}
+                }, config_file)
+            with self.assertRaises(ConfigError) as context:
+                ServicesMonitoring(config_path).run()
+        self.assertEqual(len(context.exception.errors), 1)
+
+    def test_flush_on_stop(self):
+        """
+        Queued messages are posted when the notifier is stopped
+        """
+        notifier = self._notifier(batch_size=2, batch_interval=60)
+        notifier.enqueue([
+            Message('Service {}'.format(i), 'Message', Message.ERROR)
+            for i in range(5)
+        ])
+        start_time = monotonic()
+        notifier.stop()
+        self.assertLess(monotonic() - start_time, 5)
+        self.assertEqual(
+            [message['service'] for _, payload in self.server.payloads
+             for message in payload['messages']],
+            ['Service {}'.format(i) for i in range(5)]
+        )
+
+    def test_notifier_key(self):
+        """
+        Configs with another format or headers don't share a notifier
+        """
+        configs = [
+            {'url': self.url},
+            {'url': self.url, 'format': 'json', 'batch_size': 5},
+            {'url': self.url, 'format': 'slack'},
+            {'url': self.url, 'headers': {'Authorization': 'token'}}
+        ]
+        try:
+            notifiers = [webhook.get_notifier(config) for config in configs]
+            self.assertIs(notifiers[0], notifiers[1])
+            self.assertEqual(len({id(notifier) for notifier in notifiers}),
+                             3)
+            self.assertEqual(notifiers[2].format_function,
+                             webhook.format_slack)
+        finally:
+            webhook.shutdown()
+            webhook._notifiers.clear()  # pylint: disable=protected-access